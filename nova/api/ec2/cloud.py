@@ -960,18 +960,26 @@ class CloudController(object):
                 'status': volume['attach_status'],
                 'volumeId': ec2utils.id_to_ec2_vol_id(volume_id)}
 
-    def _format_kernel_id(self, context, instance_ref, result, key):
+    def _format_kernel_id(self, context, instance_ref, result, key,
+                          image_ids=None):
         kernel_uuid = instance_ref['kernel_id']
         if kernel_uuid is None or kernel_uuid == '':
             return
-        kernel_id = self._get_image_id(context, kernel_uuid)
+        if image_ids is not None:
+            kernel_id = image_ids[kernel_uuid]
+        else:
+            kernel_id = self._get_image_id(context, kernel_uuid)
         result[key] = ec2utils.image_ec2_id(kernel_id, 'aki')
 
-    def _format_ramdisk_id(self, context, instance_ref, result, key):
+    def _format_ramdisk_id(self, context, instance_ref, result, key,
+                           image_ids=None):
         ramdisk_uuid = instance_ref['ramdisk_id']
         if ramdisk_uuid is None or ramdisk_uuid == '':
             return
-        ramdisk_id = self._get_image_id(context, ramdisk_uuid)
+        if image_ids is not None:
+            ramdisk_id = image_ids[ramdisk_uuid]
+        else:
+            ramdisk_id = self._get_image_id(context, ramdisk_uuid)
         result[key] = ec2utils.image_ec2_id(ramdisk_id, 'ari')
 
     def describe_instance_attribute(self, context, instance_id, attribute,
@@ -1068,12 +1076,14 @@ class CloudController(object):
         return i[0]
 
     def _format_instance_bdm(self, context, instance_id, root_device_name,
-                             result):
+                             result, bdms=None):
         """Format InstanceBlockDeviceMappingResponseItemType"""
         root_device_type = 'instance-store'
         mapping = []
-        for bdm in db.block_device_mapping_get_all_by_instance(context,
-                                                               instance_id):
+        if bdms is None:
+            bdms = db.block_device_mapping_get_all_by_instance(context,
+                                                               instance_id)
+        for bdm in bdms:
             volume_id = bdm['volume_id']
             if (volume_id is None or bdm['no_device']):
                 continue
@@ -1144,19 +1154,27 @@ class CloudController(object):
                                                      search_opts=search_opts)
             except exception.NotFound:
                 instances = []
+        if not context.is_admin:
+            instances = [inst for inst in instances
+                         if inst['image_ref'] != str(FLAGS.vpn_image_id)]
+
+        # NOTE(agent): the images, block device mappings and zones are looked
+        #              up for all the instances at once rather than per
+        #              instance
+        image_ids = self._get_image_ids(context, instances)
+        bdms = self._get_block_device_mappings(context, instances)
+        zones = self._get_availability_zones_by_host(context)
         for instance in instances:
-            if not context.is_admin:
-                if instance['image_ref'] == str(FLAGS.vpn_image_id):
-                    continue
             i = {}
             instance_id = instance['id']
             ec2_id = ec2utils.id_to_ec2_id(instance_id)
             i['instanceId'] = ec2_id
-            image_uuid = instance['image_ref']
-            image_id = self._get_image_id(context, image_uuid)
+            image_id = image_ids[instance['image_ref']]
             i['imageId'] = ec2utils.image_ec2_id(image_id)
-            self._format_kernel_id(context, instance, i, 'kernelId')
-            self._format_ramdisk_id(context, instance, i, 'ramdiskId')
+            self._format_kernel_id(context, instance, i, 'kernelId',
+                                   image_ids)
+            self._format_ramdisk_id(context, instance, i, 'ramdiskId',
+                                    image_ids)
             i['instanceState'] = {
                 'code': instance['power_state'],
                 'name': state_description_from_vm_state(instance['vm_state'])}
@@ -1190,10 +1208,9 @@ class CloudController(object):
             i['displayDescription'] = instance['display_description']
             self._format_instance_root_device_name(instance, i)
             self._format_instance_bdm(context, instance_id,
-                                      i['rootDeviceName'], i)
-            host = instance['host']
-            services = db.service_get_all_by_host(context.elevated(), host)
-            zone = ec2utils.get_availability_zone_by_host(services, host)
+                                      i['rootDeviceName'], i,
+                                      bdms.get(instance_id, []))
+            zone = zones.get(instance['host'], 'unknown zone')
             i['placement'] = {'availabilityZone': zone}
             if instance['reservation_id'] not in reservations:
                 r = {}
@@ -1206,6 +1223,36 @@ class CloudController(object):
 
         return list(reservations.values())
 
+    def _get_image_ids(self, context, instances):
+        """Map the image, kernel and ramdisk uuids of instances to the
+        ids used by the ec2 api, looking each distinct uuid up once."""
+        image_uuids = set()
+        for instance in instances:
+            image_uuids.add(instance['image_ref'])
+            for key in ('kernel_id', 'ramdisk_id'):
+                if instance[key]:
+                    image_uuids.add(instance[key])
+        return dict((image_uuid, self._get_image_id(context, image_uuid))
+                    for image_uuid in image_uuids)
+
+    @staticmethod
+    def _get_block_device_mappings(context, instances):
+        """Return the block device mappings of instances by instance id."""
+        bdms = {}
+        instance_ids = [instance['id'] for instance in instances]
+        for bdm in db.block_device_mapping_get_all_by_instances(context,
+                                                                instance_ids):
+            bdms.setdefault(bdm['instance_id'], []).append(bdm)
+        return bdms
+
+    @staticmethod
+    def _get_availability_zones_by_host(context):
+        """Return the availability zone of every host with a service."""
+        zones = {}
+        for service in db.service_get_all(context.elevated()):
+            zones.setdefault(service['host'], service['availability_zone'])
+        return zones
+
     def describe_addresses(self, context, **kwargs):
         return self.format_addresses(context)
 
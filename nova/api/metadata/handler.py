@@ -32,6 +32,7 @@ from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import network
+from nova import utils
 from nova import volume
 from nova import wsgi
 
@@ -40,6 +41,9 @@ LOG = logging.getLogger('nova.api.metadata')
 FLAGS = flags.FLAGS
 flags.DECLARE('use_forwarded_for', 'nova.api.auth')
 flags.DECLARE('dhcp_domain', 'nova.network.manager')
+flags.DEFINE_integer('metadata_cache_expiration', 15,
+                     'Seconds to cache the metadata of an instance and the '
+                     'mpi data of a project for, 0 to disable caching')
 
 _DEFAULT_MAPPINGS = {'ami': 'sda1',
                      'ephemeral0': 'sda2',
@@ -74,6 +78,23 @@ class MetadataRequestHandler(wsgi.Application):
         self.compute_api = compute.API(
                 network_api=network.API(),
                 volume_api=volume.API())
+        # NOTE(agent): cloud-init fetches dozens of paths in a row, so keep
+        #              what was looked up for an address around for a few
+        #              seconds. Both caches map to (timestamp, value).
+        self._metadata_cache = {}
+        self._mpi_cache = {}
+
+    def _cache_get(self, cache, key):
+        cached = cache.get(key)
+        if cached and not utils.is_older_than(cached[0],
+                                              FLAGS.metadata_cache_expiration):
+            return cached[1]
+        cache.pop(key, None)
+        return None
+
+    def _cache_set(self, cache, key, value):
+        if FLAGS.metadata_cache_expiration > 0:
+            cache[key] = (utils.utcnow(), value)
 
     def _get_mpi_data(self, context, project_id):
         result = {}
@@ -139,6 +160,38 @@ class MetadataRequestHandler(wsgi.Application):
         return mappings
 
     def get_metadata(self, address):
+        cached = self._get_cached_metadata(address)
+        if cached is None:
+            return None
+        return self._add_mpi_data(*cached)
+
+    def _add_mpi_data(self, data, project_id):
+        """Return a copy of data with the mpi data of the project filled in.
+
+        The mpi data lists every instance in the project, so it is only
+        looked up for the requests that need it.
+        """
+        mpi = self._cache_get(self._mpi_cache, project_id)
+        if mpi is None:
+            ctxt = context.get_admin_context()
+            mpi = self._get_mpi_data(ctxt, project_id)
+            self._cache_set(self._mpi_cache, project_id, mpi)
+        data = dict(data)
+        data['meta-data'] = dict(data['meta-data'], mpi=mpi)
+        return data
+
+    def _get_cached_metadata(self, address):
+        """Return the metadata for address, without the mpi data, and the
+        project of the instance.
+        """
+        cached = self._cache_get(self._metadata_cache, address)
+        if cached is None:
+            cached = self._build_metadata(address)
+            if cached is not None:
+                self._cache_set(self._metadata_cache, address, cached)
+        return cached
+
+    def _build_metadata(self, address):
         ctxt = context.get_admin_context()
         search_opts = {'fixed_ip': address, 'deleted': False}
         try:
@@ -153,7 +206,6 @@ class MetadataRequestHandler(wsgi.Application):
         # are populated.
         instance_ref = db.instance_get(ctxt, instance_ref[0]['id'])
 
-        mpi = self._get_mpi_data(ctxt, instance_ref['project_id'])
         hostname = "%s.%s" % (instance_ref['hostname'], FLAGS.dhcp_domain)
         host = instance_ref['host']
         services = db.service_get_all_by_host(ctxt.elevated(), host)
@@ -188,7 +240,8 @@ class MetadataRequestHandler(wsgi.Application):
                 'public-ipv4': floating_ip,
                 'reservation-id': instance_ref['reservation_id'],
                 'security-groups': security_groups,
-                'mpi': mpi}}
+                # NOTE(agent): filled in by _add_mpi_data when it is asked for
+                'mpi': {}}}
 
         # public-keys should be in meta-data only if user specified one
         if instance_ref['key_name']:
@@ -207,7 +260,7 @@ class MetadataRequestHandler(wsgi.Application):
             data['ancestor-ami-ids'] = []
         if False:  # TODO(vish): store product codes
             data['product-codes'] = []
-        return data
+        return data, instance_ref['project_id']
 
     def print_data(self, data):
         if isinstance(data, dict):
@@ -245,8 +298,14 @@ class MetadataRequestHandler(wsgi.Application):
         remote_address = req.remote_addr
         if FLAGS.use_forwarded_for:
             remote_address = req.headers.get('X-Forwarded-For', remote_address)
+        meta_data = None
         try:
-            meta_data = self.get_metadata(remote_address)
+            cached = self._get_cached_metadata(remote_address)
+            if cached is not None:
+                meta_data = cached[0]
+                path = [item for item in req.path_info.split('/') if item]
+                if path[:2] == ['meta-data', 'mpi']:
+                    meta_data = self._add_mpi_data(*cached)
         except Exception:
             LOG.exception(_('Failed to get metadata for ip: %s'),
                           remote_address)
@@ -603,7 +603,7 @@ class VsaVCController(servers.Controller):
         instance_list = self.compute_api.get_all(
                 context, search_opts=search_opts)
 
-        limited_list = self._limit_items(instance_list, req)
+        limited_list = common.limited_by_marker(instance_list, req)
         servers = [self._build_view(req, inst, is_detail)['server']
                 for inst in limited_list]
         return dict(servers=servers)
@@ -46,6 +46,11 @@ class Controller(wsgi.Controller):
 
     _view_builder_class = views_servers.ViewBuilder
 
+    # Instance relationships rendered by the detail view
+    _detail_columns_to_join = ['fixed_ips.floating_ips', 'fixed_ips.network',
+                               'fixed_ips.virtual_interface', 'metadata',
+                               'instance_type']
+
     def __init__(self, **kwargs):
         super(Controller, self).__init__(**kwargs)
         self.compute_api = compute.API()
@@ -134,15 +139,32 @@ class Controller(wsgi.Controller):
                 # No 'changes-since', so we only want non-deleted servers
                 search_opts['deleted'] = False
 
-        instance_list = self.compute_api.get_all(context,
-                                                 search_opts=search_opts)
+        # Pagination is done by compute's get_all(), not by the filters.
+        search_opts.pop('limit', None)
+        search_opts.pop('marker', None)
+        params = common.get_pagination_params(req)
+        limit = min(FLAGS.osapi_max_limit,
+                    params.get('limit', FLAGS.osapi_max_limit))
+        marker = params.get('marker')
+
+        if is_detail:
+            columns_to_join = self._detail_columns_to_join
+        else:
+            columns_to_join = []
+
+        try:
+            instance_list = self.compute_api.get_all(context,
+                    search_opts=search_opts, limit=limit, marker=marker,
+                    columns_to_join=columns_to_join)
+        except exception.MarkerNotFound:
+            msg = _('marker [%s] not found') % marker
+            raise exc.HTTPBadRequest(explanation=msg)
 
-        limited_list = self._limit_items(instance_list, req)
         if is_detail:
-            self._add_instance_faults(context, limited_list)
-            return self._view_builder.detail(req, limited_list)
+            self._add_instance_faults(context, instance_list)
+            return self._view_builder.detail(req, instance_list)
         else:
-            return self._view_builder.index(req, limited_list)
+            return self._view_builder.index(req, instance_list)
 
     def _get_server(self, context, instance_uuid):
         """Utility function for looking up an instance by uuid"""
@@ -618,9 +640,6 @@ class Controller(wsgi.Controller):
         self.compute_api.set_admin_password(context, server, password)
         return webob.Response(status_int=202)
 
-    def _limit_items(self, items, req):
-        return common.limited_by_marker(items, req)
-
     def _validate_metadata(self, metadata):
         """Ensure that we can work with the metadata given."""
         try:
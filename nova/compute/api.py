@@ -663,13 +663,15 @@ class API(base.Base):
             if instance['host']:
                 hosts.add(instance['host'])
 
-        # ...and finally we tell these nodes to refresh their view of this
-        # particular security group.
+        # ...and finally we tell these nodes to refresh their view of these
+        # particular security groups.
         for host in hosts:
-            rpc.cast(context,
-                     self.db.queue_get_for(context, FLAGS.compute_topic, host),
-                     {"method": "refresh_security_group_members",
-                      "args": {"security_group_id": group_id}})
+            for group_id in group_ids:
+                rpc.cast(context,
+                         self.db.queue_get_for(context, FLAGS.compute_topic,
+                                               host),
+                         {"method": "refresh_security_group_members",
+                          "args": {"security_group_id": group_id}})
 
     def trigger_provider_fw_rules_refresh(self, context):
         """Called when a rule is added to or removed from a security_group"""
@@ -923,7 +925,9 @@ class API(base.Base):
         """
         return self.get(context, instance_id)
 
-    def get_all(self, context, search_opts=None):
+    def get_all(self, context, search_opts=None, sort_key='created_at',
+                sort_dir='desc', limit=None, marker=None,
+                columns_to_join=None):
         """Get all instances filtered by one of the given parameters.
 
         If there is no filter and the context is an admin, it will retrieve
@@ -931,6 +935,9 @@ class API(base.Base):
 
         Deleted instances will be returned by default, unless there is a
         search option that says otherwise.
+
+        At most limit instances sorted after the instance with uuid marker
+        are returned.  Without child zones this is all done by the database.
         """
 
         if search_opts is None:
@@ -946,19 +953,13 @@ class API(base.Base):
                     flavor_id)
             filters['instance_type_id'] = instance_type['id']
 
-        def _remap_fixed_ip_filter(fixed_ip):
-            # Turn fixed_ip into a regexp match. Since '.' matches
-            # any character, we need to use regexp escaping for it.
-            filters['ip'] = '^%s$' % fixed_ip.replace('.', '\\.')
-
         # search_option to filter_name mapping.
         filter_mapping = {
                 'image': 'image_ref',
                 'name': 'display_name',
                 'instance_name': 'name',
                 'tenant_id': 'project_id',
-                'flavor': _remap_flavor_filter,
-                'fixed_ip': _remap_fixed_ip_filter}
+                'flavor': _remap_flavor_filter}
 
         # copy from search_opts, doing various remappings as necessary
         for opt, value in search_opts.iteritems():
@@ -980,7 +981,19 @@ class API(base.Base):
 
         local_zone_only = search_opts.get('local_zone_only', False)
 
-        inst_models = self._get_instances_by_filters(context, filters)
+        zones = []
+        if not local_zone_only:
+            zones = self.db.zone_get_all(context.elevated())
+
+        if zones:
+            # Results from the child zones are merged with ours below, so
+            # we can only page through the combined list.
+            inst_models = self._get_instances_by_filters(context, filters,
+                    sort_key, sort_dir, columns_to_join=columns_to_join)
+        else:
+            inst_models = self._get_instances_by_filters(context, filters,
+                    sort_key, sort_dir, limit=limit, marker=marker,
+                    columns_to_join=columns_to_join)
 
         # Convert the models to dictionaries
         instances = []
@@ -990,7 +1003,7 @@ class API(base.Base):
             instance['name'] = inst_model['name']
             instances.append(instance)
 
-        if local_zone_only:
+        if not zones:
             return instances
 
         # Recurse zones. Send along the un-modified search options we received.
@@ -998,6 +1011,7 @@ class API(base.Base):
                 "list",
                 errors_to_ignore=[novaclient.exceptions.NotFound],
                 novaclient_collection_name="servers",
+                zones=zones,
                 search_opts=search_opts)
 
         for zone, servers in children:
@@ -1009,10 +1023,27 @@ class API(base.Base):
                 server._info['_is_precooked'] = True
                 instances.append(server._info)
 
-        return instances
+        return self._limit_by_marker(instances, limit, marker)
 
-    def _get_instances_by_filters(self, context, filters):
-        if 'ip6' in filters or 'ip' in filters:
+    @staticmethod
+    def _limit_by_marker(instances, limit, marker):
+        """Return at most limit instances following the marker instance."""
+        start_index = 0
+        if marker:
+            for i, instance in enumerate(instances):
+                if marker in (instance['id'], instance.get('uuid')):
+                    start_index = i + 1
+                    break
+            else:
+                raise exception.MarkerNotFound(marker=marker)
+        if limit is None:
+            return instances[start_index:]
+        return instances[start_index:start_index + limit]
+
+    def _get_instances_by_filters(self, context, filters, sort_key,
+                                  sort_dir, limit=None, marker=None,
+                                  columns_to_join=None):
+        if 'ip6' in filters or 'ip' in filters or 'fixed_ip' in filters:
             res = self.network_api.get_instance_uuids_by_ip_filter(context,
                                                                    filters)
             # NOTE(jkoelker) It is possible that we will get the same
@@ -1020,7 +1051,9 @@ class API(base.Base):
             uuids = set([r['instance_uuid'] for r in res])
             filters['uuid'] = uuids
 
-        return self.db.instance_get_all_by_filters(context, filters)
+        return self.db.instance_get_all_by_filters(context, filters,
+                sort_key, sort_dir, limit=limit, marker=marker,
+                columns_to_join=columns_to_join)
 
     def _cast_compute_message(self, method, context, instance_uuid, host=None,
                               params=None):
@@ -1397,6 +1430,23 @@ class API(base.Base):
         return self._call_compute_message_for_host("host_power_action",
                 context, host=host, params={"action": action})
 
+    def prefetch_image(self, context, image_id, hosts=None):
+        """Casts to compute hosts to cache an image ahead of instances
+        booting from it.
+
+        :param hosts: hosts to cache the image on, defaults to every
+                      compute host
+        """
+        if hosts is None:
+            hosts = [service['host'] for service in
+                     self.db.service_get_all_by_topic(context,
+                                                      FLAGS.compute_topic)]
+        for host in hosts:
+            queue = self.db.queue_get_for(context, FLAGS.compute_topic, host)
+            rpc.cast(context, queue,
+                     {'method': 'prefetch_image',
+                      'args': {'image_id': image_id}})
+
     @scheduler_api.reroute_compute("diagnostics")
     def get_diagnostics(self, context, instance):
         """Retrieve diagnostics for the given instance."""
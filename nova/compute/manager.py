@@ -57,6 +57,8 @@ from nova import manager
 from nova import network
 from nova.notifier import api as notifier
 from nova import rpc
+from nova.rpc import common as rpc_common
+from nova.scheduler import api as scheduler_api
 from nova import utils
 from nova.virt import driver
 from nova import volume
@@ -92,6 +94,9 @@ flags.DEFINE_integer("running_deleted_instance_timeout", 0,
 flags.DEFINE_integer("running_deleted_instance_poll_interval", 30,
                      "Number of periodic scheduler ticks to wait between"
                      " runs of the cleanup task.")
+flags.DEFINE_integer("image_cache_manager_interval", 40,
+                     "Number of periodic scheduler ticks to wait between"
+                     " runs of the image cache manager.")
 flags.DEFINE_string("running_deleted_instance_action", "noop",
                      "Action to take if a running deleted instance is"
                      " detected. Valid options are 'noop', 'log', and"
@@ -179,6 +184,7 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.network_manager = utils.import_object(FLAGS.network_manager)
         self._last_host_check = 0
         self._last_bw_usage_poll = 0
+        self._bw_usage_vifs = {}
         super(ComputeManager, self).__init__(service_name="compute",
                                              *args, **kwargs)
 
@@ -191,6 +197,7 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.driver.init_host(host=self.host)
         context = nova.context.get_admin_context()
         instances = self.db.instance_get_all_by_host(context, self.host)
+        running_instances = []
         for instance in instances:
             inst_name = instance['name']
             db_state = instance['power_state']
@@ -208,14 +215,19 @@ class ComputeManager(manager.SchedulerDependentManager):
                             'nova-compute restart.'), locals())
                 self.reboot_instance(context, instance['id'])
             elif drv_state == power_state.RUNNING:
-                # Hyper-V and VMWareAPI drivers will raise an exception
-                try:
-                    net_info = self._get_instance_nw_info(context, instance)
-                    self.driver.ensure_filtering_rules_for_instance(instance,
-                                                                    net_info)
-                except NotImplementedError:
-                    LOG.warning(_('Hypervisor driver does not '
-                            'support firewall rules'))
+                running_instances.append(instance)
+
+        # NOTE(agent): fetch the network info of all running instances at once
+        #              rather than with a network call per instance
+        net_infos = self._get_instances_nw_info(context, running_instances)
+        for instance in running_instances:
+            # Hyper-V and VMWareAPI drivers will raise an exception
+            try:
+                self.driver.ensure_filtering_rules_for_instance(instance,
+                        net_infos.get(instance['uuid'], []))
+            except NotImplementedError:
+                LOG.warning(_('Hypervisor driver does not '
+                        'support firewall rules'))
 
     def _get_power_state(self, context, instance):
         """Retrieve the power state for the given instance."""
@@ -273,6 +285,24 @@ class ComputeManager(manager.SchedulerDependentManager):
                                                                  instance)
         return network_info
 
+    def _get_instances_nw_info(self, context, instances):
+        """Get the network data of several instances, keyed by uuid.
+        Returns an empty dict if stub_network flag is set."""
+        if FLAGS.stub_network or not instances:
+            return {}
+        try:
+            return self.network_api.get_instances_nw_info(context, instances)
+        except rpc_common.RemoteError as err:
+            if err.exc_type != 'AttributeError':
+                raise
+        # NOTE(agent): the network service predates get_instances_nw_info,
+        #              so ask it about each instance in turn
+        LOG.info(_('Network service can not get the network info of '
+                   'several instances at once, getting it one by one'))
+        return dict((instance['uuid'],
+                     self._get_instance_nw_info(context, instance))
+                    for instance in instances)
+
     def _setup_block_device_mapping(self, context, instance):
         """setup volumes for block device mapping"""
         block_device_mapping = []
@@ -626,6 +656,8 @@ class ComputeManager(manager.SchedulerDependentManager):
                               terminated_at=utils.utcnow())
 
         self.db.instance_destroy(context, instance_id)
+        scheduler_api.update_host_resources(context, self.host,
+                -instance['local_gb'], -instance['memory_mb'])
 
         usage_info = utils.usage_from_instance(instance)
         notifier.notify('compute.%s' % self.host,
@@ -1043,6 +1075,13 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.driver.confirm_migration(
                 migration_ref, instance_ref, network_info)
 
+        old_instance_type = instance_types.get_instance_type(
+                migration_ref['old_instance_type_id'])
+        scheduler_api.update_host_resources(context,
+                migration_ref['source_compute'],
+                -old_instance_type['local_gb'],
+                -old_instance_type['memory_mb'])
+
         usage_info = utils.usage_from_instance(instance_ref)
         notifier.notify('compute.%s' % self.host,
                             'compute.instance.resize.confirm',
@@ -1103,6 +1142,13 @@ class ComputeManager(manager.SchedulerDependentManager):
         self.driver.finish_revert_migration(instance_ref)
         self.db.migration_update(context, migration_id,
                 {'status': 'reverted'})
+
+        new_instance_type = instance_types.get_instance_type(
+                migration_ref['new_instance_type_id'])
+        scheduler_api.update_host_resources(context,
+                migration_ref['dest_compute'],
+                -new_instance_type['local_gb'],
+                -new_instance_type['memory_mb'])
         usage_info = utils.usage_from_instance(instance_ref)
         notifier.notify('compute.%s' % self.host,
                             'compute.instance.resize.revert',
@@ -1345,6 +1391,12 @@ class ComputeManager(manager.SchedulerDependentManager):
         """Sets the specified host's ability to accept new instances."""
         return self.driver.set_host_enabled(host, enabled)
 
+    @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
+    def prefetch_image(self, context, image_id, **kwargs):
+        """Cache an image on this host ahead of instances booting from it."""
+        LOG.audit(_("Prefetching image %s"), image_id, context=context)
+        self.driver.prefetch_image(context, image_id)
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @wrap_instance_fault
     def get_diagnostics(self, context, instance_uuid):
@@ -1973,13 +2025,44 @@ class ComputeManager(manager.SchedulerDependentManager):
                 # they just don't get the info in the usage events.
                 return
 
+            vifs = self._get_bw_usage_vifs(context,
+                            [usage['mac_address'] for usage in bw_usage])
+            usages = []
             for usage in bw_usage:
-                vif = usage['virtual_interface']
-                self.db.bw_usage_update(context,
-                                        vif.instance_id,
-                                        vif.network.label,
-                                        start_time,
-                                        usage['bw_in'], usage['bw_out'])
+                vif = vifs.get(usage['mac_address'])
+                if vif:
+                    usages.append(dict(instance_id=vif['instance_id'],
+                                       network_label=vif['network_label'],
+                                       bw_in=usage['bw_in'],
+                                       bw_out=usage['bw_out']))
+            self.db.bw_usage_update_many(context, start_time, usages)
+
+    def _get_bw_usage_vifs(self, context, addresses):
+        """Returns the instance id and network label of the virtual
+        interfaces with the given MAC addresses, by address.
+
+        These don't change while an address stays in use, so they are kept
+        from one poll to the next and only new addresses are looked up.
+        """
+        vifs = dict((address, self._bw_usage_vifs[address])
+                    for address in addresses
+                    if address in self._bw_usage_vifs)
+        missing = [address for address in addresses if address not in vifs]
+        for vif in self.db.virtual_interface_get_by_addresses(context,
+                                                              missing):
+            vifs[vif['address']] = dict(instance_id=vif['instance_id'],
+                                        network_label=vif['network']['label'])
+        self._bw_usage_vifs = vifs
+        return vifs
+
+    @manager.periodic_task(
+        ticks_between_runs=FLAGS.image_cache_manager_interval)
+    def _run_image_cache_manager_pass(self, context):
+        """Let the virtualization driver clean up its image cache."""
+        try:
+            self.driver.manage_image_cache(context)
+        except NotImplementedError:
+            pass
 
     @manager.periodic_task
     def _report_driver_status(self, context):
@@ -60,6 +60,14 @@ flags.DEFINE_string('snapshot_name_template', 'snapshot-%08x',
                     'Template string to be used to generate snapshot names')
 flags.DEFINE_string('vsa_name_template', 'vsa-%08x',
                     'Template string to be used to generate VSA names')
+flags.DEFINE_integer('quota_cache_ttl', 5,
+                     'Seconds to cache a project\'s quotas for. Quota '
+                     'changes made by other processes take up to this long '
+                     'to be seen, 0 disables the cache')
+flags.DEFINE_integer('quota_usage_max_age', 3600,
+                     'Recount a project\'s resource usage for quotas when it '
+                     'was last counted more than this many seconds ago, '
+                     '0 to never recount')
 
 IMPL = utils.LazyPluggable(FLAGS['db_backend'],
                            sqlalchemy='nova.db.sqlalchemy.api')
@@ -304,6 +312,12 @@ def floating_ip_get_by_address(context, address):
     return IMPL.floating_ip_get_by_address(context, address)
 
 
+def floating_ip_get_all_by_address_regexp(context, pattern):
+    """Get all floating ips associated with an instance whose address
+    matches the regexp pattern."""
+    return IMPL.floating_ip_get_all_by_address_regexp(context, pattern)
+
+
 def floating_ip_get_by_fixed_address(context, fixed_address):
     """Get a floating ips by fixed address"""
     return IMPL.floating_ip_get_by_fixed_address(context, fixed_address)
@@ -371,6 +385,28 @@ def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
                                         instance_id, host)
 
 
+def fixed_ip_claim_pool(context, network_id, claimed_by, count):
+    """Set aside up to count free fixed ips in a network for claimed_by.
+
+    Returns the addresses claimed.
+    """
+    return IMPL.fixed_ip_claim_pool(context, network_id, claimed_by, count)
+
+
+def fixed_ip_associate_claimed(context, address, instance_id, claimed_by):
+    """Associate a fixed ip claimed by claimed_by with an instance.
+
+    Returns False if the ip is no longer claimed by claimed_by.
+    """
+    return IMPL.fixed_ip_associate_claimed(context, address, instance_id,
+                                           claimed_by)
+
+
+def fixed_ip_release_claimed(context, claimed_by, addresses=None):
+    """Release unused fixed ips claimed by claimed_by back to the pool."""
+    return IMPL.fixed_ip_release_claimed(context, claimed_by, addresses)
+
+
 def fixed_ip_create(context, values):
     """Create a fixed ip from the values dictionary."""
     return IMPL.fixed_ip_create(context, values)
@@ -411,11 +447,22 @@ def fixed_ip_get_by_address(context, address):
     return IMPL.fixed_ip_get_by_address(context, address)
 
 
+def fixed_ip_get_all_by_address_regexp(context, pattern):
+    """Get all fixed ips associated with an instance whose address matches
+    the regexp pattern."""
+    return IMPL.fixed_ip_get_all_by_address_regexp(context, pattern)
+
+
 def fixed_ip_get_by_instance(context, instance_id):
     """Get fixed ips by instance or raise if none exist."""
     return IMPL.fixed_ip_get_by_instance(context, instance_id)
 
 
+def fixed_ip_get_by_instances(context, instance_ids):
+    """Get all fixed ips of the given instances."""
+    return IMPL.fixed_ip_get_by_instances(context, instance_ids)
+
+
 def fixed_ip_get_by_network_host(context, network_id, host):
     """Get fixed ip for a host in a network."""
     return IMPL.fixed_ip_get_by_network_host(context, network_id, host)
@@ -458,6 +505,12 @@ def virtual_interface_get_by_address(context, address):
     return IMPL.virtual_interface_get_by_address(context, address)
 
 
+def virtual_interface_get_by_addresses(context, addresses):
+    """Gets the virtual interfaces with the given addresses, with their
+    networks."""
+    return IMPL.virtual_interface_get_by_addresses(context, addresses)
+
+
 def virtual_interface_get_by_uuid(context, vif_uuid):
     """Gets a virtual interface from the table filtering on vif uuid."""
     return IMPL.virtual_interface_get_by_uuid(context, vif_uuid)
@@ -468,6 +521,11 @@ def virtual_interface_get_by_instance(context, instance_id):
     return IMPL.virtual_interface_get_by_instance(context, instance_id)
 
 
+def virtual_interface_get_by_instances(context, instance_ids):
+    """Gets all virtual interfaces of the given instances"""
+    return IMPL.virtual_interface_get_by_instances(context, instance_ids)
+
+
 def virtual_interface_get_by_instance_and_network(context, instance_id,
                                                            network_id):
     """Gets all virtual interfaces for instance."""
@@ -534,9 +592,14 @@ def instance_get_all(context):
     return IMPL.instance_get_all(context)
 
 
-def instance_get_all_by_filters(context, filters):
+def instance_get_all_by_filters(context, filters, sort_key='created_at',
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None):
     """Get all instances that match all filters."""
-    return IMPL.instance_get_all_by_filters(context, filters)
+    return IMPL.instance_get_all_by_filters(context, filters, sort_key,
+                                            sort_dir, limit=limit,
+                                            marker=marker,
+                                            columns_to_join=columns_to_join)
 
 
 def instance_get_active_by_window(context, begin, end=None, project_id=None):
@@ -580,6 +643,14 @@ def instance_get_fixed_addresses(context, instance_id):
     return IMPL.instance_get_fixed_addresses(context, instance_id)
 
 
+def instance_get_fixed_addresses_by_security_groups(context,
+                                                    security_group_ids):
+    """Get the fixed ip addresses of the instances in each of the given
+    security groups, as a dict keyed by security group id."""
+    return IMPL.instance_get_fixed_addresses_by_security_groups(context,
+                                                    security_group_ids)
+
+
 def instance_get_fixed_addresses_v6(context, instance_id):
     return IMPL.instance_get_fixed_addresses_v6(context, instance_id)
 
@@ -928,7 +999,7 @@ def quota_destroy(context, project_id, resource):
 
 def quota_destroy_all_by_project(context, project_id):
     """Destroy all quotas associated with a given project."""
-    return IMPL.quota_get_all_by_project(context, project_id)
+    return IMPL.quota_destroy_all_by_project(context, project_id)
 
 
 ###################
@@ -1074,6 +1145,12 @@ def block_device_mapping_get_all_by_instance(context, instance_id):
     return IMPL.block_device_mapping_get_all_by_instance(context, instance_id)
 
 
+def block_device_mapping_get_all_by_instances(context, instance_ids):
+    """Get all block device mapping belonging to a list of instances"""
+    return IMPL.block_device_mapping_get_all_by_instances(context,
+                                                          instance_ids)
+
+
 def block_device_mapping_destroy(context, bdm_id):
     """Destroy the block device mapping."""
     return IMPL.block_device_mapping_destroy(context, bdm_id)
@@ -1509,6 +1586,16 @@ def bw_usage_update(context,
                                 session=None)
 
 
+def bw_usage_update_many(context, start_period, usages):
+    """Update cached bw usage for many instances and networks at once.
+
+    :param usages: list of dicts with the instance_id, network_label,
+                   bw_in and bw_out to cache for start_period.
+
+    Creates new records as needed, all in a single transaction."""
+    return IMPL.bw_usage_update_many(context, start_period, usages)
+
+
 ####################
 
 
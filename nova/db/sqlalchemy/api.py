@@ -34,6 +34,7 @@ from nova.db.sqlalchemy import models
 from nova.db.sqlalchemy.session import get_session
 from sqlalchemy import and_
 from sqlalchemy import or_
+from sqlalchemy import String
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
@@ -505,6 +506,8 @@ def floating_ip_allocate_address(context, project_id):
             raise exception.NoMoreFloatingIps()
         floating_ip_ref['project_id'] = project_id
         session.add(floating_ip_ref)
+        _project_usage_update(session, (None, {}),
+                              _floating_ip_usage(floating_ip_ref))
     return floating_ip_ref['address']
 
 
@@ -512,18 +515,38 @@ def floating_ip_allocate_address(context, project_id):
 def floating_ip_create(context, values):
     floating_ip_ref = models.FloatingIp()
     floating_ip_ref.update(values)
-    floating_ip_ref.save()
+    session = get_session()
+    with session.begin():
+        floating_ip_ref.save(session=session)
+        _project_usage_update(session, (None, {}),
+                              _floating_ip_usage(floating_ip_ref))
     return floating_ip_ref['address']
 
 
+def _floating_ip_usage_count(context, project_id, session):
+    # TODO(tr3buchet): why leave auto_assigned floating IPs out?
+    count = model_query(context, models.FloatingIp, session=session,
+                        read_deleted="no").\
+                    filter_by(project_id=project_id).\
+                    filter_by(auto_assigned=False).\
+                    count()
+    return {'floating_ips': count}
+
+
+def _floating_ip_usage(floating_ip_ref):
+    """Return (project_id, usage) counted against quotas for a floating
+    ip, as _floating_ip_usage_count() counts it."""
+    if floating_ip_ref['deleted'] or floating_ip_ref['auto_assigned']:
+        return None, {}
+    return floating_ip_ref['project_id'], {'floating_ips': 1}
+
+
 @require_context
 def floating_ip_count_by_project(context, project_id):
     authorize_project_context(context, project_id)
-    # TODO(tr3buchet): why leave auto_assigned floating IPs out?
-    return model_query(context, models.FloatingIp, read_deleted="no").\
-                   filter_by(project_id=project_id).\
-                   filter_by(auto_assigned=False).\
-                   count()
+    usage = _project_usage_get(context, project_id, ('floating_ips',),
+                               _floating_ip_usage_count)
+    return usage['floating_ips']
 
 
 @require_context
@@ -549,10 +572,12 @@ def floating_ip_deallocate(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        usage = _floating_ip_usage(floating_ip_ref)
         floating_ip_ref['project_id'] = None
         floating_ip_ref['host'] = None
         floating_ip_ref['auto_assigned'] = False
         floating_ip_ref.save(session=session)
+        _project_usage_update(session, usage, (None, {}))
 
 
 @require_context
@@ -562,7 +587,9 @@ def floating_ip_destroy(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        usage = _floating_ip_usage(floating_ip_ref)
         floating_ip_ref.delete(session=session)
+        _project_usage_update(session, usage, (None, {}))
 
 
 @require_context
@@ -590,8 +617,11 @@ def floating_ip_set_auto_assigned(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        usage = _floating_ip_usage(floating_ip_ref)
         floating_ip_ref.auto_assigned = True
         floating_ip_ref.save(session=session)
+        _project_usage_update(session, usage,
+                              _floating_ip_usage(floating_ip_ref))
 
 
 def _floating_ip_get_all(context):
@@ -645,6 +675,19 @@ def floating_ip_get_by_address(context, address, session=None):
     return result
 
 
+@require_context
+def floating_ip_get_all_by_address_regexp(context, pattern):
+    query = model_query(context, models.FloatingIp, read_deleted="no").\
+                options(joinedload('fixed_ip')).\
+                join(models.FloatingIp.fixed_ip).\
+                filter(models.FixedIp.instance_id != None).\
+                order_by(models.FloatingIp.id)
+    query = _like_prefix_filter(query, models.FloatingIp.address, pattern)
+    address_re = re.compile(pattern)
+    return [floating_ip for floating_ip in query.all()
+            if address_re.match(floating_ip['address'])]
+
+
 @require_context
 def floating_ip_get_by_fixed_address(context, fixed_address, session=None):
     if not session:
@@ -666,9 +709,12 @@ def floating_ip_update(context, address, values):
     session = get_session()
     with session.begin():
         floating_ip_ref = floating_ip_get_by_address(context, address, session)
+        usage = _floating_ip_usage(floating_ip_ref)
         for (key, value) in values.iteritems():
             floating_ip_ref[key] = value
         floating_ip_ref.save(session=session)
+        _project_usage_update(session, usage,
+                              _floating_ip_usage(floating_ip_ref))
 
 
 ###################
@@ -707,6 +753,8 @@ def fixed_ip_associate(context, address, instance_id, network_id=None,
         fixed_ip_ref.instance = instance_get(context,
                                              instance_id,
                                              session=session)
+        # Take it back from whichever host had claimed it
+        fixed_ip_ref.claimed_by = None
         session.add(fixed_ip_ref)
     return fixed_ip_ref['address']
 
@@ -723,6 +771,7 @@ def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
                                filter_by(reserved=False).\
                                filter_by(instance=None).\
                                filter_by(host=None).\
+                               filter_by(claimed_by=None).\
                                with_lockmode('update').\
                                first()
         # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
@@ -743,6 +792,86 @@ def fixed_ip_associate_pool(context, network_id, instance_id=None, host=None):
     return fixed_ip_ref['address']
 
 
+@require_admin_context
+def fixed_ip_claim_pool(context, network_id, claimed_by, count):
+    """Claim up to count free fixed ips in a network for claimed_by.
+
+    The free ips are looked up without locking them and then claimed with
+    a conditional update, so ips claimed by someone else in between are
+    simply left out.
+    """
+    session = get_session()
+    with session.begin():
+        network_or_none = or_(models.FixedIp.network_id == network_id,
+                              models.FixedIp.network_id == None)
+        free_ips = model_query(context, models.FixedIp.id, session=session,
+                               read_deleted="no").\
+                           filter(network_or_none).\
+                           filter_by(reserved=False).\
+                           filter_by(instance_id=None).\
+                           filter_by(host=None).\
+                           filter_by(claimed_by=None).\
+                           limit(count).\
+                           all()
+        ids = [fixed_ip.id for fixed_ip in free_ips]
+        if not ids:
+            return []
+
+        session.query(models.FixedIp).\
+                filter(models.FixedIp.id.in_(ids)).\
+                filter(network_or_none).\
+                filter_by(instance_id=None).\
+                filter_by(host=None).\
+                filter_by(claimed_by=None).\
+                update({'claimed_by': claimed_by,
+                        'network_id': network_id},
+                       synchronize_session=False)
+        claimed = session.query(models.FixedIp.address).\
+                          filter(models.FixedIp.id.in_(ids)).\
+                          filter_by(claimed_by=claimed_by).\
+                          all()
+    return [fixed_ip.address for fixed_ip in claimed]
+
+
+@require_admin_context
+def fixed_ip_associate_claimed(context, address, instance_id, claimed_by):
+    """Associate a fixed ip claimed by claimed_by with an instance.
+
+    Returns False if the ip is no longer claimed by claimed_by.
+    """
+    session = get_session()
+    with session.begin():
+        count = session.query(models.FixedIp).\
+                        filter_by(address=address).\
+                        filter_by(deleted=False).\
+                        filter_by(instance_id=None).\
+                        filter_by(claimed_by=claimed_by).\
+                        update({'instance_id': instance_id,
+                                'claimed_by': None,
+                                'updated_at': utils.utcnow()},
+                               synchronize_session=False)
+    return count > 0
+
+
+@require_admin_context
+def fixed_ip_release_claimed(context, claimed_by, addresses=None):
+    """Release the unused fixed ips claimed by claimed_by.
+
+    Only the given addresses are released if addresses is not None.
+    """
+    session = get_session()
+    with session.begin():
+        query = session.query(models.FixedIp).\
+                        filter_by(claimed_by=claimed_by).\
+                        filter_by(instance_id=None)
+        if addresses is not None:
+            if not addresses:
+                return 0
+            query = query.filter(models.FixedIp.address.in_(addresses))
+        return query.update({'claimed_by': None},
+                            synchronize_session=False)
+
+
 @require_context
 def fixed_ip_create(context, values):
     fixed_ip_ref = models.FixedIp()
@@ -865,6 +994,17 @@ def fixed_ip_get_by_address(context, address, session=None):
     return result
 
 
+@require_context
+def fixed_ip_get_all_by_address_regexp(context, pattern):
+    query = model_query(context, models.FixedIp, read_deleted="no").\
+                 filter(models.FixedIp.instance_id != None).\
+                 order_by(models.FixedIp.id)
+    query = _like_prefix_filter(query, models.FixedIp.address, pattern)
+    address_re = re.compile(pattern)
+    return [fixed_ip for fixed_ip in query.all()
+            if address_re.match(fixed_ip['address'])]
+
+
 @require_context
 def fixed_ip_get_by_instance(context, instance_id):
     result = model_query(context, models.FixedIp, read_deleted="no").\
@@ -878,6 +1018,16 @@ def fixed_ip_get_by_instance(context, instance_id):
     return result
 
 
+@require_context
+def fixed_ip_get_by_instances(context, instance_ids):
+    if not instance_ids:
+        return []
+    return model_query(context, models.FixedIp, read_deleted="no").\
+                 options(joinedload('floating_ips')).\
+                 filter(models.FixedIp.instance_id.in_(instance_ids)).\
+                 all()
+
+
 @require_context
 def fixed_ip_get_by_network_host(context, network_id, host):
     result = model_query(context, models.FixedIp, read_deleted="no").\
@@ -983,6 +1133,21 @@ def virtual_interface_get_by_address(context, address):
     return vif_ref
 
 
+@require_context
+def virtual_interface_get_by_addresses(context, addresses):
+    """Gets the virtual interfaces with the given addresses.
+
+    :param addresses: = the addresses of the interfaces you're looking to get
+    """
+    if not addresses:
+        return []
+    return model_query(context, models.VirtualInterface,
+                       read_deleted="yes").\
+                   filter(models.VirtualInterface.address.in_(addresses)).\
+                   options(joinedload('network')).\
+                   all()
+
+
 @require_context
 def virtual_interface_get_by_uuid(context, vif_uuid):
     """Gets a virtual interface from the table.
@@ -1008,6 +1173,22 @@ def virtual_interface_get_by_instance(context, instance_id):
     return vif_refs
 
 
+@require_context
+def virtual_interface_get_by_instances(context, instance_ids):
+    """Gets all virtual interfaces of the given instances, ordered by id.
+
+    :param instance_ids: = ids of the instances to retrieve vifs for
+    """
+    if not instance_ids:
+        return []
+    return model_query(context, models.VirtualInterface,
+                       read_deleted="yes").\
+                   filter(models.VirtualInterface.instance_id.in_(
+                          instance_ids)).\
+                   order_by(models.VirtualInterface.id).\
+                   all()
+
+
 @require_context
 def virtual_interface_get_by_instance_and_network(context, instance_id,
                                                            network_id):
@@ -1093,6 +1274,8 @@ def instance_create(context, values):
     session = get_session()
     with session.begin():
         instance_ref.save(session=session)
+        _project_usage_update(session, (None, {}),
+                              _instance_usage(instance_ref))
 
     # and creat the info_cache table entry for instance
     instance_info_cache_create(context, {'instance_id': instance_ref['uuid']})
@@ -1100,23 +1283,47 @@ def instance_create(context, values):
     return instance_ref
 
 
-@require_admin_context
-def instance_data_get_for_project(context, project_id):
+def _instance_usage_count(context, project_id, session):
     result = model_query(context,
                          func.count(models.Instance.id),
                          func.sum(models.Instance.vcpus),
                          func.sum(models.Instance.memory_mb),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
     # NOTE(vish): convert None to 0
-    return (result[0] or 0, result[1] or 0, result[2] or 0)
+    return {'instances': result[0] or 0,
+            'cores': result[1] or 0,
+            'ram': result[2] or 0}
+
+
+def _instance_usage(instance_ref):
+    """Return (project_id, usage) counted against quotas for an instance,
+    as _instance_usage_count() counts it."""
+    if not instance_ref or instance_ref['deleted']:
+        return None, {}
+    return instance_ref['project_id'], {'instances': 1,
+                                        'cores': instance_ref['vcpus'] or 0,
+                                        'ram': instance_ref['memory_mb'] or 0}
+
+
+@require_admin_context
+def instance_data_get_for_project(context, project_id):
+    usage = _project_usage_get(context, project_id,
+                               ('instances', 'cores', 'ram'),
+                               _instance_usage_count)
+    return (usage['instances'], usage['cores'], usage['ram'])
 
 
 @require_context
 def instance_destroy(context, instance_id):
     session = get_session()
     with session.begin():
+        usage = _instance_usage(session.query(models.Instance).\
+                                        filter_by(id=instance_id).\
+                                        first())
+        _project_usage_update(session, usage, (None, {}))
         session.query(models.Instance).\
                 filter_by(id=instance_id).\
                 update({'deleted': True,
@@ -1210,11 +1417,98 @@ def instance_get_all(context):
                    all()
 
 
+# Relationships loaded by instance_get_all_by_filters() unless the caller
+# asks for a narrower set with columns_to_join.
+_INSTANCE_FILTER_JOINS = ['fixed_ips.floating_ips', 'fixed_ips.network',
+                          'fixed_ips.virtual_interface', 'info_cache',
+                          'security_groups', 'metadata', 'instance_type']
+
+_REGEXP_SPECIAL_CHARS = '.^$*+?{}[]()|\\'
+
+
+def _regexp_literal_prefix(pattern):
+    """Return the literal string every re.match() of pattern starts with.
+
+    Stops at the first character that isn't a plain literal, so '^foo.*'
+    gives 'foo' and 'web\\.1' gives 'web.1'.  Patterns using alternation
+    can match several prefixes, so they give ''.
+    """
+    if '|' in pattern:
+        return ''
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern) and \
+                not pattern[i + 1].isalnum():
+            char = pattern[i + 1]
+            i += 2
+        elif char in _REGEXP_SPECIAL_CHARS:
+            break
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in '*?{':
+            # The last literal is optional or repeated
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+def _like_prefix_filter(query, column, pattern):
+    """Narrow query to rows where column can match the regexp pattern.
+
+    The LIKE only uses the literal prefix of the pattern, so it can use an
+    index on the column but the regexp still has to be checked on the
+    rows it returns.
+    """
+    prefix = _regexp_literal_prefix(pattern)
+    if not prefix:
+        return query
+    for char in ('\\', '%', '_'):
+        prefix = prefix.replace(char, '\\' + char)
+    return query.filter(column.like(prefix + '%', escape='\\'))
+
+
+def _paginate_instance_query(query, sort_key, sort_dir, marker=None):
+    """Sort query by sort_key, then id, and skip everything up to and
+    including the marker instance.
+    """
+    sort_column = getattr(models.Instance, sort_key)
+    if sort_dir == 'desc':
+        query = query.order_by(desc(sort_column)).\
+                      order_by(desc(models.Instance.id))
+    else:
+        query = query.order_by(sort_column).order_by(models.Instance.id)
+    if marker is None:
+        return query
+
+    marker_value = getattr(marker, sort_key)
+    if sort_dir == 'desc':
+        after_marker = or_(sort_column < marker_value,
+                           and_(sort_column == marker_value,
+                                models.Instance.id < marker.id))
+    else:
+        after_marker = or_(sort_column > marker_value,
+                           and_(sort_column == marker_value,
+                                models.Instance.id > marker.id))
+    return query.filter(after_marker)
+
+
 @require_context
-def instance_get_all_by_filters(context, filters):
+def instance_get_all_by_filters(context, filters, sort_key='created_at',
+                                sort_dir='desc', limit=None, marker=None,
+                                columns_to_join=None):
     """Return instances that match all filters.  Deleted instances
     will be returned by default, unless there's a filter that says
-    otherwise"""
+    otherwise.
+
+    Results are sorted by sort_key and sort_dir.  If marker (an instance
+    uuid) is given, only instances sorted after it are returned, and at
+    most limit instances are returned if limit is given.  Only the
+    relationships in columns_to_join are loaded with the instances.
+    """
 
     def _regexp_filter_by_metadata(instance, meta):
         inst_metadata = [{node['key']: node['value']} \
@@ -1250,23 +1544,30 @@ def instance_get_all_by_filters(context, filters):
             filter_dict[column] = value
             return query.filter_by(**filter_dict)
 
+    if sort_dir not in ('asc', 'desc'):
+        raise exception.InvalidInput(
+                reason=_("Invalid sort direction '%s'") % sort_dir)
+    if sort_key not in models.Instance.__table__.columns:
+        raise exception.InvalidInput(
+                reason=_("Invalid sort key '%s'") % sort_key)
+
+    if columns_to_join is None:
+        columns_to_join = _INSTANCE_FILTER_JOINS
+
     session = get_session()
-    query_prefix = session.query(models.Instance).\
-            options(joinedload_all('fixed_ips.floating_ips')).\
-            options(joinedload_all('fixed_ips.network')).\
-            options(joinedload_all('fixed_ips.virtual_interface')).\
-            options(joinedload('info_cache')).\
-            options(joinedload('security_groups')).\
-            options(joinedload('metadata')).\
-            options(joinedload('instance_type')).\
-            order_by(desc(models.Instance.created_at))
+    query_prefix = session.query(models.Instance)
+    for column in columns_to_join:
+        if '.' in column:
+            query_prefix = query_prefix.options(joinedload_all(column))
+        else:
+            query_prefix = query_prefix.options(joinedload(column))
 
     # Make a copy of the filters dictionary to use going forward, as we'll
     # be modifying it and we shouldn't affect the caller's use of it.
     filters = filters.copy()
 
     if 'changes-since' in filters:
-        changes_since = filters['changes-since']
+        changes_since = filters.pop('changes-since')
         query_prefix = query_prefix.\
                             filter(models.Instance.updated_at > changes_since)
 
@@ -1303,31 +1604,78 @@ def instance_get_all_by_filters(context, filters):
         query_prefix = _exact_match_filter(query_prefix, filter_name,
                 filters.pop(filter_name))
 
-    instances = query_prefix.all()
-    if not instances:
-        return []
-
     # Now filter on everything else for regexp matching..
     # For filters not in the list, we'll attempt to use the filter_name
     # as a column name in Instance..
     regexp_filter_funcs = {}
+    python_filters = []
 
     for filter_name in filters.iterkeys():
+        if not hasattr(models.Instance, filter_name):
+            # Not something an instance has, so nothing is filtered out
+            continue
         filter_func = regexp_filter_funcs.get(filter_name, None)
         filter_re = re.compile(str(filters[filter_name]))
         if filter_func:
-            filter_l = lambda instance: filter_func(instance, filter_re)
+            filter_l = lambda instance, filter_func=filter_func, \
+                    filter_re=filter_re: filter_func(instance, filter_re)
         elif filter_name == 'metadata':
-            filter_l = lambda instance: _regexp_filter_by_metadata(instance,
-                    filters[filter_name])
+            filter_l = lambda instance, meta=filters[filter_name]: \
+                    _regexp_filter_by_metadata(instance, meta)
         else:
-            filter_l = lambda instance: _regexp_filter_by_column(instance,
-                    filter_name, filter_re)
-        instances = filter(filter_l, instances)
-        if not instances:
-            break
+            column = models.Instance.__table__.columns.get(filter_name)
+            if column is not None and \
+                    isinstance(column.type, String):
+                # Let the database discard rows that can't match, the
+                # regexp below then only sees the likely candidates.
+                query_prefix = _like_prefix_filter(query_prefix,
+                        getattr(models.Instance, filter_name),
+                        str(filters[filter_name]))
+            filter_l = lambda instance, filter_name=filter_name, \
+                    filter_re=filter_re: _regexp_filter_by_column(instance,
+                            filter_name, filter_re)
+        python_filters.append(filter_l)
+
+    def _matches(instance):
+        for filter_l in python_filters:
+            if not filter_l(instance):
+                return False
+        return True
 
-    return instances
+    if marker is not None:
+        marker_ref = model_query(context, models.Instance,
+                                 read_deleted='yes', project_only=True,
+                                 session=session).\
+                             filter_by(uuid=marker).\
+                             first()
+        if not marker_ref:
+            raise exception.MarkerNotFound(marker=marker)
+        marker = marker_ref
+
+    if not python_filters:
+        query = _paginate_instance_query(query_prefix, sort_key, sort_dir,
+                                         marker)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    if limit is None:
+        query = _paginate_instance_query(query_prefix, sort_key, sort_dir,
+                                         marker)
+        return filter(_matches, query.all())
+
+    # Some filters can only be checked here, so fetch pages of candidates
+    # until we have enough matches rather than loading every instance.
+    instances = []
+    while len(instances) < limit:
+        query = _paginate_instance_query(query_prefix, sort_key, sort_dir,
+                                         marker)
+        page = query.limit(limit).all()
+        instances.extend(filter(_matches, page))
+        if len(page) < limit:
+            break
+        marker = page[-1]
+    return instances[:limit]
 
 
 @require_context
@@ -1423,6 +1771,29 @@ def instance_get_fixed_addresses(context, instance_id):
         return [fixed_ip.address for fixed_ip in fixed_ips]
 
 
+@require_context
+def instance_get_fixed_addresses_by_security_groups(context,
+                                                    security_group_ids):
+    addresses = dict((group_id, []) for group_id in security_group_ids)
+    if not security_group_ids:
+        return addresses
+    association = models.SecurityGroupInstanceAssociation
+    rows = get_session().query(association.security_group_id,
+                               models.FixedIp.address).\
+                filter(association.security_group_id.in_(
+                       security_group_ids)).\
+                filter(association.deleted == False).\
+                filter(association.instance_id == models.Instance.id).\
+                filter(models.Instance.deleted == False).\
+                filter(models.FixedIp.instance_id == models.Instance.id).\
+                filter(models.FixedIp.deleted == False).\
+                order_by(models.FixedIp.id).\
+                all()
+    for group_id, address in rows:
+        addresses[group_id].append(address)
+    return addresses
+
+
 @require_context
 def instance_get_fixed_addresses_v6(context, instance_id):
     session = get_session()
@@ -1493,8 +1864,10 @@ def instance_update(context, instance_id, values):
                                  values.pop('metadata'),
                                  delete=True)
     with session.begin():
+        usage = _instance_usage(instance_ref)
         instance_ref.update(values)
         instance_ref.save(session=session)
+        _project_usage_update(session, usage, _instance_usage(instance_ref))
 
     return instance_ref
 
@@ -1866,6 +2239,7 @@ def network_get_associated_fixed_ips(context, network_id):
     # fixed_ip_get_all_by_network.
     return model_query(context, models.FixedIp, read_deleted="no").\
                     options(joinedload_all('instance')).\
+                    options(joinedload('virtual_interface')).\
                     filter_by(network_id=network_id).\
                     filter(models.FixedIp.instance_id != None).\
                     filter(models.FixedIp.virtual_interface_id != None).\
@@ -2069,10 +2443,19 @@ def quota_get(context, project_id, resource, session=None):
     return result
 
 
+# Maps project_id to (time cached, quotas) for quota_get_all_by_project()
+_quota_cache = {}
+
+
 @require_context
 def quota_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
 
+    cached = _quota_cache.get(project_id)
+    if FLAGS.quota_cache_ttl and cached and \
+            not utils.is_older_than(cached[0], FLAGS.quota_cache_ttl):
+        return dict(cached[1])
+
     rows = model_query(context, models.Quota, read_deleted="no").\
                    filter_by(project_id=project_id).\
                    all()
@@ -2081,6 +2464,8 @@ def quota_get_all_by_project(context, project_id):
     for row in rows:
         result[row.resource] = row.hard_limit
 
+    if FLAGS.quota_cache_ttl:
+        _quota_cache[project_id] = (utils.utcnow(), dict(result))
     return result
 
 
@@ -2091,6 +2476,7 @@ def quota_create(context, project_id, resource, limit):
     quota_ref.resource = resource
     quota_ref.hard_limit = limit
     quota_ref.save()
+    _quota_cache.pop(project_id, None)
     return quota_ref
 
 
@@ -2101,6 +2487,7 @@ def quota_update(context, project_id, resource, limit):
         quota_ref = quota_get(context, project_id, resource, session=session)
         quota_ref.hard_limit = limit
         quota_ref.save(session=session)
+    _quota_cache.pop(project_id, None)
 
 
 @require_admin_context
@@ -2109,6 +2496,7 @@ def quota_destroy(context, project_id, resource):
     with session.begin():
         quota_ref = quota_get(context, project_id, resource, session=session)
         quota_ref.delete(session=session)
+    _quota_cache.pop(project_id, None)
 
 
 @require_admin_context
@@ -2122,6 +2510,91 @@ def quota_destroy_all_by_project(context, project_id):
 
         for quota_ref in quotas:
             quota_ref.delete(session=session)
+    _quota_cache.pop(project_id, None)
+
+
+###################
+
+
+def _project_usage_get(context, project_id, resources, count_func):
+    """Return a dict of how much of each resource project_id is using.
+
+    The usage comes from the project_usages table.  If it hasn't been
+    counted yet, or was counted more than quota_usage_max_age seconds ago,
+    count_func(context, project_id, session) counts it from scratch.
+    """
+    try:
+        return _project_usage_get_or_count(context, project_id, resources,
+                                           count_func)
+    except (IntegrityError, exception.Duplicate):
+        # NOTE(agent): another request created the missing rows first,
+        #              so read them back instead
+        return _project_usage_get_or_count(context, project_id, resources,
+                                           count_func)
+
+
+def _project_usage_get_or_count(context, project_id, resources, count_func):
+    session = get_session()
+    with session.begin():
+        rows = model_query(context, models.ProjectUsage, session=session,
+                           read_deleted="no").\
+                       filter_by(project_id=project_id).\
+                       filter(models.ProjectUsage.resource.in_(resources)).\
+                       all()
+
+        usage = {}
+        usage_refs = {}
+        for usage_ref in rows:
+            usage_refs[usage_ref.resource] = usage_ref
+            counted_at = usage_ref.updated_at or usage_ref.created_at
+            if FLAGS.quota_usage_max_age and \
+                    utils.is_older_than(counted_at,
+                                        FLAGS.quota_usage_max_age):
+                continue
+            usage[usage_ref.resource] = usage_ref.in_use
+
+        if len(usage) < len(resources):
+            usage = count_func(context, project_id, session)
+            now = utils.utcnow()
+            for resource in resources:
+                usage_ref = usage_refs.get(resource)
+                if not usage_ref:
+                    usage_ref = models.ProjectUsage()
+                    usage_ref.project_id = project_id
+                    usage_ref.resource = resource
+                usage_ref.in_use = usage[resource]
+                usage_ref.updated_at = now
+                usage_ref.save(session=session)
+
+    return usage
+
+
+def _project_usage_update(session, before, after):
+    """Apply the change in usage from before to after to project_usages.
+
+    before and after are (project_id, usage) pairs.  Usage that hasn't
+    been counted yet is left alone, it is counted from scratch when first
+    needed.
+    """
+    deltas = {}
+    project_id, usage = before
+    for resource, in_use in usage.iteritems():
+        key = (project_id, resource)
+        deltas[key] = deltas.get(key, 0) - in_use
+    project_id, usage = after
+    for resource, in_use in usage.iteritems():
+        key = (project_id, resource)
+        deltas[key] = deltas.get(key, 0) + in_use
+
+    for (project_id, resource), delta in deltas.iteritems():
+        if not delta or project_id is None:
+            continue
+        session.query(models.ProjectUsage).\
+                filter_by(project_id=project_id).\
+                filter_by(resource=resource).\
+                update({'in_use': models.ProjectUsage.in_use + delta,
+                        'updated_at': literal_column('updated_at')},
+                       synchronize_session=False)
 
 
 ###################
@@ -2172,26 +2645,47 @@ def volume_create(context, values):
     session = get_session()
     with session.begin():
         volume_ref.save(session=session)
+        _project_usage_update(session, (None, {}), _volume_usage(volume_ref))
     return volume_ref
 
 
-@require_admin_context
-def volume_data_get_for_project(context, project_id):
+def _volume_usage_count(context, project_id, session):
     result = model_query(context,
                          func.count(models.Volume.id),
                          func.sum(models.Volume.size),
+                         session=session,
                          read_deleted="no").\
                      filter_by(project_id=project_id).\
                      first()
 
     # NOTE(vish): convert None to 0
-    return (result[0] or 0, result[1] or 0)
+    return {'volumes': result[0] or 0, 'gigabytes': result[1] or 0}
+
+
+def _volume_usage(volume_ref):
+    """Return (project_id, usage) counted against quotas for a volume,
+    as _volume_usage_count() counts it."""
+    if not volume_ref or volume_ref['deleted']:
+        return None, {}
+    return volume_ref['project_id'], {'volumes': 1,
+                                      'gigabytes': volume_ref['size'] or 0}
+
+
+@require_admin_context
+def volume_data_get_for_project(context, project_id):
+    usage = _project_usage_get(context, project_id, ('volumes', 'gigabytes'),
+                               _volume_usage_count)
+    return (usage['volumes'], usage['gigabytes'])
 
 
 @require_admin_context
 def volume_destroy(context, volume_id):
     session = get_session()
     with session.begin():
+        usage = _volume_usage(session.query(models.Volume).\
+                                      filter_by(id=volume_id).\
+                                      first())
+        _project_usage_update(session, usage, (None, {}))
         session.query(models.Volume).\
                 filter_by(id=volume_id).\
                 update({'deleted': True,
@@ -2303,8 +2797,10 @@ def volume_update(context, volume_id, values):
                                 delete=True)
     with session.begin():
         volume_ref = volume_get(context, volume_id, session=session)
+        usage = _volume_usage(volume_ref)
         volume_ref.update(values)
         volume_ref.save(session=session)
+        _project_usage_update(session, usage, _volume_usage(volume_ref))
 
 
 ####################
@@ -2509,6 +3005,16 @@ def block_device_mapping_get_all_by_instance(context, instance_id):
                  all()
 
 
+@require_context
+def block_device_mapping_get_all_by_instances(context, instance_ids):
+    if not instance_ids:
+        return []
+    return _block_device_mapping_get_query(context).\
+                 filter(models.BlockDeviceMapping.instance_id.in_(
+                        instance_ids)).\
+                 all()
+
+
 @require_context
 def block_device_mapping_destroy(context, bdm_id):
     session = get_session()
@@ -3497,6 +4003,40 @@ def bw_usage_update(context,
         bwusage.save(session=session)
 
 
+@require_context
+def bw_usage_update_many(context, start_period, usages):
+    if not usages:
+        return
+
+    session = get_session()
+    with session.begin():
+        instance_ids = set(usage['instance_id'] for usage in usages)
+        bwusages = {}
+        for bwusage in model_query(context, models.BandwidthUsage,
+                                   session=session, read_deleted="yes").\
+                           filter(models.BandwidthUsage.instance_id.in_(
+                                  instance_ids)).\
+                           filter_by(start_period=start_period).\
+                           all():
+            bwusages[(bwusage.instance_id, bwusage.network_label)] = bwusage
+
+        now = utils.utcnow()
+        for usage in usages:
+            key = (usage['instance_id'], usage['network_label'])
+            bwusage = bwusages.get(key)
+            if not bwusage:
+                bwusage = models.BandwidthUsage()
+                bwusage.instance_id = usage['instance_id']
+                bwusage.start_period = start_period
+                bwusage.network_label = usage['network_label']
+                bwusages[key] = bwusage
+
+            bwusage.last_refreshed = now
+            bwusage.bw_in = usage['bw_in']
+            bwusage.bw_out = usage['bw_out']
+            session.add(bwusage)
+
+
 ####################
 
 
@@ -0,0 +1,32 @@
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+
+meta = MetaData()
+
+fixed_ips = Table("fixed_ips", meta, Column("id", Integer(),
+        primary_key=True, nullable=False))
+
+claimed_by = Column("claimed_by", String(255))
+
+
+def upgrade(migrate_engine):
+    meta.bind = migrate_engine
+    fixed_ips.create_column(claimed_by)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    fixed_ips.drop_column(claimed_by)
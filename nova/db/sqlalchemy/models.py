@@ -439,6 +439,26 @@ class Quota(BASE, NovaBase):
     hard_limit = Column(Integer, nullable=True)
 
 
+class ProjectUsage(BASE, NovaBase):
+    """Represents how much of a quota'd resource a project is using.
+
+    Rows are created from the instances, volumes and floating_ips tables
+    the first time a project's usage is needed and are kept up to date
+    in the same transactions that change those tables.
+    """
+
+    __tablename__ = 'project_usages'
+    __table_args__ = (schema.UniqueConstraint("project_id", "resource",
+                                              "deleted"),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255), index=True)
+
+    resource = Column(String(255))
+    in_use = Column(Integer, nullable=False, default=0)
+
+
 class Snapshot(BASE, NovaBase):
     """Represents a block storage device that can be attached to a vm."""
     __tablename__ = 'snapshots'
@@ -664,6 +684,10 @@ class VirtualInterface(BASE, NovaBase):
     id = Column(Integer, primary_key=True)
     address = Column(String(255), unique=True)
     network_id = Column(Integer, nullable=False)
+    network = relationship(Network,
+                           foreign_keys=network_id,
+                           primaryjoin='VirtualInterface.network_id == '
+                                       'Network.id')
     instance_id = Column(Integer, nullable=False)
     uuid = Column(String(36))
 
@@ -694,6 +718,8 @@ class FixedIp(BASE, NovaBase):
     leased = Column(Boolean, default=False)
     reserved = Column(Boolean, default=False)
     host = Column(String(255))
+    # claimed_by is the network host that has set the ip aside to hand out
+    claimed_by = Column(String(255))
 
 
 class FloatingIp(BASE, NovaBase):
@@ -938,7 +964,7 @@ def register_models():
               VolumeMetadata, VolumeTypes, VolumeTypeExtraSpecs,
               AgentBuild, InstanceMetadata, InstanceTypeExtraSpecs, Migration,
               VirtualStorageArray, SMFlavors, SMBackendConf, SMVolume,
-              InstanceFault)
+              InstanceFault, ProjectUsage)
     engine = create_engine(FLAGS.sql_connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
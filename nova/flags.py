@@ -429,6 +429,10 @@ DEFINE_bool('resume_guests_state_on_host_boot', False,
 
 DEFINE_string('root_helper', 'sudo',
               'Command prefix to use for running commands as root')
+DEFINE_string('root_helper_daemon', None,
+              'Command to start a root wrapper daemon that commands are run '
+              'as root through instead of root_helper, e.g. '
+              '"sudo nova-rootwrap-daemon"')
 
 DEFINE_string('network_driver', 'nova.network.linux_net',
               'Driver to use for network creation')
@@ -21,6 +21,7 @@ from __future__ import absolute_import
 
 import copy
 import datetime
+import hashlib
 import json
 import random
 import time
@@ -250,9 +251,21 @@ class GlanceImageService(object):
                     raise
             time.sleep(1)
 
+        # NOTE(agent): verify the image data against the checksum glance has
+        #              recorded for it while it is streamed, rather than
+        #              reading the written image back
+        checksum = hashlib.md5()
         for chunk in image_chunks:
+            checksum.update(chunk)
             data.write(chunk)
 
+        expected = image_meta.get('checksum')
+        actual = checksum.hexdigest()
+        if expected and actual != expected:
+            raise exception.ImageUnacceptable(image_id=image_id,
+                    reason=_("checksum %(actual)s does not match the "
+                             "expected %(expected)s") % locals())
+
         base_image_meta = self._translate_from_glance(image_meta)
         return base_image_meta
 
@@ -19,14 +19,14 @@
 """Proxy AMI-related calls from cloud controller to objectstore service."""
 
 import binascii
+import collections
 import os
-import shutil
 import tarfile
-import tempfile
 from xml.etree import ElementTree
 
 import boto.s3.connection
 import eventlet
+from eventlet.green import subprocess
 
 from nova import crypto
 import nova.db.api
@@ -40,8 +40,9 @@ from nova.api.ec2 import ec2utils
 
 LOG = logging.getLogger("nova.image.s3")
 FLAGS = flags.FLAGS
-flags.DEFINE_string('image_decryption_dir', '/tmp',
-                    'parent dir for tempdir used for image decryption')
+flags.DEFINE_integer('s3_image_part_concurrency', 4,
+                     'number of part files of a bundled image to download '
+                     'from s3 at once while registering it')
 flags.DEFINE_string('s3_access_key', 'notchecked',
                     'access key to use for s3 server for images')
 flags.DEFINE_string('s3_secret_key', 'notchecked',
@@ -153,11 +154,37 @@ class S3ImageService(object):
                                                host=FLAGS.s3_host)
 
     @staticmethod
-    def _download_file(bucket, filename, local_dir):
-        key = bucket.get_key(filename)
-        local_filename = os.path.join(local_dir, os.path.basename(filename))
-        key.get_contents_to_filename(local_filename)
-        return local_filename
+    def _download_part(bucket, filename):
+        return bucket.get_key(filename).get_contents_as_string()
+
+    def _download_parts(self, bucket, filenames):
+        """Yields the contents of the part files in order, downloading up
+        to s3_image_part_concurrency of them at once."""
+        pool = eventlet.GreenPool(FLAGS.s3_image_part_concurrency)
+        downloads = collections.deque()
+        for filename in filenames:
+            downloads.append(pool.spawn(self._download_part, bucket,
+                                        filename))
+            if len(downloads) == FLAGS.s3_image_part_concurrency:
+                yield downloads.popleft().wait()
+        while downloads:
+            yield downloads.popleft().wait()
+
+    def _write_parts(self, bucket, filenames, pipe):
+        """Writes the downloaded part files to pipe, closing it after."""
+        try:
+            for part in self._download_parts(bucket, filenames):
+                try:
+                    pipe.write(part)
+                except IOError:
+                    # NOTE(agent): the decryption was stopped, which is
+                    #              reported as the failure rather than this
+                    return
+        finally:
+            try:
+                pipe.close()
+            except IOError:
+                pass
 
     def _s3_parse_manifest(self, context, metadata, manifest):
         manifest = ElementTree.fromstring(manifest)
@@ -250,8 +277,6 @@ class S3ImageService(object):
     def _s3_create(self, context, metadata):
         """Gets a manifext from s3 and makes an image."""
 
-        image_path = tempfile.mkdtemp(dir=FLAGS.image_decryption_dir)
-
         image_location = metadata['properties']['image_location']
         bucket_name = image_location.split('/')[0]
         manifest_path = image_location[len(bucket_name) + 1:]
@@ -263,38 +288,16 @@ class S3ImageService(object):
                                                               metadata,
                                                               manifest)
 
-        def delayed_create():
-            """This handles the fetching and decrypting of the part files."""
-            log_vars = {'image_location': image_location,
-                        'image_path': image_path}
-            metadata['properties']['image_state'] = 'downloading'
+        def set_image_state(image_state):
+            metadata['properties']['image_state'] = image_state
             self.service.update(context, image_uuid, metadata)
 
-            try:
-                parts = []
-                elements = manifest.find('image').getiterator('filename')
-                for fn_element in elements:
-                    part = self._download_file(bucket,
-                                               fn_element.text,
-                                               image_path)
-                    parts.append(part)
-
-                # NOTE(vish): this may be suboptimal, should we use cat?
-                enc_filename = os.path.join(image_path, 'image.encrypted')
-                with open(enc_filename, 'w') as combined:
-                    for filename in parts:
-                        with open(filename) as part:
-                            shutil.copyfileobj(part, combined)
-
-            except Exception:
-                LOG.exception(_("Failed to download %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_download'
-                self.service.update(context, image_uuid, metadata)
-                return
-
-            metadata['properties']['image_state'] = 'decrypting'
-            self.service.update(context, image_uuid, metadata)
+        def delayed_create():
+            """This streams the part files through decryption and untarring
+            straight into the image service, without staging them on disk.
+            """
+            log_vars = {'image_location': image_location}
+            set_image_state('downloading')
 
             try:
                 hex_key = manifest.find('image/ec2_encrypted_key').text
@@ -306,55 +309,81 @@ class S3ImageService(object):
                 #              any host.
                 cloud_pk = crypto.key_path(context.project_id)
 
-                dec_filename = os.path.join(image_path, 'image.tar.gz')
-                self._decrypt_image(enc_filename, encrypted_key,
-                                    encrypted_iv, cloud_pk,
-                                    dec_filename)
+                key, iv = self._decrypt_image_key(encrypted_key, encrypted_iv,
+                                                  cloud_pk)
+                decrypter = self._start_decrypter(key, iv)
             except Exception:
-                LOG.exception(_("Failed to decrypt %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_decrypt'
-                self.service.update(context, image_uuid, metadata)
+                LOG.exception(_("Failed to decrypt %(image_location)s"),
+                              log_vars)
+                set_image_state('failed_decrypt')
                 return
 
-            metadata['properties']['image_state'] = 'untarring'
-            self.service.update(context, image_uuid, metadata)
+            filenames = [fn_element.text for fn_element in
+                         manifest.find('image').getiterator('filename')]
+            writer = eventlet.spawn(self._write_parts, bucket, filenames,
+                                    decrypter.stdin)
 
+            # NOTE(agent): downloading, decrypting, untarring and uploading all
+            #              happen at once, so a failure is blamed on the
+            #              earliest stage that failed rather than on where it
+            #              surfaced
+            failed_state = None
             try:
-                unz_filename = self._untarzip_image(image_path, dec_filename)
+                image_file, size = self._image_from_tarball(decrypter.stdout)
             except Exception:
-                LOG.exception(_("Failed to untar %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_untar'
-                self.service.update(context, image_uuid, metadata)
-                return
+                failed_state = 'failed_untar'
+                LOG.exception(_("Failed to untar %(image_location)s"),
+                              log_vars)
+            else:
+                metadata['size'] = size
+                set_image_state('uploading')
+                try:
+                    self.service.update(context, image_uuid, metadata,
+                                        image_file)
+                except Exception:
+                    failed_state = 'failed_upload'
+                    LOG.exception(_("Failed to upload %(image_location)s"),
+                                  log_vars)
+
+            decrypter_killed = False
+            if not failed_state:
+                # NOTE(agent): read whatever follows the image in the tarball,
+                #              so the decryption isn't left blocked writing it
+                #              out
+                for _chunk in iter(lambda: decrypter.stdout.read(65536), ''):
+                    pass
+            elif decrypter.poll() is None:
+                decrypter.kill()
+                decrypter_killed = True
 
-            metadata['properties']['image_state'] = 'uploading'
-            self.service.update(context, image_uuid, metadata)
             try:
-                with open(unz_filename) as image_file:
-                    self.service.update(context, image_uuid,
-                                        metadata, image_file)
+                writer.wait()
             except Exception:
-                LOG.exception(_("Failed to upload %(image_location)s "
-                                "to %(image_path)s"), log_vars)
-                metadata['properties']['image_state'] = 'failed_upload'
-                self.service.update(context, image_uuid, metadata)
+                failed_state = 'failed_download'
+                LOG.exception(_("Failed to download %(image_location)s"),
+                              log_vars)
+
+            if decrypter.wait() and not decrypter_killed and \
+               failed_state != 'failed_download':
+                failed_state = 'failed_decrypt'
+                LOG.error(_("Failed to decrypt %(image_location)s: "
+                            "%(err)s"),
+                          dict(log_vars, err=decrypter.stderr.read()))
+
+            if failed_state:
+                set_image_state(failed_state)
                 return
 
             metadata['properties']['image_state'] = 'available'
             metadata['status'] = 'active'
             self.service.update(context, image_uuid, metadata)
 
-            shutil.rmtree(image_path)
-
         eventlet.spawn_n(delayed_create)
 
         return image
 
     @staticmethod
-    def _decrypt_image(encrypted_filename, encrypted_key, encrypted_iv,
-                       cloud_private_key, decrypted_filename):
+    def _decrypt_image_key(encrypted_key, encrypted_iv, cloud_private_key):
         key, err = utils.execute('openssl',
                                  'rsautl',
                                  '-decrypt',
@@ -373,35 +402,45 @@ class S3ImageService(object):
         if err:
             raise exception.Error(_('Failed to decrypt initialization '
                                     'vector: %s') % err)
-
-        _out, err = utils.execute('openssl', 'enc',
-                                  '-d', '-aes-128-cbc',
-                                  '-in', '%s' % (encrypted_filename,),
-                                  '-K', '%s' % (key,),
-                                  '-iv', '%s' % (iv,),
-                                  '-out', '%s' % (decrypted_filename,),
-                                  check_exit_code=False)
-        if err:
-            raise exception.Error(_('Failed to decrypt image file '
-                                    '%(image_file)s: %(err)s') %
-                                    {'image_file': encrypted_filename,
-                                     'err': err})
+        return key, iv
 
     @staticmethod
-    def _test_for_malicious_tarball(path, filename):
-        """Raises exception if extracting tarball would escape extract path"""
-        tar_file = tarfile.open(filename, 'r|gz')
-        for n in tar_file.getnames():
-            if not os.path.abspath(os.path.join(path, n)).startswith(path):
-                tar_file.close()
-                raise exception.Error(_('Unsafe filenames in image'))
-        tar_file.close()
+    def _start_decrypter(key, iv):
+        """Starts an openssl process decrypting its stdin to its stdout."""
+        return subprocess.Popen(['openssl', 'enc',
+                                 '-d', '-aes-128-cbc',
+                                 '-K', '%s' % (key,),
+                                 '-iv', '%s' % (iv,)],
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
 
     @staticmethod
-    def _untarzip_image(path, filename):
-        S3ImageService._test_for_malicious_tarball(path, filename)
-        tar_file = tarfile.open(filename, 'r|gz')
-        tar_file.extractall(path)
-        image_file = tar_file.getnames()[0]
-        tar_file.close()
-        return os.path.join(path, image_file)
+    def _image_from_tarball(tarball):
+        """Returns a reader of the image, the first file of the gzipped tar
+        stream tarball, and its size.
+
+        Nothing is extracted to disk, but tarballs whose filenames would
+        escape the directory they are extracted to are still refused.
+        """
+        tar_file = tarfile.open(fileobj=tarball, mode='r|gz')
+        member = tar_file.next()
+        if member is None:
+            raise exception.Error(_('No image in tarball'))
+        name = os.path.normpath(member.name)
+        if os.path.isabs(name) or name.split(os.sep)[0] == os.pardir:
+            raise exception.Error(_('Unsafe filenames in image'))
+        if not member.isfile():
+            raise exception.Error(_('Image %s is not a file') % member.name)
+        return _StreamReader(tar_file.extractfile(member)), member.size
+
+
+class _StreamReader(object):
+    """Only exposes read, so the image service streams the data instead of
+    seeking around it to find its size."""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, size=None):
+        return self._stream.read(size)
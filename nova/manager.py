@@ -167,6 +167,14 @@ class Manager(base.Base):
         """
         pass
 
+    def cleanup_host(self):
+        """Handle cleanup when the service is stopped.
+
+        Child classes should override this method.
+
+        """
+        pass
+
     def service_version(self, context):
         return version.version_string()
 
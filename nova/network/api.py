@@ -177,6 +177,20 @@ class API(base.Base):
                 raise exception.InstanceNotFound(instance_id=instance['id'])
             raise
 
+    def get_instances_nw_info(self, context, instances):
+        """Returns the network info of several instances in one call.
+
+        :returns: dict mapping each instance uuid to its network info
+        """
+        args = {'instances': [
+                {'instance_id': instance['id'],
+                 'instance_uuid': instance['uuid'],
+                 'instance_type_id': instance['instance_type_id'],
+                 'host': instance['host']} for instance in instances]}
+        return rpc.call(context, FLAGS.network_topic,
+                        {'method': 'get_instances_nw_info',
+                         'args': args})
+
     def validate_networks(self, context, requested_networks):
         """validate the networks passed at the time of creating
         the server
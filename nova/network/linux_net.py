@@ -22,6 +22,9 @@ import calendar
 import inspect
 import netaddr
 import os
+import time
+
+from eventlet import greenthread
 
 from nova import db
 from nova import exception
@@ -69,6 +72,10 @@ flags.DEFINE_bool('send_arp_for_ha', False,
 flags.DEFINE_bool('use_single_default_gateway',
                    False, 'Use single default gateway. Only first nic of vm'
                           ' will get default gateway from dhcp server')
+flags.DEFINE_integer('dnsmasq_hup_interval', 0,
+                     'Minimum seconds between two reloads of a dnsmasq, '
+                     'changes made in between are picked up by one delayed '
+                     'reload. 0 reloads on every change')
 binary_name = os.path.basename(inspect.stack()[-1][1])
 
 
@@ -204,6 +211,13 @@ class IptablesTable(object):
         for rule in chained_rules:
             self.rules.remove(rule)
 
+    def state(self):
+        """Return a snapshot of the chains and rules, for comparing the
+        table with how it was when it was last applied."""
+        return (frozenset(self.chains), frozenset(self.unwrapped_chains),
+                tuple((rule.chain, rule.rule, rule.wrap, rule.top)
+                      for rule in self.rules))
+
 
 class IptablesManager(object):
     """Wrapper for iptables.
@@ -287,7 +301,12 @@ class IptablesManager(object):
         self.ipv4['nat'].add_chain('float-snat')
         self.ipv4['nat'].add_rule('snat', '-j $float-snat')
 
-    @utils.synchronized('iptables', external=True)
+        # The state of each table as of its last iptables-restore, keyed
+        # by (command, table name).
+        self._applied = {}
+        self._apply_requested = 0
+        self._apply_done = 0
+
     def apply(self):
         """Apply the current in-memory set of iptables rules.
 
@@ -295,13 +314,30 @@ class IptablesManager(object):
         same component of Nova, and replace them with our current set of
         rules. This happens atomically, thanks to iptables-restore.
 
+        Calls that queue up behind an apply in progress are served by a
+        single apply, and tables that haven't changed since they were last
+        applied are left alone.
+
         """
+        self._apply_requested += 1
+        self._apply(self._apply_requested)
+
+    @utils.synchronized('iptables', external=True)
+    def _apply(self, request):
+        if request <= self._apply_done:
+            # Another caller applied our changes while we were waiting
+            return
+        generation = self._apply_requested
+
         s = [('iptables', self.ipv4)]
         if FLAGS.use_ipv6:
             s += [('ip6tables', self.ipv6)]
 
         for cmd, tables in s:
             for table in tables:
+                state = tables[table].state()
+                if self._applied.get((cmd, table)) == state:
+                    continue
                 current_table, _ = self.execute('%s-save' % (cmd,),
                                                 '-t', '%s' % (table,),
                                                 run_as_root=True,
@@ -312,6 +348,8 @@ class IptablesManager(object):
                 self.execute('%s-restore' % (cmd,), run_as_root=True,
                              process_input='\n'.join(new_filter),
                              attempts=5)
+                self._applied[(cmd, table)] = state
+        self._apply_done = generation
 
     def _modify_rules(self, current_lines, table, binary=None):
         unwrapped_chains = table.unwrapped_chains
@@ -333,16 +371,20 @@ class IptablesManager(object):
                     break
 
         our_rules = []
+        top_rules = set()
         for rule in rules:
             rule_str = str(rule)
             if rule.top:
-                # rule.top == True means we want this rule to be at the top.
-                # Further down, we weed out duplicates from the bottom of the
-                # list, so here we remove the dupes ahead of time.
-                new_filter = filter(lambda s: s.strip() != rule_str.strip(),
-                                    new_filter)
+                top_rules.add(rule_str.strip())
             our_rules += [rule_str]
 
+        # rule.top == True means we want this rule to be at the top.
+        # Further down, we weed out duplicates from the bottom of the
+        # list, so here we remove the dupes ahead of time.
+        if top_rules:
+            new_filter = [line for line in new_filter
+                          if line.strip() not in top_rules]
+
         new_filter[rules_index:rules_index] = our_rules
 
         new_filter[rules_index:rules_index] = [':%s - [0:0]' % \
@@ -373,8 +415,16 @@ class IptablesManager(object):
 # NOTE(jkoelker) This is just a nice little stub point since mocking
 #                builtins with mox is a nightmare
 def write_to_file(file, data, mode='w'):
-    with open(file, mode) as f:
+    if mode != 'w':
+        with open(file, mode) as f:
+            f.write(data)
+        return
+    # NOTE(agent): replace the file in one go, so that a dnsmasq reloading it
+    #              never reads it half written
+    tmp_file = '%s.tmp' % file
+    with open(tmp_file, mode) as f:
         f.write(data)
+    os.rename(tmp_file, file)
 
 
 def ensure_path(path):
@@ -524,12 +574,11 @@ def initialize_gateway_device(dev, network_ref):
                 _execute('route', 'del', 'default', 'gw', gateway,
                          'dev', dev, check_exit_code=False,
                          run_as_root=True)
-        for ip_params in old_ip_params:
-            _execute(*_ip_bridge_cmd('del', ip_params, dev),
-                        run_as_root=True)
-        for ip_params in new_ip_params:
-            _execute(*_ip_bridge_cmd('add', ip_params, dev),
-                        run_as_root=True)
+        _execute_many([_ip_bridge_cmd('del', params, dev)
+                       for params in old_ip_params] +
+                      [_ip_bridge_cmd('add', params, dev)
+                       for params in new_ip_params],
+                      run_as_root=True)
         if gateway:
             _execute('route', 'add', 'default', 'gw', gateway,
                         run_as_root=True)
@@ -595,11 +644,11 @@ def get_dhcp_opts(context, network_ref):
         instance_set = set([fixed_ip_ref['instance_id']
                             for fixed_ip_ref in ips_ref])
         default_gw_network_node = {}
-        for instance_id in instance_set:
-            vifs = db.virtual_interface_get_by_instance(context, instance_id)
-            if vifs:
-                #offer a default gateway to the first virtual interface
-                default_gw_network_node[instance_id] = vifs[0]['network_id']
+        for vif in db.virtual_interface_get_by_instances(context,
+                                                         list(instance_set)):
+            #offer a default gateway to the first virtual interface
+            default_gw_network_node.setdefault(vif['instance_id'],
+                                               vif['network_id'])
 
         for fixed_ip_ref in ips_ref:
             instance_id = fixed_ip_ref['instance_id']
@@ -615,10 +664,19 @@ def release_dhcp(dev, address, mac_address):
     utils.execute('dhcp_release', dev, address, mac_address, run_as_root=True)
 
 
+# The hosts file last written for each device by update_dhcp
+_dhcp_hosts = {}
+
+
 def update_dhcp(context, dev, network_ref):
     conffile = _dhcp_file(dev, 'conf')
-    write_to_file(conffile, get_dhcp_hosts(context, network_ref))
+    hosts = get_dhcp_hosts(context, network_ref)
+    if _dhcp_hosts.get(dev) == hosts and _dnsmasq_running(dev):
+        # dnsmasq already serves these hosts
+        return
+    write_to_file(conffile, hosts)
     restart_dhcp(context, dev, network_ref)
+    _dhcp_hosts[dev] = hosts
 
 
 def update_dhcp_hostfile_with_text(dev, hosts_text):
@@ -661,6 +719,8 @@ def restart_dhcp(context, dev, network_ref):
         # Using symlinks can cause problems here so just compare the name
         # of the file itself
         if conffile.split("/")[-1] in out:
+            if _delay_dnsmasq_hup(dev):
+                return
             try:
                 _execute('kill', '-HUP', pid, run_as_root=True)
                 return
@@ -696,6 +756,49 @@ def restart_dhcp(context, dev, network_ref):
     _add_dnsmasq_accept_rules(dev)
 
 
+# When each device's dnsmasq was last sent a HUP, and the devices with a
+# delayed HUP pending
+_dnsmasq_hup_times = {}
+_dnsmasq_delayed_hups = set()
+
+
+def _delay_dnsmasq_hup(dev):
+    """Put off reloading dnsmasq if it was reloaded too recently.
+
+    Returns True if the HUP has been left to a delayed one.
+
+    """
+    if not FLAGS.dnsmasq_hup_interval:
+        return False
+    now = time.time()
+    wait = _dnsmasq_hup_times.get(dev, 0) + FLAGS.dnsmasq_hup_interval - now
+    if wait <= 0:
+        _dnsmasq_hup_times[dev] = now
+        return False
+    if dev not in _dnsmasq_delayed_hups:
+        _dnsmasq_delayed_hups.add(dev)
+        greenthread.spawn_after(wait, _delayed_dnsmasq_hup, dev)
+    return True
+
+
+def _delayed_dnsmasq_hup(dev):
+    _dnsmasq_delayed_hups.discard(dev)
+    _dnsmasq_hup_times[dev] = time.time()
+    pid = _dnsmasq_pid_for(dev)
+    if not pid:
+        return
+    try:
+        _execute('kill', '-HUP', pid, run_as_root=True)
+    except Exception as exc:  # pylint: disable=W0703
+        LOG.debug(_('Hupping dnsmasq threw %s'), exc)
+
+
+def _dnsmasq_running(dev):
+    """Check whether the dnsmasq for a bridge/device is still alive."""
+    pid = _dnsmasq_pid_for(dev)
+    return pid is not None and os.path.exists('/proc/%d' % pid)
+
+
 @utils.synchronized('radvd_start')
 def update_ra(context, dev, network_ref):
     conffile = _ra_file(dev, 'conf')
@@ -791,6 +894,16 @@ def _execute(*cmd, **kwargs):
         return utils.execute(*cmd, **kwargs)
 
 
+def _execute_many(cmds, **kwargs):
+    """Wrapper around utils.execute_many for fake_network."""
+    if FLAGS.fake_network:
+        for cmd in cmds:
+            LOG.debug('FAKE NET: %s', ' '.join(map(str, cmd)))
+        return [('fake', 0) for cmd in cmds]
+    else:
+        return utils.execute_many(cmds, **kwargs)
+
+
 def _device_exists(device):
     """Check if ethernet device exists."""
     (_out, err) = _execute('ip', 'link', 'show', 'dev', device,
@@ -994,14 +1107,14 @@ class LinuxBridgeInterfaceDriver(LinuxNetInterfaceDriver):
                              run_as_root=True)
             out, err = _execute('ip', 'addr', 'show', 'dev', interface,
                                 'scope', 'global', run_as_root=True)
+            ip_cmds = []
             for line in out.split('\n'):
                 fields = line.split()
                 if fields and fields[0] == 'inet':
                     params = fields[1:-1]
-                    _execute(*_ip_bridge_cmd('del', params, fields[-1]),
-                                run_as_root=True)
-                    _execute(*_ip_bridge_cmd('add', params, bridge),
-                                run_as_root=True)
+                    ip_cmds.append(_ip_bridge_cmd('del', params, fields[-1]))
+                    ip_cmds.append(_ip_bridge_cmd('add', params, bridge))
+            _execute_many(ip_cmds, run_as_root=True)
             if old_gateway:
                 _execute('route', 'add', 'default', 'gw', old_gateway,
                             run_as_root=True)
@@ -44,6 +44,7 @@ topologies.  All of the network commands are issued to a subclass of
 
 """
 
+import collections
 import datetime
 import itertools
 import math
@@ -104,6 +105,11 @@ flags.DEFINE_bool('update_dhcp_on_disassociate', False,
                   'Whether to update dhcp when fixed_ip is disassociated')
 flags.DEFINE_integer('fixed_ip_disassociate_timeout', 600,
                      'Seconds after which a deallocated ip is disassociated')
+flags.DEFINE_integer('fixed_ip_pool_size', 0,
+                     'Number of fixed ips a network host claims at once and '
+                     'hands out without locking the fixed_ips table; claimed '
+                     'ips are not available to other hosts until used or '
+                     'released. 0 disables claiming')
 flags.DEFINE_integer('create_unique_mac_address_attempts', 5,
                      'Number of attempts to create unique mac address')
 flags.DEFINE_bool('auto_assign_floating_ip', False,
@@ -491,6 +497,8 @@ class NetworkManager(manager.SchedulerDependentManager):
         self.floating_dns_manager = temp
         self.network_api = network_api.API()
         self.compute_api = compute_api.API()
+        # NOTE(agent): fixed ips claimed by this host, keyed by network id
+        self._fixed_ip_pools = {}
         super(NetworkManager, self).__init__(service_name='network',
                                                 *args, **kwargs)
 
@@ -526,9 +534,48 @@ class NetworkManager(manager.SchedulerDependentManager):
         # NOTE(vish): Set up networks for which this host already has
         #             an ip address.
         ctxt = context.get_admin_context()
+        # NOTE(agent): drop whatever a previous run of this host left claimed
+        self.db.fixed_ip_release_claimed(ctxt, self.host)
         for network in self.db.network_get_all_by_host(ctxt, self.host):
             self._setup_network(ctxt, network)
 
+    def cleanup_host(self):
+        """Return the fixed ips this host claimed but did not use."""
+        self._fixed_ip_pools = {}
+        ctxt = context.get_admin_context()
+        self.db.fixed_ip_release_claimed(ctxt, self.host)
+
+    def _associate_pool_address(self, context, network_id, instance_id):
+        """Associate a free fixed ip in the network with the instance.
+
+        With fixed_ip_pool_size set, addresses are handed out from a block
+        claimed by this host instead of locking the fixed_ips table for
+        every allocation.
+        """
+        if FLAGS.fixed_ip_pool_size <= 0:
+            return self.db.fixed_ip_associate_pool(context.elevated(),
+                                                   network_id,
+                                                   instance_id)
+        elevated = context.elevated()
+        pool = self._fixed_ip_pools.setdefault(network_id,
+                                               collections.deque())
+        while True:
+            if not pool:
+                size = FLAGS.fixed_ip_pool_size
+                addresses = self.db.fixed_ip_claim_pool(elevated,
+                                                        network_id,
+                                                        self.host,
+                                                        size)
+                if not addresses:
+                    raise exception.NoMoreFixedIps()
+                pool.extend(addresses)
+            address = pool.popleft()
+            # NOTE(agent): the ip may have been taken explicitly since it was
+            #              claimed, in which case just move on to the next one
+            if self.db.fixed_ip_associate_claimed(elevated, address,
+                                                  instance_id, self.host):
+                return address
+
     @manager.periodic_task
     def _disassociate_stale_fixed_ips(self, context):
         if self.timeout_fixed_ips:
@@ -564,51 +611,62 @@ class NetworkManager(manager.SchedulerDependentManager):
         return []
 
     def get_instance_uuids_by_ip_filter(self, context, filters):
-        fixed_ip_filter = filters.get('fixed_ip')
-        ip_filter = re.compile(str(filters.get('ip')))
-        ipv6_filter = re.compile(str(filters.get('ip6')))
-
-        # NOTE(jkoelker) Should probably figure out a better way to do
-        #                this. But for now it "works", this could suck on
-        #                large installs.
-
-        vifs = self.db.virtual_interface_get_all(context)
         results = []
-
-        for vif in vifs:
-            if vif['instance_id'] is None:
-                continue
-
-            network = self.db.network_get(context, vif['network_id'])
-            fixed_ipv6 = None
-            if network['cidr_v6'] is not None:
+        if filters.get('fixed_ip'):
+            try:
+                fixed_ip = self.db.fixed_ip_get_by_address(
+                        context.elevated(), filters['fixed_ip'])
+            except exception.FixedIpNotFoundForAddress:
+                fixed_ip = None
+            if (fixed_ip and fixed_ip['instance_id'] and
+                not fixed_ip['deleted']):
+                results.append({'instance_id': fixed_ip['instance_id'],
+                                'ip': fixed_ip['address']})
+
+        if filters.get('ip'):
+            # NOTE(agent): the addresses are indexed, so only the rows
+            #              sharing the literal prefix of the regexp are
+            #              read back.
+            ip_filter = str(filters['ip'])
+            matched_fixed_ips = set()
+            for fixed_ip in self.db.fixed_ip_get_all_by_address_regexp(
+                    context, ip_filter):
+                matched_fixed_ips.add(fixed_ip['id'])
+                results.append({'instance_id': fixed_ip['instance_id'],
+                                'ip': fixed_ip['address']})
+            for floating_ip in self.db.floating_ip_get_all_by_address_regexp(
+                    context, ip_filter):
+                fixed_ip = floating_ip['fixed_ip']
+                if fixed_ip['id'] in matched_fixed_ips:
+                    continue
+                results.append({'instance_id': fixed_ip['instance_id'],
+                                'ip': floating_ip['address']})
+
+        if filters.get('ip6'):
+            # NOTE(jkoelker) Should probably figure out a better way to do
+            #                this. But for now it "works", this could suck on
+            #                large installs.
+            #                The v6 addresses are derived from the mac and
+            #                aren't stored, so every vif is still looked at.
+            ipv6_filter = re.compile(str(filters['ip6']))
+            networks = {}
+            for vif in self.db.virtual_interface_get_all(context):
+                if vif['instance_id'] is None:
+                    continue
+                network_id = vif['network_id']
+                if network_id not in networks:
+                    networks[network_id] = self.db.network_get(context,
+                                                               network_id)
+                network = networks[network_id]
+                if network['cidr_v6'] is None:
+                    continue
                 fixed_ipv6 = ipv6.to_global(network['cidr_v6'],
                                             vif['address'],
                                             context.project_id)
-
-            if fixed_ipv6 and ipv6_filter.match(fixed_ipv6):
-                # NOTE(jkoelker) Will need to update for the UUID flip
-                results.append({'instance_id': vif['instance_id'],
-                                'ip': fixed_ipv6})
-
-            for fixed_ip in vif['fixed_ips']:
-                if not fixed_ip or not fixed_ip['address']:
-                    continue
-                if fixed_ip['address'] == fixed_ip_filter:
-                    results.append({'instance_id': vif['instance_id'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                if ip_filter.match(fixed_ip['address']):
+                if ipv6_filter.match(fixed_ipv6):
+                    # NOTE(jkoelker) Will need to update for the UUID flip
                     results.append({'instance_id': vif['instance_id'],
-                                    'ip': fixed_ip['address']})
-                    continue
-                for floating_ip in fixed_ip.get('floating_ips', []):
-                    if not floating_ip or not floating_ip['address']:
-                        continue
-                    if ip_filter.match(floating_ip['address']):
-                        results.append({'instance_id': vif['instance_id'],
-                                        'ip': floating_ip['address']})
-                        continue
+                                    'ip': fixed_ipv6})
 
         # NOTE(jkoelker) Until we switch over to instance_uuid ;)
         ids = [res['instance_id'] for res in results]
@@ -700,11 +758,66 @@ class NetworkManager(manager.SchedulerDependentManager):
 
         vifs = self.db.virtual_interface_get_by_instance(context, instance_id)
         instance_type = instance_types.get_instance_type(instance_type_id)
+        return self._build_instance_nw_info(context, instance_uuid,
+                                            instance_type, host, vifs,
+                                            fixed_ips, {}, {})
+
+    def get_instances_nw_info(self, context, instances):
+        """Creates network info lists for several instances at once.
+
+        The fixed ips and virtual interfaces of all the instances are
+        fetched in one query each, and networks, dhcp servers and instance
+        types are only looked up once however many instances share them.
+
+        :param instances: list of dicts with the instance_id, instance_uuid,
+                          instance_type_id and host of each instance, as
+                          taken by get_instance_nw_info
+        :returns: dict mapping each instance uuid to its network info list
+        """
+        instance_ids = [instance['instance_id'] for instance in instances]
+        fixed_ips = {}
+        for fixed_ip in self.db.fixed_ip_get_by_instances(context,
+                                                          instance_ids):
+            fixed_ips.setdefault(fixed_ip['instance_id'], []).append(fixed_ip)
+        vifs = {}
+        for vif in self.db.virtual_interface_get_by_instances(context,
+                                                              instance_ids):
+            vifs.setdefault(vif['instance_id'], []).append(vif)
+
+        networks = {}
+        dhcp_ips = {}
+        instance_type_refs = {}
+        network_infos = {}
+        for instance in instances:
+            instance_id = instance['instance_id']
+            instance_type_id = instance['instance_type_id']
+            if instance_type_id not in instance_type_refs:
+                instance_type_refs[instance_type_id] = \
+                        instance_types.get_instance_type(instance_type_id)
+            network_infos[instance['instance_uuid']] = \
+                    self._build_instance_nw_info(context,
+                            instance['instance_uuid'],
+                            instance_type_refs[instance_type_id],
+                            instance['host'],
+                            vifs.get(instance_id, []),
+                            fixed_ips.get(instance_id, []),
+                            networks, dhcp_ips)
+        return network_infos
+
+    def _build_instance_nw_info(self, context, instance_uuid, instance_type,
+                                host, vifs, fixed_ips, networks, dhcp_ips):
+        """Builds the network info list of one instance and refreshes its
+        info cache.
+
+        networks and dhcp_ips memoize network refs by id and dhcp servers
+        by (network id, host) so callers can share them between instances.
+        """
         network_info = []
         # a vif has an address, instance_id, and network_id
         # it is also joined to the instance and network given by those IDs
         for vif in vifs:
-            network = self.db.network_get(context, vif['network_id'])
+            network = self._get_network_memo(context, networks,
+                                             vif['network_id'])
 
             if network is None:
                 continue
@@ -746,11 +859,14 @@ class NetworkManager(manager.SchedulerDependentManager):
                 'bridge_interface': network['bridge_interface'],
                 'multi_host': network['multi_host']}
             if network['multi_host']:
-                dhcp_server = self._get_dhcp_ip(context, network, host)
+                dhcp_host = host
             else:
-                dhcp_server = self._get_dhcp_ip(context,
-                                                network,
-                                                network['host'])
+                dhcp_host = network['host']
+            dhcp_key = (network['id'], dhcp_host)
+            if dhcp_key not in dhcp_ips:
+                dhcp_ips[dhcp_key] = self._get_dhcp_ip(context, network,
+                                                       dhcp_host)
+            dhcp_server = dhcp_ips[dhcp_key]
             info = {
                 'label': network['label'],
                 'gateway': network['gateway'],
@@ -778,20 +894,37 @@ class NetworkManager(manager.SchedulerDependentManager):
 
         # update instance network cache and return network_info
         nw_info = self.build_network_info_model(context, vifs, fixed_ips,
-                                                               instance_type)
-        self.db.instance_info_cache_update(context, instance_uuid,
-                                          {'network_info': nw_info.as_cache()})
+                                                instance_type, networks)
+        cache = nw_info.as_cache()
+        # NOTE(agent): only write the cache back when the network info changed
+        info_cache = self.db.instance_info_cache_get(context, instance_uuid)
+        if info_cache and info_cache['network_info'] != cache:
+            self.db.instance_info_cache_update(context, instance_uuid,
+                                               {'network_info': cache})
 
         # TODO(tr3buchet): return model
         return network_info
 
+    def _get_network_memo(self, context, networks, network_id):
+        """Returns the network ref for network_id, looking it up only if
+        it is not in the networks dict yet."""
+        if network_id not in networks:
+            networks[network_id] = self.db.network_get(context, network_id)
+        return networks[network_id]
+
     def build_network_info_model(self, context, vifs, fixed_ips,
-                                                 instance_type):
+                                 instance_type, networks=None):
         """Returns a NetworkInfo object containing all network information
-        for an instance"""
+        for an instance
+
+        fixed_ips are expected to have their floating_ips loaded, and
+        networks optionally memoizes network refs by id."""
+        if networks is None:
+            networks = {}
         nw_info = network_model.NetworkInfo()
         for vif in vifs:
-            network = self.db.network_get(context, vif['network_id'])
+            network = self._get_network_memo(context, networks,
+                                             vif['network_id'])
             subnets = self._get_subnets_from_network(network)
 
             # if rxtx_cap data are not set everywhere, set to none
@@ -800,24 +933,18 @@ class NetworkManager(manager.SchedulerDependentManager):
             except (TypeError, KeyError):
                 rxtx_cap = None
 
-            # determine which of the instance's fixed IPs are on this network
-            network_IPs = [fixed_ip['address'] for fixed_ip in fixed_ips if
-                           fixed_ip['network_id'] == network['id']]
-
-            # create model FixedIPs from these fixed_ips
-            network_IPs = [network_model.FixedIP(address=ip_address)
-                           for ip_address in network_IPs]
-
-            # get floating_ips for each fixed_ip
-            # add them to the fixed ip
-            for fixed_ip in network_IPs:
-                fipgbfa = self.db.floating_ip_get_by_fixed_address
-                floating_ips = fipgbfa(context, fixed_ip['address'])
-                floating_ips = [network_model.IP(address=ip['address'],
-                                                 type='floating')
-                                for ip in floating_ips]
-                for ip in floating_ips:
-                    fixed_ip.add_floating_ip(ip)
+            # create model FixedIPs from the instance's fixed IPs that are
+            # on this network, and add the floating ips already loaded
+            # with each of them
+            network_IPs = []
+            for fixed_ip in fixed_ips:
+                if fixed_ip['network_id'] != network['id']:
+                    continue
+                model_ip = network_model.FixedIP(address=fixed_ip['address'])
+                for floating_ip in fixed_ip['floating_ips']:
+                    model_ip.add_floating_ip(network_model.IP(
+                            address=floating_ip['address'], type='floating'))
+                network_IPs.append(model_ip)
 
             # at this point nova networks can only have 2 subnets,
             # one for v4 and one for v6, all ips will belong to the v4 subnet
@@ -977,9 +1104,9 @@ class NetworkManager(manager.SchedulerDependentManager):
                                                      address, instance_id,
                                                      network['id'])
             else:
-                address = self.db.fixed_ip_associate_pool(context.elevated(),
-                                                          network['id'],
-                                                          instance_id)
+                address = self._associate_pool_address(context,
+                                                       network['id'],
+                                                       instance_id)
             self._do_trigger_security_group_members_refresh_for_instance(
                                                                    instance_id)
             get_vif = self.db.virtual_interface_get_by_instance_and_network
@@ -1417,9 +1544,9 @@ class VlanManager(RPCAllocateFixedIP, FloatingIP, NetworkManager):
                                                      instance_id,
                                                      network['id'])
             else:
-                address = self.db.fixed_ip_associate_pool(context,
-                                                          network['id'],
-                                                          instance_id)
+                address = self._associate_pool_address(context,
+                                                       network['id'],
+                                                       instance_id)
             self._do_trigger_security_group_members_refresh_for_instance(
                                                                    instance_id)
         vif = self.db.virtual_interface_get_by_instance_and_network(context,
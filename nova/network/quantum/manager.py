@@ -379,6 +379,16 @@ class QuantumManager(manager.FlatManager):
 
         return self.db.virtual_interface_create(context, vif)
 
+    def get_instances_nw_info(self, context, instances):
+        """Returns a dict mapping each instance uuid to its network info,
+           as get_instance_nw_info would build it."""
+        return dict((instance['instance_uuid'],
+                     self.get_instance_nw_info(context,
+                                               instance['instance_id'],
+                                               instance['instance_type_id'],
+                                               instance['host']))
+                    for instance in instances)
+
     def get_instance_nw_info(self, context, instance_id,
                                 instance_type_id, host):
         """This method is used by compute to fetch all network data
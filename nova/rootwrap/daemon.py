@@ -0,0 +1,130 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long-lived root wrapper serving commands over a unix socket.
+
+A request is a single line of JSON: a list of commands, each a dict with
+the command line ('cmd'), the input to send it ('process_input') and the
+exit codes it may exit with ('check_exit_code', null for any).  Commands
+are checked against the same filters as nova-rootwrap and run in order,
+stopping after the first one that is unauthorized or exits with a code
+it may not exit with.  The reply is a single line of JSON: a list of
+[returncode, stdout, stderr] for each command run.
+
+Command lines, input and output are passed as latin-1 strings, so any
+bytes survive JSON.
+
+This runs as root, so it must not import anything beyond nova.rootwrap.
+"""
+
+import json
+import os
+import shutil
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+
+from nova.rootwrap import wrapper
+
+
+RC_UNAUTHORIZED = 99
+
+
+def run_commands(filters, commands):
+    """Runs commands allowed by filters, returns their results."""
+    results = []
+    for command in commands:
+        userargs = [arg.encode('latin-1') for arg in command['cmd']]
+        filtermatch = wrapper.match_filter(filters, userargs)
+        if not filtermatch:
+            results.append([RC_UNAUTHORIZED, '',
+                            'Unauthorized command: %s' % ' '.join(userargs)])
+            break
+
+        process_input = command.get('process_input')
+        if process_input is not None:
+            process_input = process_input.encode('latin-1')
+        obj = subprocess.Popen(filtermatch.get_command(userargs),
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE,
+                               close_fds=True)
+        stdout, stderr = obj.communicate(process_input)
+        results.append([obj.returncode,
+                        stdout.decode('latin-1'),
+                        stderr.decode('latin-1')])
+
+        check_exit_code = command.get('check_exit_code', [0])
+        if (check_exit_code is not None and
+            obj.returncode not in check_exit_code):
+            break
+    return results
+
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        commands = json.loads(self.rfile.readline())
+        results = run_commands(self.server.filters, commands)
+        self.wfile.write(json.dumps(results) + '\n')
+
+
+class RootwrapServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    """Serves requests concurrently, each in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, filters):
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               _RequestHandler)
+        self.filters = filters
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    """Serves requests until stdin is closed.
+
+    The socket is created in a new directory only the user who ran sudo
+    can access, and its path is written to stdout once it accepts
+    connections.
+    """
+    uid = int(os.environ.get('SUDO_UID', os.getuid()))
+    gid = int(os.environ.get('SUDO_GID', os.getgid()))
+
+    socket_dir = tempfile.mkdtemp(prefix='nova-rootwrap-')
+    try:
+        os.chown(socket_dir, uid, gid)
+        socket_path = os.path.join(socket_dir, 'rootwrap.sock')
+        server = RootwrapServer(socket_path, wrapper.load_filters())
+        os.chown(socket_path, uid, gid)
+        os.chmod(socket_path, 0600)
+
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        stdout.write(socket_path + '\n')
+        stdout.flush()
+        # NOTE(agent): the parent holds the other end of stdin, so reaching EOF
+        #              means it went away and nothing is left to serve
+        stdin.read()
+
+        server.shutdown()
+        server.server_close()
+    finally:
+        shutil.rmtree(socket_dir, ignore_errors=True)
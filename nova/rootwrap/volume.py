@@ -16,7 +16,7 @@
 #    under the License.
 
 
-from nova.rootwrap.filters import CommandFilter
+from nova.rootwrap.filters import CommandFilter, RegExpFilter
 
 filters = [
     # nova/volume/iscsi.py: iscsi_helper '--op' ...
@@ -39,6 +39,17 @@ filters = [
     # nova/volume/driver.py: 'lvdisplay', '--noheading', '-C', '-o', 'Attr',..
     CommandFilter("/sbin/lvdisplay", "root"),
 
+    # nova/volume/driver.py: 'lvrename', FLAGS.volume_group, volume_name,..
+    CommandFilter("/sbin/lvrename", "root"),
+
+    # nova/volume/driver.py: 'lvs', '--noheadings', '--nosuffix', ...
+    CommandFilter("/sbin/lvs", "root"),
+
+    # nova/volume/driver.py: 'ionice', '-c%d' % ..., 'dd', 'if=/dev/zero',..
+    RegExpFilter("/usr/bin/ionice", "root", "ionice", "-c[1-3]", "dd",
+                 "if=/dev/zero", "of=/dev/mapper/[^/]+", "bs=1M",
+                 "count=[0-9]+", "seek=[0-9]+", "oflag=direct"),
+
     # nova/volume/driver.py: 'iscsiadm', '-m', 'discovery', '-t',...
     # nova/volume/driver.py: 'iscsiadm', '-m', 'node', '-T', ...
     CommandFilter("/sbin/iscsiadm", "root"),
@@ -28,6 +28,9 @@ flags.DEFINE_integer('rpc_thread_pool_size', 1024,
                              'Size of RPC thread pool')
 flags.DEFINE_integer('rpc_conn_pool_size', 30,
                              'Size of RPC connection pool')
+flags.DEFINE_integer('rpc_response_timeout', 600,
+                             'Seconds to wait for a response from call or '
+                             'multicall')
 
 
 class RemoteError(exception.NovaException):
@@ -48,6 +51,15 @@ class RemoteError(exception.NovaException):
         super(RemoteError, self).__init__(**self.__dict__)
 
 
+class Timeout(exception.NovaException):
+    """Signifies that a timeout has occurred.
+
+    This exception is raised if the rpc_response_timeout is reached while
+    waiting for a response from the remote side.
+    """
+    message = _("Timeout while waiting on RPC response.")
+
+
 class Connection(object):
     """A connection, returned by rpc.create_connection().
 
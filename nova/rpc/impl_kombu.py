@@ -26,8 +26,9 @@ import traceback
 import uuid
 
 import eventlet
-from eventlet import greenpool
 from eventlet import pools
+from eventlet import queue
+from eventlet import semaphore
 import greenlet
 
 from nova import context
@@ -40,6 +41,25 @@ from nova.rpc.common import RemoteError, LOG
 eventlet.monkey_patch()
 
 FLAGS = flags.FLAGS
+flags.DEFINE_float('rpc_cast_batch_window', 0,
+                   'Seconds to hold casts, fanout casts and notifications '
+                   'so that a burst of them is sent together over one '
+                   'connection.  Batched sends do not raise errors back to '
+                   'the caller.  0 sends each one immediately.')
+flags.DEFINE_list('rpc_method_pool_sizes', [],
+                  'Methods that get their own pool of greenthreads so '
+                  'they can not starve other methods, as method:size '
+                  '(e.g. run_instance:64).  All other methods share a '
+                  'pool of rpc_thread_pool_size greenthreads.')
+flags.DEFINE_integer('rpc_method_pool_backlog', 0,
+                     'Messages that may wait for a free greenthread in each '
+                     'pool.  Beyond that, the consumer waits for the pool '
+                     'before taking any more messages.')
+flags.DEFINE_integer('rpc_prefetch_count', 0,
+                     'Most messages the broker sends to a consumer ahead of '
+                     'it taking them, so that messages queue up on the '
+                     'broker, where other consumers can take them, while '
+                     'its pools are full.  0 means no limit.')
 
 
 class ConsumerBase(object):
@@ -65,6 +85,8 @@ class ConsumerBase(object):
         """Re-declare the queue after a rabbit reconnect"""
         self.channel = channel
         self.kwargs['channel'] = channel
+        if FLAGS.rpc_prefetch_count:
+            channel.basic_qos(0, FLAGS.rpc_prefetch_count, False)
         self.queue = kombu.entity.Queue(**self.kwargs)
         self.queue.declare()
 
@@ -311,12 +333,18 @@ class NotifyPublisher(TopicPublisher):
         queue.declare()
 
 
+# Most publishers a Connection keeps around for reuse
+MAX_PUBLISHERS = 100
+
+
 class Connection(object):
     """Connection object."""
 
     def __init__(self):
         self.consumers = []
         self.consumer_thread = None
+        # { (<publisher class>, <topic>, <options>) : Publisher() }
+        self.publishers = {}
         self.max_retries = FLAGS.rabbit_max_retries
         # Try forever?
         if self.max_retries <= 0:
@@ -378,6 +406,8 @@ class Connection(object):
             consumer.reconnect(self.channel)
         if self.consumers:
             LOG.debug(_("Re-established AMQP queues"))
+        for publisher in self.publishers.values():
+            publisher.reconnect(self.channel)
 
     def get_channel(self):
         """Convenience call for bin/clear_rabbit_queues"""
@@ -401,12 +431,17 @@ class Connection(object):
     def reset(self):
         """Reset a connection so it can be used again"""
         self.cancel_consumer_thread()
+        if not self.consumers:
+            # Nothing to tear down.  Keep the channel and the publishers
+            # so the next caller doesn't have to declare exchanges again.
+            return
         self.channel.close()
         self.channel = self.connection.channel()
         # work around 'memory' transport bug in 1.1.3
         if self.memory_transport:
             self.channel._new_queue('ae.undeliver')
         self.consumers = []
+        self.publishers = {}
 
     def declare_consumer(self, consumer_cls, topic, callback):
         """Create a Consumer using the class that was passed in and
@@ -423,8 +458,8 @@ class Connection(object):
             try:
                 queues_head = self.consumers[:-1]
                 queues_tail = self.consumers[-1]
-                for queue in queues_head:
-                    queue.consume(nowait=True)
+                for consumer in queues_head:
+                    consumer.consume(nowait=True)
                 queues_tail.consume(nowait=False)
 
                 for iteration in itertools.count(0):
@@ -447,12 +482,32 @@ class Connection(object):
             self.consumer_thread = None
 
     def publisher_send(self, cls, topic, msg, **kwargs):
-        """Send to a publisher based on the publisher class"""
+        """Send to a publisher based on the publisher class.
+
+        Publishers are kept on the connection, so the exchange is only
+        declared the first time we send to it (and after a reconnect).
+        """
+        key = (cls, topic, tuple(sorted(kwargs.iteritems())))
+        redeclared = False
         while True:
             try:
-                publisher = cls(self.channel, topic, **kwargs)
+                publisher = self.publishers.get(key)
+                if publisher is None:
+                    if len(self.publishers) >= MAX_PUBLISHERS:
+                        # Mostly replies to callers that are long gone.
+                        self.publishers = {}
+                    publisher = cls(self.channel, topic, **kwargs)
+                    self.publishers[key] = publisher
                 publisher.send(msg)
                 return
+            except self.connection.channel_errors, e:
+                # The exchange may have been auto-deleted since we declared
+                # it.  Reconnecting declares it again, so retry once.
+                if redeclared:
+                    raise
+                redeclared = True
+                LOG.exception(_('Failed to publish message %s' % str(e)))
+                self.reconnect()
             except self.connection.connection_errors, e:
                 LOG.exception(_('Failed to publish message %s' % str(e)))
                 try:
@@ -606,12 +661,78 @@ class ConnectionContext(rpc_common.Connection):
             raise exception.InvalidRPCConnectionReuse()
 
 
+class MethodPool(object):
+    """A bounded pool of greenthreads for running rpc methods, with
+    counters on how busy each method is.
+
+    Up to 'size' methods run at once and up to 'backlog' more wait for a
+    greenthread.  Beyond that, spawn() blocks.  Since messages are only
+    acked once they are spawned, this stops the consumer from taking more
+    messages off the queue until the pool catches up.
+    """
+
+    def __init__(self, size, backlog=0):
+        self._running = semaphore.Semaphore(size)
+        self._outstanding = semaphore.Semaphore(size + backlog)
+        self.stats = {}  # { <method> : { <counter> : <value> } }
+
+    def full(self):
+        """Returns whether spawn() would block."""
+        return self._outstanding.locked()
+
+    def spawn(self, method, func, *args):
+        """Run func(*args) in a greenthread once one is free."""
+        stats = self.stats.get(method)
+        if stats is None:
+            stats = dict(waiting=0, running=0, completed=0,
+                         wait_time=0.0, run_time=0.0, max_run_time=0.0)
+            self.stats[method] = stats
+        self._outstanding.acquire()
+        stats['waiting'] += 1
+        eventlet.spawn_n(self._run, stats, time.time(), func, *args)
+
+    def _run(self, stats, queued_at, func, *args):
+        try:
+            with self._running:
+                started_at = time.time()
+                stats['waiting'] -= 1
+                stats['wait_time'] += started_at - queued_at
+                stats['running'] += 1
+                try:
+                    func(*args)
+                finally:
+                    run_time = time.time() - started_at
+                    stats['running'] -= 1
+                    stats['completed'] += 1
+                    stats['run_time'] += run_time
+                    stats['max_run_time'] = max(stats['max_run_time'],
+                                                run_time)
+        finally:
+            self._outstanding.release()
+
+
 class ProxyCallback(object):
     """Calls methods on a proxy object based on method and args."""
 
     def __init__(self, proxy):
         self.proxy = proxy
-        self.pool = greenpool.GreenPool(FLAGS.rpc_thread_pool_size)
+        backlog = FLAGS.rpc_method_pool_backlog
+        self.pool = MethodPool(FLAGS.rpc_thread_pool_size, backlog)
+        self.method_pools = {}
+        for pool_size in FLAGS.rpc_method_pool_sizes:
+            method, size = pool_size.split(':')
+            self.method_pools[method] = MethodPool(int(size), backlog)
+
+    def get_stats(self):
+        """Returns a dict of {<method>: {<counter>: <value>}} with the
+        number of waiting, running and completed calls of each method
+        seen so far, and the time spent waiting for and running them.
+        """
+        stats = {}
+        for pool in [self.pool] + self.method_pools.values():
+            for method, counters in pool.stats.iteritems():
+                stats[method] = counters.copy()
+        return stats
 
     def __call__(self, message_data):
         """Consumer callback to call a method on a proxy object.
@@ -634,7 +755,12 @@ class ProxyCallback(object):
             LOG.warn(_('no method for message: %s') % message_data)
             ctxt.reply(_('No method for message: %s') % message_data)
             return
-        self.pool.spawn_n(self._process_data, ctxt, method, args)
+        pool = self.method_pools.get(method, self.pool)
+        if pool.full():
+            LOG.debug(_('Waiting for room to run %(method)s. '
+                        'Method stats: %(stats)s'),
+                      {'method': method, 'stats': self.get_stats()})
+        pool.spawn(method, self._process_data, ctxt, method, args)
 
     @exception.wrap_exception()
     def _process_data(self, ctxt, method, args):
@@ -672,6 +798,7 @@ def _unpack_context(msg):
             value = msg.pop(key)
             context_dict[key[9:]] = value
     context_dict['msg_id'] = msg.pop('_msg_id', None)
+    context_dict['reply_q'] = msg.pop('_reply_q', None)
     LOG.debug(_('unpacked context: %s'), context_dict)
     return RpcContext.from_dict(context_dict)
 
@@ -694,55 +821,160 @@ class RpcContext(context.RequestContext):
     """Context that supports replying to a rpc.call"""
     def __init__(self, *args, **kwargs):
         msg_id = kwargs.pop('msg_id', None)
+        reply_q = kwargs.pop('reply_q', None)
         self.msg_id = msg_id
+        self.reply_q = reply_q
         super(RpcContext, self).__init__(*args, **kwargs)
 
     def reply(self, reply=None, failure=None, ending=False):
         if self.msg_id:
-            msg_reply(self.msg_id, reply, failure, ending)
+            msg_reply(self.msg_id, reply, failure, ending, self.reply_q)
             if ending:
                 self.msg_id = None
 
 
+class ReplyProxy(object):
+    """A single long-lived 'direct' queue that receives the replies for
+    every call/multicall made from this process.  Replies carry the
+    msg_id of the call they answer, which is used to hand them to the
+    right MulticallWaiter.
+    """
+
+    def __init__(self):
+        self.reply_q = 'reply_%s' % uuid.uuid4().hex
+        self._waiters = {}  # { <msg_id> : queue.LightQueue() }
+        self._connection = Connection()
+        self._connection.declare_direct_consumer(self.reply_q,
+                                                 self._process_data)
+        self._connection.consume_in_thread()
+
+    def _process_data(self, data):
+        """The consume() callback will call this.  Pass the reply on
+        to the waiter for its msg_id.
+        """
+        msg_id = data.pop('_msg_id', None)
+        waiter = self._waiters.get(msg_id)
+        if waiter is None:
+            LOG.warn(_('No calling threads waiting for msg_id %s'), msg_id)
+            return
+        waiter.put(data)
+
+    def add_waiter(self, msg_id):
+        """Start collecting replies for msg_id."""
+        waiter = queue.LightQueue()
+        self._waiters[msg_id] = waiter
+        return waiter
+
+    def del_waiter(self, msg_id):
+        """Stop collecting replies for msg_id."""
+        self._waiters.pop(msg_id, None)
+
+
+_REPLY_PROXY = None
+_REPLY_PROXY_LOCK = semaphore.Semaphore()
+
+
+def _get_reply_proxy():
+    """Return the ReplyProxy for this process, creating it the first
+    time a call is made.
+    """
+    global _REPLY_PROXY
+    if _REPLY_PROXY is None:
+        with _REPLY_PROXY_LOCK:
+            if _REPLY_PROXY is None:
+                _REPLY_PROXY = ReplyProxy()
+    return _REPLY_PROXY
+
+
 class MulticallWaiter(object):
-    def __init__(self, connection):
-        self._connection = connection
-        self._iterator = connection.iterconsume()
-        self._result = None
+    def __init__(self, reply_proxy, msg_id, timeout):
+        self._reply_proxy = reply_proxy
+        self._msg_id = msg_id
+        self._queue = reply_proxy.add_waiter(msg_id)
+        self._timeout = timeout
         self._done = False
-        self._got_ending = False
 
     def done(self):
         if self._done:
             return
         self._done = True
-        self._iterator.close()
-        self._iterator = None
-        self._connection.close()
-
-    def __call__(self, data):
-        """The consume() callback will call this.  Store the result."""
-        if data['failure']:
-            self._result = RemoteError(*data['failure'])
-        elif data.get('ending', False):
-            self._got_ending = True
-        else:
-            self._result = data['result']
+        self._reply_proxy.del_waiter(self._msg_id)
+
+    def __del__(self):
+        # NOTE(agent): a waiter dropped without being iterated to the end
+        #              must not keep collecting replies for its msg_id
+        self.done()
 
     def __iter__(self):
         """Return a result until we get a 'None' response from consumer"""
         if self._done:
             raise StopIteration
-        while True:
-            self._iterator.next()
-            if self._got_ending:
-                self.done()
-                raise StopIteration
-            result = self._result
-            if isinstance(result, Exception):
-                self.done()
-                raise result
-            yield result
+        try:
+            while True:
+                try:
+                    data = self._queue.get(timeout=self._timeout)
+                except queue.Empty:
+                    raise rpc_common.Timeout()
+                if data['failure']:
+                    raise RemoteError(*data['failure'])
+                if data.get('ending', False):
+                    raise StopIteration
+                yield data['result']
+        finally:
+            # NOTE(agent): also runs when the caller closes or drops the
+            #              iterator before the ending reply
+            self.done()
+
+
+class CastBatcher(object):
+    """Holds casts for rpc_cast_batch_window seconds and then sends all
+    of them, in order, from one greenthread over one pooled connection.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._flusher = None
+
+    def add(self, send_method, topic, msg, **kwargs):
+        """Queue a message to be sent with Connection.<send_method>."""
+        self._pending.append((send_method, topic, msg, kwargs))
+        if self._flusher is None:
+            self._flusher = eventlet.spawn_after(FLAGS.rpc_cast_batch_window,
+                                                 self._flush)
+
+    def _flush(self):
+        try:
+            with ConnectionContext() as conn:
+                while self._pending:
+                    pending, self._pending = self._pending, []
+                    for send_method, topic, msg, kwargs in pending:
+                        try:
+                            getattr(conn, send_method)(topic, msg, **kwargs)
+                        except Exception:
+                            LOG.exception(_('Failed to send batched message '
+                                            'on %s'), topic)
+        except Exception:
+            LOG.exception(_('Failed to send %d batched messages, will '
+                            'retry'), len(self._pending))
+        finally:
+            self._flusher = None
+            if self._pending:
+                self._flusher = eventlet.spawn_after(
+                        FLAGS.rpc_cast_batch_window, self._flush)
+
+
+_CAST_BATCHER = CastBatcher()
+
+
+def _send(send_method, topic, msg, **kwargs):
+    """Send a message that doesn't expect a reply, batching it with
+    others if rpc_cast_batch_window is set.
+    """
+    if FLAGS.rpc_cast_batch_window > 0:
+        _CAST_BATCHER.add(send_method, topic, msg, **kwargs)
+        return
+    with ConnectionContext() as conn:
+        getattr(conn, send_method)(topic, msg, **kwargs)
 
 
 def create_connection(new=True):
@@ -752,20 +984,20 @@ def create_connection(new=True):
 
 def multicall(context, topic, msg):
     """Make a call that returns multiple times."""
-    # Can't use 'with' for multicall, as it returns an iterator
-    # that will continue to use the connection.  When it's done,
-    # connection.close() will get called which will put it back into
-    # the pool
+    # Replies come back on the shared reply queue for this process and
+    # are routed to our waiter by msg_id, so no queue has to be declared
+    # or deleted per call.
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
+    reply_proxy = _get_reply_proxy()
     msg_id = uuid.uuid4().hex
-    msg.update({'_msg_id': msg_id})
+    msg.update({'_msg_id': msg_id, '_reply_q': reply_proxy.reply_q})
     LOG.debug(_('MSG_ID is %s') % (msg_id))
     _pack_context(msg, context)
 
-    conn = ConnectionContext()
-    wait_msg = MulticallWaiter(conn)
-    conn.declare_direct_consumer(msg_id, wait_msg)
-    conn.topic_send(topic, msg)
+    timeout = FLAGS.rpc_response_timeout or None
+    wait_msg = MulticallWaiter(reply_proxy, msg_id, timeout)
+    with ConnectionContext() as conn:
+        conn.topic_send(topic, msg)
     return wait_msg
 
 
@@ -783,29 +1015,29 @@ def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
     _pack_context(msg, context)
-    with ConnectionContext() as conn:
-        conn.topic_send(topic, msg)
+    _send('topic_send', topic, msg)
 
 
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
     _pack_context(msg, context)
-    with ConnectionContext() as conn:
-        conn.fanout_send(topic, msg)
+    _send('fanout_send', topic, msg)
 
 
 def notify(context, topic, msg):
     """Sends a notification event on a topic."""
     LOG.debug(_('Sending notification on %s...'), topic)
     _pack_context(msg, context)
-    with ConnectionContext() as conn:
-        conn.notify_send(topic, msg, durable=True)
+    _send('notify_send', topic, msg, durable=True)
 
 
-def msg_reply(msg_id, reply=None, failure=None, ending=False):
+def msg_reply(msg_id, reply=None, failure=None, ending=False, reply_q=None):
     """Sends a reply or an error on the channel signified by msg_id.
 
+    If the caller gave a reply_q, the reply is sent there tagged with
+    msg_id. Otherwise it is sent on a queue named after msg_id.
+
     Failure should be a sys.exc_info() tuple.
 
     """
@@ -825,4 +1057,8 @@ def msg_reply(msg_id, reply=None, failure=None, ending=False):
                     'failure': failure}
         if ending:
             msg['ending'] = True
-        conn.direct_send(msg_id, msg)
+        if reply_q:
+            msg['_msg_id'] = msg_id
+            conn.direct_send(reply_q, msg)
+        else:
+            conn.direct_send(msg_id, msg)
@@ -105,6 +105,14 @@ def update_service_capabilities(context, service_name, host, capabilities):
     return rpc.fanout_cast(context, 'scheduler', kwargs)
 
 
+def update_host_resources(context, host, disk_gb, ram_mb):
+    """Send an update to all the scheduler services informing them
+       of resources consumed (or released, if negative) on a host."""
+    kwargs = dict(method='update_host_resources',
+                  args=dict(host=host, disk_gb=disk_gb, ram_mb=ram_mb))
+    return rpc.fanout_cast(context, 'scheduler', kwargs)
+
+
 def call_zone_method(context, method_name, errors_to_ignore=None,
                      novaclient_collection_name='zones', zones=None,
                      *args, **kwargs):
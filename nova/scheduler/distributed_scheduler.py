@@ -19,6 +19,7 @@ You can customize this scheduler by specifying your own Host Filters and
 Weighing Functions.
 """
 
+import heapq
 import json
 import operator
 
@@ -146,6 +147,8 @@ class DistributedScheduler(driver.Scheduler):
         if not hosts:
             raise exception.NoValidHost(reason=_(""))
         host = hosts.pop(0)
+        self.zone_manager.consume_host_resources(host.host,
+                instance_type['local_gb'], instance_type['memory_mb'])
 
         # Forward off to the host
         driver.cast_to_host(context, 'compute', host.host, 'prep_resize',
@@ -172,6 +175,9 @@ class DistributedScheduler(driver.Scheduler):
         instance = self.create_instance_db_entry(context, request_spec)
         driver.cast_to_compute_host(context, weighted_host.host,
                 'run_instance', instance_uuid=instance['uuid'], **kwargs)
+        instance_type = request_spec['instance_type']
+        self.zone_manager.consume_host_resources(weighted_host.host,
+                instance_type['local_gb'], instance_type['memory_mb'])
         inst = driver.encode_instance(instance, local=True)
         # So if another instance is created, create_instance_db_entry will
         # actually create a new entry, instead of assume it's been created
@@ -304,39 +310,50 @@ class DistributedScheduler(driver.Scheduler):
 
         options = self._get_configuration_options()
 
-        # Find our local list of acceptable hosts by repeatedly
-        # filtering and weighing our options. Each time we choose a
-        # host, we virtually consume resources on it so subsequent
-        # selections can adjust accordingly.
+        # Find our local list of acceptable hosts by filtering and
+        # weighing our options once. Each time we choose a host, we
+        # virtually consume resources on it. Since that is the only host
+        # whose fitness changed, it is the only one that needs to be
+        # filtered and weighed again before the next selection.
 
         # unfiltered_hosts_dict is {host : ZoneManager.HostInfo()}
         unfiltered_hosts_dict = self.zone_manager.get_all_host_data(elevated)
         unfiltered_hosts = unfiltered_hosts_dict.items()
 
+        # Filter local hosts based on requirements ...
+        filtered_hosts = self._filter_hosts(topic, request_spec,
+                unfiltered_hosts, options)
+        LOG.debug(_("Filtered %(filtered_hosts)s") % locals())
+
+        # host_heap is [(weight, host, HostInfo()), ...] with the
+        # best (lowest weight) host on top.
+        host_heap = [(least_cost.weigh_host(cost_functions, host_info,
+                                            options), host, host_info)
+                     for host, host_info in filtered_hosts]
+        heapq.heapify(host_heap)
+
         num_instances = request_spec.get('num_instances', 1)
         selected_hosts = []
         for num in xrange(num_instances):
-            # Filter local hosts based on requirements ...
-            filtered_hosts = self._filter_hosts(topic, request_spec,
-                    unfiltered_hosts, options)
-
-            if not filtered_hosts:
+            if not host_heap:
                 # Can't get any more locally.
                 break
 
-            LOG.debug(_("Filtered %(filtered_hosts)s") % locals())
-
-            # weighted_host = WeightedHost() ... the best
-            # host for the job.
-            weighted_host = least_cost.weighted_sum(cost_functions,
-                                                filtered_hosts, options)
+            weight, host, host_info = heapq.heappop(host_heap)
+            weighted_host = least_cost.WeightedHost(weight, host=host,
+                                                    hostinfo=host_info)
             LOG.debug(_("Weighted %(weighted_host)s") % locals())
             selected_hosts.append(weighted_host)
 
-            # Now consume the resources so the filter/weights
-            # will change for the next instance.
-            weighted_host.hostinfo.consume_resources(disk_requirement_gb,
+            # Now consume the resources and put the host back if it can
+            # still take another instance.
+            host_info.consume_resources(disk_requirement_gb,
                                         ram_requirement_mb)
+            if self._filter_hosts(topic, request_spec,
+                                  [(host, host_info)], options):
+                weight = least_cost.weigh_host(cost_functions, host_info,
+                                               options)
+                heapq.heappush(host_heap, (weight, host, host_info))
 
         # Next, tack on the host weights from the child zones
         if not request_spec.get('local_zone', False):
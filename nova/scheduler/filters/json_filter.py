@@ -21,6 +21,11 @@ import nova.scheduler
 from nova.scheduler.filters import abstract_filter
 
 
+# { (<filter class>, <query string>) : <compiled query> }
+_compiled_queries = {}
+_COMPILED_QUERIES_MAX = 1000
+
+
 class JsonFilter(abstract_filter.AbstractHostFilter):
     """Host Filter to allow simple JSON-based grammar for
     selecting hosts.
@@ -96,49 +101,78 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
                 ['>=', '$compute.disk_available', required_disk]]
         return json.dumps(query)
 
-    def _parse_string(self, string, host, hostinfo):
+    def _compile_string(self, string):
         """Strings prefixed with $ are capability lookups in the
-        form '$service.capability[.subcap*]'.
+        form '$service.capability[.subcap*]'. Returns a function that
+        takes a HostInfo and returns the looked up value.
         """
         if not string:
-            return None
+            return lambda hostinfo: None
         if not string.startswith("$"):
-            return string
+            return lambda hostinfo: string
 
         path = string[1:].split(".")
-        services = dict(compute=hostinfo.compute, network=hostinfo.network,
-                        volume=hostinfo.volume)
-        service = services.get(path[0], None)
-        if not service:
-            return None
-        for item in path[1:]:
-            service = service.get(item, None)
+        if path[0] not in ('compute', 'network', 'volume'):
+            return lambda hostinfo: None
+        get_service = operator.attrgetter(path[0])
+        items = path[1:]
+
+        def _lookup(hostinfo):
+            service = get_service(hostinfo)
             if not service:
                 return None
-        return service
-
-    def _process_filter(self, query, host, hostinfo):
-        """Recursively parse the query structure."""
+            for item in items:
+                service = service.get(item, None)
+                if not service:
+                    return None
+            return service
+        return _lookup
+
+    def _compile_query(self, query):
+        """Recursively turn the query structure into a function that
+        takes a HostInfo and returns the result of the query.
+        """
         if not query:
-            return True
+            return lambda hostinfo: True
         cmd = query[0]
         method = self.commands[cmd]
-        cooked_args = []
+        arg_fns = []
         for arg in query[1:]:
             if isinstance(arg, list):
-                arg = self._process_filter(arg, host, hostinfo)
+                arg_fns.append(self._compile_query(arg))
             elif isinstance(arg, basestring):
-                arg = self._parse_string(arg, host, hostinfo)
-            if arg is not None:
-                cooked_args.append(arg)
-        result = method(self, cooked_args)
-        return result
+                arg_fns.append(self._compile_string(arg))
+            else:
+                arg_fns.append(lambda hostinfo, arg=arg: arg)
+
+        def _query(hostinfo):
+            cooked_args = []
+            for arg_fn in arg_fns:
+                arg = arg_fn(hostinfo)
+                if arg is not None:
+                    cooked_args.append(arg)
+            return method(self, cooked_args)
+        return _query
+
+    def compile_query(self, query):
+        """Return the compiled form of a JSON query string. Compiled
+        queries are cached, so the same flavor or hint is only parsed
+        once.
+        """
+        key = (self.__class__, query)
+        compiled = _compiled_queries.get(key, None)
+        if compiled is None:
+            if len(_compiled_queries) >= _COMPILED_QUERIES_MAX:
+                _compiled_queries.clear()
+            compiled = self._compile_query(json.loads(query))
+            _compiled_queries[key] = compiled
+        return compiled
 
     def filter_hosts(self, host_list, query, options):
         """Return a list of hosts that can fulfill the requirements
         specified in the query.
         """
-        expanded = json.loads(query)
+        compiled = self.compile_query(query)
         filtered_hosts = []
         for host, hostinfo in host_list:
             if not hostinfo:
@@ -146,7 +180,7 @@ class JsonFilter(abstract_filter.AbstractHostFilter):
             if hostinfo.compute and not hostinfo.compute.get("enabled", True):
                 # Host is disabled
                 continue
-            result = self._process_filter(expanded, host, hostinfo)
+            result = compiled(hostinfo)
             if isinstance(result, list):
                 # If any succeeded, include the host
                 result = any(result)
@@ -79,6 +79,19 @@ def compute_fill_first_cost_fn(host_info, options=None):
     return host_info.free_ram_mb
 
 
+def weigh_host(weighted_fns, host_info, options):
+    """Returns the weighted sum of the cost functions for a single host.
+
+    weighted_fns - list of weights and functions like:
+        [(weight, objective-functions), ...]
+    options is an arbitrary dict of values.
+    """
+    score = 0.0
+    for weight, fn in weighted_fns:
+        score += weight * fn(host_info, options)
+    return score
+
+
 def weighted_sum(weighted_fns, host_list, options):
     """Use the weighted-sum method to compute a score for an array of objects.
     Normalize the results of the objective-functions so that the weights are
@@ -92,31 +105,13 @@ def weighted_sum(weighted_fns, host_list, options):
     Returns a single WeightedHost object which represents the best
     candidate.
     """
-
-    # Make a grid of functions results.
-    # One row per host. One column per function.
-    scores = []
-    for weight, fn in weighted_fns:
-        scores.append([fn(host_info, options) for hostname, host_info
-                                                                in host_list])
-
-    # Adjust the weights in the grid by the functions weight adjustment
-    # and sum them up to get a final list of weights.
-    adjusted_scores = []
-    for (weight, fn), row in zip(weighted_fns, scores):
-        adjusted_scores.append([weight * score for score in row])
-
-    # Now, sum down the columns to get the final score. Column per host.
-    final_scores = [0.0] * len(host_list)
-    for row in adjusted_scores:
-        for idx, col in enumerate(row):
-            final_scores[idx] += col
-
-    # Super-impose the hostinfo into the scores so
-    # we don't lose it when we sort.
-    final_scores = [(final_scores[idx], host_tuple)
-                    for idx, host_tuple in enumerate(host_list)]
-
-    final_scores = sorted(final_scores)
-    weight, (host, hostinfo) = final_scores[0]  # Lowest score is the winner!
+    # Single pass over the hosts, keeping the lowest (score, host).
+    # Ties are broken by host name, same as sorting the full list.
+    best = None
+    for host, host_info in host_list:
+        score = weigh_host(weighted_fns, host_info, options)
+        if best is None or (score, host) < best[:2]:
+            best = (score, host, host_info)
+
+    weight, host, hostinfo = best  # Lowest score is the winner!
     return WeightedHost(weight, host=host, hostinfo=hostinfo)
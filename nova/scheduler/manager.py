@@ -80,6 +80,11 @@ class SchedulerManager(manager.Manager):
         self.zone_manager.update_service_capabilities(service_name,
                             host, capabilities)
 
+    def update_host_resources(self, context=None, host=None, disk_gb=0,
+                              ram_mb=0):
+        """Process a resource consumption update from a compute node."""
+        self.zone_manager.consume_host_resources(host, disk_gb, ram_mb)
+
     def select(self, context=None, *args, **kwargs):
         """Select a list of hosts best matching the provided specs."""
         return self.driver.select(context, *args, **kwargs)
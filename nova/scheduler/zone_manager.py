@@ -39,6 +39,9 @@ flags.DEFINE_integer('reserved_host_disk_mb', 0,
         'Amount of disk in MB to reserve for host/dom0')
 flags.DEFINE_integer('reserved_host_memory_mb', 512,
         'Amount of memory in MB to reserve for host/dom0')
+flags.DEFINE_integer('host_resource_sync_interval', 600,
+        'Seconds between reconciling the cached host resource table '
+        'against the db.')
 
 
 class ZoneState(object):
@@ -187,6 +190,9 @@ class ZoneManager(object):
         self.zone_states = {}  # { <zone_id> : ZoneState }
         self.service_states = {}  # { <host> : { <service> : { cap k : v }}}
         self.green_pool = greenpool.GreenPool()
+        self.last_host_resource_sync = datetime.datetime.min
+        # { <host> : {'free_disk_gb': <int>, 'free_ram_mb': <int>} }
+        self.host_resources = {}
 
     def get_zone_list(self):
         """Return the list of zones we know about."""
@@ -212,52 +218,81 @@ class ZoneManager(object):
         """Broken out for testing."""
         return db.instance_get_all(context)
 
-    def get_all_host_data(self, context):
-        """Returns a dict of all the hosts the ZoneManager
-        knows about. Also, each of the consumable resources in HostInfo
-        are pre-populated and adjusted based on data in the db.
+    def host_resources_stale(self):
+        """Check if the host resource table needs to be reconciled
+        against the db."""
+        diff = utils.utcnow() - self.last_host_resource_sync
+        return diff >= datetime.timedelta(
+                seconds=FLAGS.host_resource_sync_interval)
 
-        For example:
-        {'192.168.1.100': HostInfo(), ...}
+    def sync_host_resources(self, context):
+        """Rebuild the host resource table from the db.
 
-        Note: this can be very slow with a lot of instances.
+        Note: this can be very slow with a lot of instances, so it is
+        only done every host_resource_sync_interval seconds. In between,
+        the table is kept current via consume_host_resources().
         InstanceType table isn't required since a copy is stored
         with the instance (in case the InstanceType changed since the
         instance was created)."""
 
         # Make a compute node dict with the bare essential metrics.
         compute_nodes = self._compute_node_get_all(context)
-        host_info_map = {}
+        host_resources = {}
         for compute in compute_nodes:
-            all_disk = compute['local_gb']
-            all_ram = compute['memory_mb']
             service = compute['service']
             if not service:
                 logging.warn(_("No service for compute ID %s") % compute['id'])
                 continue
 
-            host = service['host']
-            caps = self.service_states.get(host, None)
-            host_info = HostInfo(host, caps=caps,
-                    free_disk_gb=all_disk, free_ram_mb=all_ram)
             # Reserve resources for host/dom0
-            host_info.consume_resources(FLAGS.reserved_host_disk_mb * 1024,
-                    FLAGS.reserved_host_memory_mb)
-            host_info_map[host] = host_info
+            host_resources[service['host']] = dict(
+                    free_disk_gb=(compute['local_gb'] -
+                                  FLAGS.reserved_host_disk_mb * 1024),
+                    free_ram_mb=(compute['memory_mb'] -
+                                 FLAGS.reserved_host_memory_mb))
 
         # "Consume" resources from the host the instance resides on.
         instances = self._instance_get_all(context)
         for instance in instances:
-            host = instance['host']
-            if not host:
-                continue
-            host_info = host_info_map.get(host, None)
-            if not host_info:
+            resources = host_resources.get(instance['host'], None)
+            if not resources:
                 continue
-            disk = instance['local_gb']
-            ram = instance['memory_mb']
-            host_info.consume_resources(disk, ram)
+            resources['free_disk_gb'] -= instance['local_gb']
+            resources['free_ram_mb'] -= instance['memory_mb']
+
+        self.host_resources = host_resources
+        self.last_host_resource_sync = utils.utcnow()
+
+    def consume_host_resources(self, host, disk_gb, ram_mb):
+        """Account for resources consumed (or released, if negative)
+        on a host since the last sync with the db."""
+        resources = self.host_resources.get(host, None)
+        if not resources:
+            # Unknown hosts are picked up on the next sync.
+            return
+        resources['free_disk_gb'] -= disk_gb
+        resources['free_ram_mb'] -= ram_mb
 
+    def get_all_host_data(self, context):
+        """Returns a dict of all the hosts the ZoneManager
+        knows about. Also, each of the consumable resources in HostInfo
+        are pre-populated from the host resource table, which is
+        reconciled against the db when it becomes stale.
+
+        For example:
+        {'192.168.1.100': HostInfo(), ...}
+
+        The HostInfo objects are fresh copies, so the caller is free to
+        virtually consume resources on them."""
+        if self.host_resources_stale():
+            self.sync_host_resources(context)
+
+        host_info_map = {}
+        for host, resources in self.host_resources.iteritems():
+            caps = self.service_states.get(host, None)
+            host_info_map[host] = HostInfo(host, caps=caps,
+                    free_disk_gb=resources['free_disk_gb'],
+                    free_ram_mb=resources['free_ram_mb'])
         return host_info_map
 
     def get_zone_capabilities(self, context):
@@ -332,6 +367,10 @@ class ZoneManager(object):
         logging.debug(_("Received %(service_name)s service update from "
                 "%(host)s.") % locals())
         service_caps = self.service_states.get(host, {})
+        if (service_name == 'compute' and service_name not in service_caps
+            and host not in self.host_resources):
+            # A new compute node came up, force a sync on the next request.
+            self.last_host_resource_sync = datetime.datetime.min
         capabilities["timestamp"] = utils.utcnow()  # Reported time
         service_caps[service_name] = capabilities
         self.service_states[host] = service_caps
@@ -244,6 +244,11 @@ class Service(object):
             except Exception:
                 pass
         self.timers = []
+        try:
+            self.manager.cleanup_host()
+        except Exception:
+            logging.exception(_('Error cleaning up the %s manager'),
+                              self.topic)
 
     def wait(self):
         for x in self.timers:
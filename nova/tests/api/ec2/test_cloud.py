@@ -594,6 +594,37 @@ class CloudTestCase(test.TestCase):
         db.service_destroy(self.context, comp1['id'])
         db.service_destroy(self.context, comp2['id'])
 
+    def test_describe_instances_bulk_lookups(self):
+        """Makes sure describe_instances doesn't query per instance."""
+        self._stub_instance_get_with_fixed_ips('get_all')
+
+        def fail(*args, **kwargs):
+            self.fail('looked up per instance')
+
+        self.stubs.Set(db, 'block_device_mapping_get_all_by_instance', fail)
+        self.stubs.Set(db, 'service_get_all_by_host', fail)
+
+        image_uuid = 'cedef40a-ed67-4d10-800e-17455edce175'
+        instances = []
+        for host in ('host1', 'host1', 'host2'):
+            instances.append(db.instance_create(self.context,
+                                                {'reservation_id': 'a',
+                                                 'image_ref': image_uuid,
+                                                 'instance_type_id': 1,
+                                                 'host': host,
+                                                 'vm_state': 'active'}))
+        comp = db.service_create(self.context, {'host': 'host1',
+                                                'availability_zone': 'zone1',
+                                                'topic': "compute"})
+        result = self.cloud.describe_instances(self.context)
+        result = result['reservationSet'][0]
+        zones = [i['placement']['availabilityZone']
+                 for i in result['instancesSet']]
+        self.assertEqual(sorted(zones), ['unknown zone', 'zone1', 'zone1'])
+        for instance in instances:
+            db.instance_destroy(self.context, instance['id'])
+        db.service_destroy(self.context, comp['id'])
+
     def test_describe_instances_no_ipv6(self):
         """Makes sure describe_instances w/ no ipv6 works."""
         self.flags(use_ipv6=False)
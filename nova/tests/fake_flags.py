@@ -41,3 +41,5 @@ FLAGS['sqlite_db'].SetDefault("tests.sqlite")
 FLAGS['use_ipv6'].SetDefault(True)
 FLAGS['flat_network_bridge'].SetDefault('br100')
 FLAGS['sqlite_synchronous'].SetDefault(False)
+flags.DECLARE('quota_cache_ttl', 'nova.db.api')
+FLAGS['quota_cache_ttl'].SetDefault(0)
@@ -37,6 +37,14 @@ def get_backing_file(path):
     return disk_backing_files.get(path, None)
 
 
+def get_disk_backing_file(path):
+    return disk_backing_files.get(path, None)
+
+
+def update_mtime(path):
+    pass
+
+
 def copy_image(src, dest):
     pass
 
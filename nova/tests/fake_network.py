@@ -15,6 +15,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import re
+
 from nova import db
 from nova import exception
 from nova import flags
@@ -111,6 +113,36 @@ class FakeNetworkManager(network_manager.NetworkManager):
                                     'floating_ips': [floats[2]]}]}]
             return vifs
 
+        def fixed_ip_get_all_by_address_regexp(self, context, pattern):
+            fixed_ips = []
+            for vif in self.virtual_interface_get_all(context):
+                for fixed_ip in vif['fixed_ips']:
+                    if re.match(pattern, fixed_ip['address']):
+                        fixed_ips.append(dict(fixed_ip,
+                                              id=fixed_ip['address'],
+                                              instance_id=vif['instance_id']))
+            return fixed_ips
+
+        def fixed_ip_get_by_address(self, context, address):
+            for vif in self.virtual_interface_get_all(context):
+                for fixed_ip in vif['fixed_ips']:
+                    if fixed_ip['address'] == address:
+                        return dict(fixed_ip, id=address, deleted=False,
+                                    instance_id=vif['instance_id'])
+            raise exception.FixedIpNotFoundForAddress(address=address)
+
+        def floating_ip_get_all_by_address_regexp(self, context, pattern):
+            floating_ips = []
+            for vif in self.virtual_interface_get_all(context):
+                for fixed_ip in vif['fixed_ips']:
+                    for floating_ip in fixed_ip['floating_ips']:
+                        if re.match(pattern, floating_ip['address']):
+                            fixed = {'id': fixed_ip['address'],
+                                     'instance_id': vif['instance_id']}
+                            floating_ips.append(dict(floating_ip,
+                                                     fixed_ip=fixed))
+            return floating_ips
+
         def instance_get_id_to_uuid_mapping(self, context, ids):
             # NOTE(jkoelker): This is just here until we can rely on UUIDs
             mapping = {}
@@ -272,6 +304,7 @@ def fake_get_instance_nw_info(stubs, num_networks=1, ips_per_vif=2,
     stubs.Set(db, 'virtual_interface_get_by_instance', virtual_interfaces_fake)
     stubs.Set(db, 'instance_type_get', instance_type_fake)
     stubs.Set(db, 'network_get', network_get_fake)
+    stubs.Set(db, 'instance_info_cache_get', lambda *args: None)
     stubs.Set(db, 'instance_info_cache_update', update_cache_fake)
 
     class FakeContext(object):
@@ -17,6 +17,7 @@
 
 
 import datetime
+import hashlib
 import stubout
 
 from nova.tests.api.openstack import fakes
@@ -537,6 +538,22 @@ class TestGlanceImageService(test.TestCase):
         self.flags(glance_num_retries=1)
         service.get(self.context, image_id, writer)
 
+    def test_get_verifies_checksum(self):
+        checksums = {1: hashlib.md5('chunk1chunk2').hexdigest(), 2: 'bad'}
+
+        class MyGlanceStubClient(glance_stubs.StubGlanceClient):
+            """A client that returns image data with a checksum."""
+            def get_image(self, image_id):
+                return {'checksum': checksums[image_id]}, ['chunk1', 'chunk2']
+
+        client = MyGlanceStubClient()
+        service = glance.GlanceImageService(client=client)
+        writer = NullWriter()
+
+        service.get(self.context, 1, writer)
+        self.assertRaises(exception.ImageUnacceptable, service.get,
+                          self.context, 2, writer)
+
     def test_glance_client_image_id(self):
         fixture = self._make_fixture(name='test image')
         image_id = self.service.create(self.context, fixture)['id']
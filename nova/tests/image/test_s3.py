@@ -16,6 +16,10 @@
 #    under the License.
 
 import os
+import StringIO
+import tarfile
+
+import eventlet
 
 from nova import context
 import nova.db.api
@@ -134,9 +138,35 @@ class TestS3ImageService(test.TestCase):
         self.assertEqual(block_device_mapping, expected_bdm)
 
     def test_s3_malicious_tarballs(self):
-        self.assertRaises(exception.Error,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'abs.tar.gz'))
-        self.assertRaises(exception.Error,
-            self.image_service._test_for_malicious_tarball,
-            "/unused", os.path.join(os.path.dirname(__file__), 'rel.tar.gz'))
+        for tarball in ('abs.tar.gz', 'rel.tar.gz'):
+            with open(os.path.join(os.path.dirname(__file__),
+                                   tarball)) as tarball_file:
+                self.assertRaises(exception.Error,
+                    self.image_service._image_from_tarball, tarball_file)
+
+    def test_s3_image_from_tarball(self):
+        tarball = StringIO.StringIO()
+        tar_file = tarfile.open(fileobj=tarball, mode='w|gz')
+        member = tarfile.TarInfo('image')
+        member.size = len('image data')
+        tar_file.addfile(member, StringIO.StringIO('image data'))
+        tar_file.close()
+        tarball.seek(0)
+
+        image_file, size = self.image_service._image_from_tarball(tarball)
+        self.assertEqual(image_file.read(), 'image data')
+        self.assertEqual(size, len('image data'))
+
+    def test_s3_download_parts_in_order(self):
+        self.flags(s3_image_part_concurrency=2)
+        filenames = ['part.%d' % i for i in xrange(5)]
+
+        def fake_download_part(bucket, filename):
+            # NOTE(agent): later parts finish downloading first
+            eventlet.sleep(0.001 * (5 - filenames.index(filename)))
+            return filename
+
+        self.stubs.Set(self.image_service, '_download_part',
+                       fake_download_part)
+        parts = list(self.image_service._download_parts(None, filenames))
+        self.assertEqual(parts, filenames)
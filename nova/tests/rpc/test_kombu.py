@@ -19,9 +19,12 @@
 Unit Tests for remote procedure calls using kombu
 """
 
-from nova import context
+import eventlet
+from eventlet import event
+
 from nova import log as logging
 from nova import test
+from nova.rpc import common as rpc_common
 from nova.rpc import impl_kombu
 from nova.tests.rpc import common
 
@@ -108,3 +111,196 @@ class RpcKombuTestCase(common._BaseRpcTestCase):
         conn2.consume(limit=1)
         conn2.close()
         self.assertEqual(self.received_message, message)
+
+    def test_calls_share_reply_queue(self):
+        """Test that calls get their replies on one shared queue"""
+        value = 42
+        result = self.rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value, result)
+        reply_proxy = self.rpc._get_reply_proxy()
+
+        result = self.rpc.call(self.context, 'test', {"method": "echo",
+                                                 "args": {"value": value}})
+        self.assertEqual(value, result)
+        self.assertTrue(self.rpc._get_reply_proxy() is reply_proxy)
+        self.assertEqual(reply_proxy._waiters, {})
+
+    def test_call_timeout(self):
+        """Test that a call with nobody answering times out"""
+        self.flags(rpc_response_timeout=1)
+        self.assertRaises(rpc_common.Timeout, self.rpc.call, self.context,
+                          'nobody_listening', {"method": "echo",
+                                               "args": {"value": 42}})
+        self.assertEqual(self.rpc._get_reply_proxy()._waiters, {})
+
+    def test_abandoned_multicall(self):
+        """Test that a multicall dropped before its last reply stops
+        collecting replies"""
+        reply_proxy = self.rpc._get_reply_proxy()
+        results = iter(self.rpc.multicall(self.context, 'test',
+                                          {"method": "echo",
+                                           "args": {"value": 42}}))
+        self.assertEqual(results.next(), 42)
+        results.close()
+        self.assertEqual(reply_proxy._waiters, {})
+
+        result = self.rpc.multicall(self.context, 'test',
+                                    {"method": "echo",
+                                     "args": {"value": 42}})
+        self.assertEqual(len(reply_proxy._waiters), 1)
+        del result
+        self.assertEqual(reply_proxy._waiters, {})
+
+    def test_publishers_reused(self):
+        """Test that sending twice on a connection reuses the publisher"""
+        conn_context = self.rpc.create_connection(new=False)
+        conn = conn_context.connection
+        conn_context.topic_send('a_topic', 'message 1')
+        publishers = conn.publishers.copy()
+        conn_context.topic_send('a_topic', 'message 2')
+        conn_context.close()
+        self.assertEqual(conn.publishers, publishers)
+
+        # The pooled connection keeps its publishers for the next user.
+        conn_context = self.rpc.create_connection(new=False)
+        self.assertEqual(conn_context.connection, conn)
+        self.assertEqual(conn.publishers, publishers)
+        conn_context.close()
+
+    def test_batched_casts(self):
+        """Test that batched casts are all delivered, in order"""
+        self.flags(rpc_cast_batch_window=0.01)
+        conn = self.rpc.create_connection()
+        self.received_messages = []
+
+        def _callback(message):
+            self.received_messages.append(message['args']['value'])
+
+        conn.declare_topic_consumer('a_batch', _callback)
+        for value in xrange(5):
+            self.rpc.cast(self.context, 'a_batch',
+                          {"method": "echo", "args": {"value": value}})
+        self.assertEqual(self.received_messages, [])
+        conn.consume(limit=5)
+        conn.close()
+
+        self.assertEqual(self.received_messages, range(5))
+
+    def test_batched_casts_connection_failure(self):
+        """Test that batched casts are sent once a connection can be had
+        again"""
+        self.flags(rpc_cast_batch_window=0.01)
+        conn = self.rpc.create_connection()
+        self.received_messages = []
+
+        def _callback(message):
+            self.received_messages.append(message['args']['value'])
+
+        conn.declare_topic_consumer('a_batch', _callback)
+        connection_context = self.rpc.ConnectionContext
+        failures = []
+
+        def fake_connection_context(*args, **kwargs):
+            if not failures:
+                failures.append(True)
+                raise IOError('broker down')
+            return connection_context(*args, **kwargs)
+
+        self.stubs.Set(self.rpc, 'ConnectionContext',
+                       fake_connection_context)
+        self.rpc.cast(self.context, 'a_batch',
+                      {"method": "echo", "args": {"value": 0}})
+        eventlet.sleep(0.05)
+        self.rpc.cast(self.context, 'a_batch',
+                      {"method": "echo", "args": {"value": 1}})
+        conn.consume(limit=2)
+        conn.close()
+
+        self.assertEqual(failures, [True])
+        self.assertEqual(self.received_messages, [0, 1])
+
+    def test_method_pools(self):
+        """Test that a saturated method pool doesn't hold up others"""
+        self.flags(rpc_method_pool_sizes=['slow:1'],
+                   rpc_method_pool_backlog=1)
+        calls = []
+        release = event.Event()
+
+        class Proxy(object):
+            def slow(self, context):
+                release.wait()
+                calls.append('slow')
+
+            def fast(self, context):
+                calls.append('fast')
+
+        def _message(method):
+            message = {'method': method, 'args': {}}
+            self.rpc._pack_context(message, self.context)
+            return message
+
+        callback = self.rpc.ProxyCallback(Proxy())
+        for method in ('slow', 'slow', 'fast'):
+            callback(_message(method))
+        self.assertTrue(callback.method_pools['slow'].full())
+        self.assertFalse(callback.pool.full())
+        eventlet.sleep(0)
+
+        self.assertEqual(calls, ['fast'])
+        stats = callback.get_stats()
+        self.assertEqual(stats['slow']['running'], 1)
+        self.assertEqual(stats['slow']['waiting'], 1)
+        self.assertEqual(stats['fast']['completed'], 1)
+
+        release.send()
+        for i in xrange(3):
+            eventlet.sleep(0)
+
+        self.assertEqual(calls, ['fast', 'slow', 'slow'])
+        stats = callback.get_stats()
+        self.assertEqual(stats['slow']['running'], 0)
+        self.assertEqual(stats['slow']['waiting'], 0)
+        self.assertEqual(stats['slow']['completed'], 2)
+
+    def test_full_method_pool_holds_up_consumer(self):
+        """Test that messages for a full pool wait on the consumer rather
+        than going back to the broker"""
+        self.flags(rpc_method_pool_sizes=['slow:1'],
+                   rpc_method_pool_backlog=0)
+        received = []
+        calls = []
+        release = event.Event()
+
+        class Proxy(object):
+            def slow(self, context, value):
+                release.wait()
+                calls.append(value)
+
+        proxy_callback = self.rpc.ProxyCallback.__call__
+
+        def fake_proxy_callback(callback, message_data):
+            received.append(message_data['args']['value'])
+            return proxy_callback(callback, message_data)
+
+        self.stubs.Set(self.rpc.ProxyCallback, '__call__',
+                       fake_proxy_callback)
+        conn = self.rpc.create_connection(new=True)
+        conn.create_consumer('a_pool', Proxy())
+        conn.consume_in_thread()
+        for value in (1, 2, 3):
+            self.rpc.cast(self.context, 'a_pool',
+                          {'method': 'slow', 'args': {'value': value}})
+        eventlet.sleep(0.1)
+
+        # The first runs, the second waits for it and the third is left
+        # on the queue, each received once
+        self.assertEqual(received, [1, 2])
+        self.assertEqual(calls, [])
+
+        release.send()
+        eventlet.sleep(0.1)
+        conn.close()
+
+        self.assertEqual(received, [1, 2, 3])
+        self.assertEqual(calls, [1, 2, 3])
@@ -32,6 +32,7 @@ class FakeZoneManager(zone_manager.ZoneManager):
        host4: free_ram_mb=8192  free_disk_gb=8192"""
 
     def __init__(self):
+        super(FakeZoneManager, self).__init__()
         self.service_states = {
             'host1': {
                 'compute': {'host_memory_free': 1073741824},
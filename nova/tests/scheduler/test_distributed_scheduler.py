@@ -33,6 +33,7 @@ from nova.tests.scheduler import fake_zone_manager as ds_fakes
 
 class FakeEmptyZoneManager(zone_manager.ZoneManager):
     def __init__(self):
+        super(FakeEmptyZoneManager, self).__init__()
         self.service_states = {}
 
     def get_host_list_from_db(self, context):
@@ -214,17 +215,15 @@ class DistributedSchedulerTestCase(test.TestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weighted_sum(functions, hosts, options):
+        def _fake_weigh_host(functions, hostinfo, options):
             self.next_weight += 2.0
-            host, hostinfo = hosts[0]
-            return least_cost.WeightedHost(self.next_weight, host=host,
-                                           hostinfo=hostinfo)
+            return self.next_weight
 
         sched = ds_fakes.FakeDistributedScheduler()
         fake_context = context.RequestContext('user', 'project')
         sched.zone_manager = ds_fakes.FakeZoneManager()
         self.stubs.Set(sched, '_filter_hosts', fake_filter_hosts)
-        self.stubs.Set(least_cost, 'weighted_sum', _fake_weighted_sum)
+        self.stubs.Set(least_cost, 'weigh_host', _fake_weigh_host)
         self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
         self.stubs.Set(sched, '_call_zone_method', fake_call_zone_method)
 
@@ -248,17 +247,15 @@ class DistributedSchedulerTestCase(test.TestCase):
 
         self.next_weight = 1.0
 
-        def _fake_weighted_sum(functions, hosts, options):
+        def _fake_weigh_host(functions, hostinfo, options):
             self.next_weight += 2.0
-            host, hostinfo = hosts[0]
-            return least_cost.WeightedHost(self.next_weight, host=host,
-                                           hostinfo=hostinfo)
+            return self.next_weight
 
         sched = ds_fakes.FakeDistributedScheduler()
         fake_context = context.RequestContext('user', 'project')
         sched.zone_manager = ds_fakes.FakeZoneManager()
         self.stubs.Set(sched, '_filter_hosts', fake_filter_hosts)
-        self.stubs.Set(least_cost, 'weighted_sum', _fake_weighted_sum)
+        self.stubs.Set(least_cost, 'weigh_host', _fake_weigh_host)
         self.stubs.Set(nova.db, 'zone_get_all', fake_zone_get_all)
         self.stubs.Set(sched, '_call_zone_method', fake_call_zone_method)
 
@@ -273,6 +270,39 @@ class DistributedSchedulerTestCase(test.TestCase):
             self.assertTrue(weighted_host.host is not None)
             self.assertTrue(weighted_host.zone is None)
 
+    def test_schedule_filters_hosts_once(self):
+        """Make sure _schedule() only filters the full host list once and
+        afterwards only re-checks the host it consumed resources on."""
+        self.filter_calls = []
+
+        def _fake_filter_hosts(topic, request_spec, hosts, options):
+            self.filter_calls.append([host for host, hostinfo in hosts])
+            # Only hosts with room for another 512MB instance pass.
+            return [(host, hostinfo) for host, hostinfo in hosts
+                    if hostinfo.free_ram_mb >= 512]
+
+        sched = ds_fakes.FakeDistributedScheduler()
+        fake_context = context.RequestContext('user', 'project')
+        sched.zone_manager = ds_fakes.FakeZoneManager()
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+        self.stubs.Set(sched, '_filter_hosts', _fake_filter_hosts)
+
+        # Fill-first: host2 (1536 free) takes three instances before
+        # host3 (3072 free) is used.
+        instance_type = dict(memory_mb=512, local_gb=512)
+        request_spec = dict(num_instances=5, instance_type=instance_type,
+                            local_zone=True)
+        weighted_hosts = sched._schedule(fake_context, 'compute',
+                                         request_spec)
+
+        self.assertEquals([wh.host for wh in weighted_hosts],
+                          ['host2', 'host2', 'host2', 'host3', 'host3'])
+        self.assertEquals(sorted(self.filter_calls[0]),
+                          ['host1', 'host2', 'host3', 'host4'])
+        self.assertEquals(self.filter_calls[1:],
+                          [['host2'], ['host2'], ['host2'], ['host3'],
+                           ['host3']])
+
     def test_decrypt_blob(self):
         """Test that the decrypt method works."""
 
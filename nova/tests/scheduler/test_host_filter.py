@@ -251,3 +251,25 @@ class HostFilterTestCase(test.TestCase):
 
         self.assertFalse(hf.filter_hosts(all_hosts,
                 json.dumps(['=', {}, ['>', '$missing....foo']]), {}))
+
+    def test_json_filter_compiles_query_once(self):
+        hf = nova.scheduler.filters.JsonFilter()
+        cooked = hf.instance_type_to_filter(self.instance_type)
+        all_hosts = self._get_all_hosts()
+
+        self.loads_count = 0
+        real_loads = json.loads
+
+        def _fake_loads(*args, **kwargs):
+            self.loads_count += 1
+            return real_loads(*args, **kwargs)
+
+        self.stubs.Set(json, 'loads', _fake_loads)
+        hosts = hf.filter_hosts(all_hosts, cooked, {})
+        self.assertEquals(2, len(hosts))
+
+        # A new filter instance reuses the compiled query.
+        hf = nova.scheduler.filters.JsonFilter()
+        hosts = hf.filter_hosts(all_hosts, cooked, {})
+        self.assertEquals(2, len(hosts))
+        self.assertTrue(self.loads_count <= 1)
@@ -80,3 +80,14 @@ class LeastCostTestCase(test.TestCase):
                                                                     options)
         self.assertEqual(weighted_host.weight, 10000)
         self.assertEqual(weighted_host.host, 'host1')
+
+    def test_weighted_sum_ties_go_to_lowest_host_name(self):
+        fn_tuples = [(1.0, least_cost.noop_cost_fn), ]
+        hostinfo_list = self.zone_manager.get_all_host_data(None).items()
+        hostinfo_list.sort(reverse=True)
+
+        options = {}
+        weighted_host = least_cost.weighted_sum(fn_tuples, hostinfo_list,
+                                                options)
+        self.assertEqual(weighted_host.weight, 1)
+        self.assertEqual(weighted_host.host, 'host1')
@@ -44,6 +44,7 @@ from nova.network.quantum import client as quantum_client
 from nova.notifier import test_notifier
 from nova.scheduler import driver as scheduler_driver
 from nova import rpc
+from nova.rpc import common as rpc_common
 from nova import test
 from nova.tests import fake_network
 from nova import utils
@@ -894,6 +895,29 @@ class ComputeTestCase(BaseTestCase):
 
         self.compute.terminate_instance(self.context, instance_uuid)
 
+    def test_get_instances_nw_info_old_network_service(self):
+        """Make sure the network info is still fetched from a network
+        service without get_instances_nw_info"""
+        self.flags(stub_network=False)
+
+        def fake_get_instances_nw_info(context, instances):
+            raise rpc_common.RemoteError('AttributeError',
+                    "'VlanManager' object has no attribute "
+                    "'get_instances_nw_info'")
+
+        def fake_get_instance_nw_info(context, instance):
+            return ['info of %s' % instance['uuid']]
+
+        self.stubs.Set(self.compute.network_api, 'get_instances_nw_info',
+                       fake_get_instances_nw_info)
+        self.stubs.Set(self.compute.network_api, 'get_instance_nw_info',
+                       fake_get_instance_nw_info)
+        instances = [{'uuid': 'fake-uuid-1'}, {'uuid': 'fake-uuid-2'}]
+        self.assertEqual(self.compute._get_instances_nw_info(self.context,
+                                                             instances),
+                         {'fake-uuid-1': ['info of fake-uuid-1'],
+                          'fake-uuid-2': ['info of fake-uuid-2']})
+
     def test_finish_resize(self):
         """Contrived test to ensure finish_resize doesn't raise anything"""
 
@@ -1347,6 +1371,47 @@ class ComputeTestCase(BaseTestCase):
         self.compute.add_instance_fault_from_exc(ctxt, instance_uuid,
                                         exc.HTTPNotFound("Error Details"))
 
+    def test_poll_bandwidth_usage(self):
+        """Ensure bandwidth usage is written in bulk, looking up each
+        virtual interface only once"""
+        bw_usage = [dict(mac_address='56:12:12:12:12:10', bw_in=1, bw_out=2),
+                    dict(mac_address='56:12:12:12:12:11', bw_in=3, bw_out=4),
+                    dict(mac_address='56:12:12:12:12:12', bw_in=5, bw_out=6)]
+        lookups = []
+        updates = []
+
+        def fake_virtual_interface_get_by_addresses(context, addresses):
+            lookups.append(sorted(addresses))
+            return [dict(address=address, instance_id=i,
+                         network=dict(label='net1'))
+                    for i, address in enumerate(sorted(addresses))
+                    if address != '56:12:12:12:12:12']
+
+        def fake_bw_usage_update_many(context, start_period, usages):
+            updates.append(usages)
+
+        self.stubs.Set(self.compute.driver, 'get_all_bw_usage',
+                       lambda start_time, stop_time: bw_usage)
+        self.stubs.Set(nova.db, 'virtual_interface_get_by_addresses',
+                       fake_virtual_interface_get_by_addresses)
+        self.stubs.Set(nova.db, 'bw_usage_update_many',
+                       fake_bw_usage_update_many)
+        self.flags(bandwith_poll_interval=-1)
+        ctxt = context.get_admin_context()
+        start_time = datetime.datetime(2012, 3, 1)
+        self.compute._poll_bandwidth_usage(ctxt, start_time)
+        self.compute._poll_bandwidth_usage(ctxt, start_time)
+
+        # Only the unknown address is looked up again
+        self.assertEqual(lookups, [['56:12:12:12:12:10', '56:12:12:12:12:11',
+                                    '56:12:12:12:12:12'],
+                                   ['56:12:12:12:12:12']])
+        expected = [dict(instance_id=0, network_label='net1',
+                         bw_in=1, bw_out=2),
+                    dict(instance_id=1, network_label='net1',
+                         bw_in=3, bw_out=4)]
+        self.assertEqual(updates, [expected, expected])
+
 
 class ComputeAPITestCase(BaseTestCase):
 
@@ -2252,6 +2317,44 @@ class ComputeAPITestCase(BaseTestCase):
         db.instance_destroy(c, instance2['uuid'])
         db.instance_destroy(c, instance3['uuid'])
 
+    def test_get_all_by_fixed_ip(self):
+        """Test searching instances by an exact fixed ip"""
+        c = context.get_admin_context()
+        network_manager = fake_network.FakeNetworkManager()
+        self.stubs.Set(self.compute_api.network_api,
+                       'get_instance_uuids_by_ip_filter',
+                       network_manager.get_instance_uuids_by_ip_filter)
+        self.stubs.Set(network_manager.db,
+                       'instance_get_id_to_uuid_mapping',
+                       db.instance_get_id_to_uuid_mapping)
+
+        def fake_regexp_lookup(context, pattern):
+            self.fail('fixed_ip looked up by regexp')
+
+        self.stubs.Set(network_manager.db,
+                       'fixed_ip_get_all_by_address_regexp',
+                       fake_regexp_lookup)
+        self.stubs.Set(network_manager.db,
+                       'floating_ip_get_all_by_address_regexp',
+                       fake_regexp_lookup)
+
+        instance1 = self._create_fake_instance({'id': 0})
+        instance2 = self._create_fake_instance({'id': 20})
+        instance3 = self._create_fake_instance({'id': 30})
+
+        instances = self.compute_api.get_all(c,
+                search_opts={'fixed_ip': '172.16.0.2'})
+        self.assertEqual([instance['uuid'] for instance in instances],
+                         [instance2['uuid']])
+
+        instances = self.compute_api.get_all(c,
+                search_opts={'fixed_ip': '172.16.0.20'})
+        self.assertEqual(instances, [])
+
+        db.instance_destroy(c, instance1['uuid'])
+        db.instance_destroy(c, instance2['uuid'])
+        db.instance_destroy(c, instance3['uuid'])
+
     def test_get_all_by_multiple_options_at_once(self):
         """Test searching by multiple options at once"""
         c = context.get_admin_context()
@@ -2904,3 +3007,24 @@ class ComputeAPITestCase(BaseTestCase):
         self.compute_api.inject_file(self.context, instance,
                                      "/tmp/test", "File Contents")
         db.instance_destroy(self.context, instance['uuid'])
+
+    def test_prefetch_image(self):
+        """Ensure prefetching an image casts to every compute host"""
+        context = self.context.elevated()
+        for host in ('host1', 'host2'):
+            db.service_create(context, {'host': host,
+                                        'binary': 'nova-compute',
+                                        'topic': FLAGS.compute_topic})
+        casts = []
+
+        def fake_cast(context, topic, msg):
+            casts.append((topic, msg))
+
+        self.stubs.Set(rpc, 'cast', fake_cast)
+        self.compute_api.prefetch_image(context, 'fake-image')
+        self.assertEqual(sorted(topic for topic, _msg in casts),
+                         ['%s.host1' % FLAGS.compute_topic,
+                          '%s.host2' % FLAGS.compute_topic])
+        for _topic, msg in casts:
+            self.assertEqual(msg, {'method': 'prefetch_image',
+                                   'args': {'image_id': 'fake-image'}})
@@ -23,8 +23,10 @@ import datetime
 from nova import test
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import utils
+from nova.db.sqlalchemy import api as sqlalchemy_api
 
 FLAGS = flags.FLAGS
 
@@ -102,6 +104,58 @@ class DbApiTestCase(test.TestCase):
         else:
             self.assertTrue(result[1].deleted)
 
+    def test_instance_get_all_by_filters_paginated(self):
+        values = {'project_id': self.project_id}
+        instances = [db.instance_create(self.context, values)
+                     for i in xrange(5)]
+        uuids = [instance['uuid'] for instance in reversed(instances)]
+
+        result = db.instance_get_all_by_filters(self.context, {}, limit=2)
+        self.assertEqual([r['uuid'] for r in result], uuids[:2])
+        result = db.instance_get_all_by_filters(self.context, {}, limit=2,
+                                                marker=result[-1]['uuid'])
+        self.assertEqual([r['uuid'] for r in result], uuids[2:4])
+        result = db.instance_get_all_by_filters(self.context, {}, 'id',
+                                                'asc', marker=uuids[1])
+        self.assertEqual([r['uuid'] for r in result], [uuids[0]])
+        self.assertRaises(exception.MarkerNotFound,
+                          db.instance_get_all_by_filters, self.context, {},
+                          marker='not-a-marker')
+
+    def test_instance_get_all_by_filters_regexp(self):
+        for name in ('web1', 'web2', 'WEB3', 'db1', 'webx'):
+            db.instance_create(self.context, {'display_name': name,
+                                              'project_id': self.project_id})
+
+        result = db.instance_get_all_by_filters(self.context,
+                {'display_name': 'web'}, limit=2)
+        self.assertEqual(len(result), 2)
+        result = db.instance_get_all_by_filters(self.context,
+                {'display_name': '^web[0-9]'})
+        self.assertEqual(sorted(r['display_name'] for r in result),
+                         ['web1', 'web2'])
+        result = db.instance_get_all_by_filters(self.context,
+                {'display_name': 'db|web', 'ip': '^10\\.0\\.0\\.1$'})
+        self.assertEqual(len(result), 4)
+
+    def test_instance_get_all_by_filters_columns_to_join(self):
+        values = {'project_id': self.project_id}
+        instance = db.instance_create(self.context, values)
+        _setup_networking(instance['id'])
+        result = db.instance_get_all_by_filters(self.context, {},
+                                                columns_to_join=[])
+        self.assertFalse('fixed_ips' in result[0].__dict__)
+        result = db.instance_get_all_by_filters(self.context, {})
+        self.assertTrue('fixed_ips' in result[0].__dict__)
+
+    def test_regexp_literal_prefix(self):
+        prefix = sqlalchemy_api._regexp_literal_prefix
+        self.assertEqual(prefix('^web.*'), 'web')
+        self.assertEqual(prefix('web\\.1$'), 'web.1')
+        self.assertEqual(prefix('webs?'), 'web')
+        self.assertEqual(prefix('\\dweb'), '')
+        self.assertEqual(prefix('db|web'), '')
+
     def test_migration_get_all_unconfirmed(self):
         ctxt = context.get_admin_context()
 
@@ -270,3 +324,71 @@ class DbApiTestCase(test.TestCase):
         instance_faults = db.instance_fault_get_by_instance_uuids(ctxt, uuids)
         expected = {uuids[0]: [], uuids[1]: []}
         self.assertEqual(expected, instance_faults)
+
+    def test_fixed_ip_claim_pool(self):
+        ctxt = context.get_admin_context()
+        network = db.network_create_safe(ctxt, {})
+        for i in xrange(3):
+            db.fixed_ip_create(ctxt, {'address': '10.0.0.%d' % i,
+                                      'network_id': network['id']})
+        instance = db.instance_create(ctxt, {})
+
+        claimed = db.fixed_ip_claim_pool(ctxt, network['id'], 'host1', 2)
+        self.assertEqual(len(claimed), 2)
+        others = db.fixed_ip_claim_pool(ctxt, network['id'], 'host2', 2)
+        self.assertEqual(len(others), 1)
+        self.assertFalse(set(claimed) & set(others))
+
+        # Claimed ips are skipped by the locking allocator.
+        self.assertRaises(exception.NoMoreFixedIps,
+                          db.fixed_ip_associate_pool, ctxt, network['id'],
+                          instance['id'])
+        self.assertFalse(db.fixed_ip_associate_claimed(ctxt, claimed[0],
+                                                       instance['id'],
+                                                       'host2'))
+        self.assertTrue(db.fixed_ip_associate_claimed(ctxt, claimed[0],
+                                                      instance['id'],
+                                                      'host1'))
+        fixed_ip = db.fixed_ip_get_by_address(ctxt, claimed[0])
+        self.assertEqual(fixed_ip['instance_id'], instance['id'])
+        self.assertEqual(fixed_ip['claimed_by'], None)
+
+        self.assertEqual(db.fixed_ip_release_claimed(ctxt, 'host1'), 1)
+        address = db.fixed_ip_associate_pool(ctxt, network['id'],
+                                             instance['id'])
+        self.assertEqual(address, claimed[1])
+
+    def test_virtual_interface_get_by_addresses(self):
+        ctxt = context.get_admin_context()
+        network = db.network_create_safe(ctxt, {'label': 'net1'})
+        for i in xrange(3):
+            db.virtual_interface_create(ctxt,
+                                        {'address': '56:12:12:12:12:1%d' % i,
+                                         'network_id': network['id'],
+                                         'instance_id': i})
+        addresses = ['56:12:12:12:12:10', '56:12:12:12:12:12',
+                     '56:12:12:12:12:13']
+        vifs = db.virtual_interface_get_by_addresses(ctxt, addresses)
+        self.assertEqual(sorted(vif['instance_id'] for vif in vifs), [0, 2])
+        self.assertEqual([vif['network']['label'] for vif in vifs],
+                         ['net1', 'net1'])
+        self.assertEqual(db.virtual_interface_get_by_addresses(ctxt, []), [])
+
+    def test_bw_usage_update_many(self):
+        ctxt = context.get_admin_context()
+        start_period = datetime.datetime(2012, 3, 1)
+        db.bw_usage_update(ctxt, 1, 'net1', start_period, 10, 20)
+        db.bw_usage_update_many(ctxt, start_period,
+                                [dict(instance_id=1, network_label='net1',
+                                      bw_in=100, bw_out=200),
+                                 dict(instance_id=2, network_label='net1',
+                                      bw_in=300, bw_out=400)])
+
+        bw_usages = db.bw_usage_get_by_instance(ctxt, 1, start_period)
+        self.assertEqual(len(bw_usages), 1)
+        self.assertEqual((bw_usages[0]['bw_in'], bw_usages[0]['bw_out']),
+                         (100, 200))
+        bw_usages = db.bw_usage_get_by_instance(ctxt, 2, start_period)
+        self.assertEqual(len(bw_usages), 1)
+        self.assertEqual((bw_usages[0]['bw_in'], bw_usages[0]['bw_out']),
+                         (300, 400))
@@ -162,3 +162,27 @@ class IptablesManagerTestCase(test.TestCase):
             self.assertTrue('-A %s -j runner.py-%s' \
                             % (chain, chain) in new_lines,
                             "Built-in chain %s not wrapped" % (chain,))
+
+    def test_apply_skips_unchanged_tables(self):
+        self.flags(use_ipv6=False)
+        restored = []
+
+        def fake_execute(*cmd, **kwargs):
+            if cmd[0] == 'iptables-save':
+                if cmd[2] == 'nat':
+                    return '\n'.join(self.sample_nat), None
+                return '\n'.join(self.sample_filter), None
+            restored.append(kwargs['process_input'].split('\n')[1])
+            return '', ''
+
+        self.manager.execute = fake_execute
+        self.manager.apply()
+        self.assertEqual(sorted(restored), ['*filter', '*nat'])
+
+        restored[:] = []
+        self.manager.apply()
+        self.assertEqual(restored, [])
+
+        self.manager.ipv4['filter'].add_rule('FORWARD', '-s 1.2.3.4/5 -j DROP')
+        self.manager.apply()
+        self.assertEqual(restored, ['*filter'])
@@ -15,6 +15,7 @@
 #    under the License.
 
 import copy
+import datetime
 import eventlet
 import mox
 import os
@@ -41,6 +42,7 @@ from nova.virt import images
 from nova.virt import driver
 from nova.virt.libvirt import connection
 from nova.virt.libvirt import firewall
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import volume
 from nova.volume import driver as volume_driver
 from nova.virt.libvirt import utils as libvirt_utils
@@ -257,6 +259,65 @@ class CacheConcurrencyTestCase(test.TestCase):
             eventlet.sleep(0)
 
 
+class ImageCacheManagerTestCase(test.TestCase):
+    def setUp(self):
+        super(ImageCacheManagerTestCase, self).setUp()
+        self.instances_path = tempfile.mkdtemp()
+        self.flags(instances_path=self.instances_path)
+        self.base_dir = imagecache.get_base_dir()
+        os.mkdir(self.base_dir)
+        os.mkdir(os.path.join(self.instances_path, 'instance-00000001'))
+        open(os.path.join(self.instances_path, 'instance-00000001',
+                          'disk'), 'w').close()
+        # NOTE(agent): 'used' is the least recently used base image, but backs
+        #              the disk of instance-00000001
+        for fname, mtime in (('used', 1000), ('old', 2000), ('new', 3000)):
+            path = os.path.join(self.base_dir, fname)
+            with open(path, 'w') as f:
+                f.write('x' * 4096)
+            os.utime(path, (mtime, mtime))
+
+        self.stubs.Set(libvirt_utils, 'get_disk_backing_file',
+                       lambda path: 'used')
+        self.manager = imagecache.ImageCacheManager()
+
+    def tearDown(self):
+        shutil.rmtree(self.instances_path)
+        super(ImageCacheManagerTestCase, self).tearDown()
+
+    def _base_image_size(self, fname):
+        return os.stat(os.path.join(self.base_dir, fname)).st_blocks * 512
+
+    def test_removes_unused_base_images_lru_first(self):
+        self.flags(base_image_cache_max_bytes=self._base_image_size('used') +
+                                              self._base_image_size('new'))
+        self.manager.manage_base_images()
+        self.assertEqual(sorted(os.listdir(self.base_dir)), ['new', 'used'])
+
+    def test_keeps_base_images_in_use(self):
+        self.flags(base_image_cache_max_bytes=1)
+        self.manager.manage_base_images()
+        self.assertEqual(os.listdir(self.base_dir), ['used'])
+
+    def test_never_removes_base_images_by_default(self):
+        self.flags(base_image_cache_max_bytes=0)
+        self.manager.manage_base_images()
+        self.assertEqual(len(os.listdir(self.base_dir)), 3)
+
+    def test_keeps_base_images_used_since_listed(self):
+        self.flags(base_image_cache_max_bytes=1)
+        real_list_backing_files = self.manager._list_backing_files
+
+        def fake_list_backing_files():
+            libvirt_utils.update_mtime(os.path.join(self.base_dir, 'old'))
+            return real_list_backing_files()
+
+        self.stubs.Set(self.manager, '_list_backing_files',
+                       fake_list_backing_files)
+        self.manager.manage_base_images()
+        self.assertEqual(sorted(os.listdir(self.base_dir)), ['old', 'used'])
+
+
 class FakeVolumeDriver(object):
     def __init__(self, *args, **kwargs):
         pass
@@ -736,6 +797,66 @@ class LibvirtConnTestCase(test.TestCase):
             self.assertEquals(conn.uri, testuri)
         db.instance_destroy(user_context, instance_ref['id'])
 
+    def test_get_all_bw_usage(self):
+        xml = """
+            <domain type='kvm'>
+                <devices>
+                    <interface type='bridge'>
+                        <mac address='56:12:12:12:12:10'/>
+                        <target dev='vnet0'/>
+                    </interface>
+                </devices>
+            </domain>
+        """
+        stats = {'vnet0': (100, 1, 0, 0, 200, 2, 0, 0)}
+
+        class FakeDomain(FakeVirtDomain):
+            def interfaceStats(self, dev):
+                return stats[dev]
+
+        def listDomainsID():
+            return [1]
+
+        def lookupByID(domain_id):
+            return FakeDomain(xml)
+
+        self.create_fake_libvirt_mock(listDomainsID=listDomainsID,
+                                      lookupByID=lookupByID)
+        self.mox.ReplayAll()
+        conn = connection.LibvirtConnection(False)
+
+        def assert_bw_usage(start_time, bw_in, bw_out):
+            self.assertEqual(conn.get_all_bw_usage(start_time),
+                             [dict(mac_address='56:12:12:12:12:10',
+                                   bw_in=bw_in, bw_out=bw_out)])
+
+        # Traffic from before the first poll may already be recorded
+        start_time = datetime.datetime(2012, 3, 1)
+        assert_bw_usage(start_time, 0, 0)
+        stats['vnet0'] = (150, 2, 0, 0, 260, 3, 0, 0)
+        assert_bw_usage(start_time, 50, 60)
+        # The counters start over when the instance is restarted
+        stats['vnet0'] = (10, 1, 0, 0, 20, 1, 0, 0)
+        assert_bw_usage(start_time, 60, 80)
+        # Usage starts over in a new audit period
+        start_time = datetime.datetime(2012, 4, 1)
+        stats['vnet0'] = (30, 2, 0, 0, 50, 2, 0, 0)
+        assert_bw_usage(start_time, 20, 30)
+
+        # After a restart of nova-compute, usage carries on from what was
+        # recorded
+        ctxt = context.get_admin_context()
+        network = db.network_create_safe(ctxt, {'label': 'public'})
+        db.virtual_interface_create(ctxt, {'address': '56:12:12:12:12:10',
+                                           'instance_id': 1,
+                                           'network_id': network['id']})
+        db.bw_usage_update(ctxt, 1, 'public', start_time, 20, 30)
+        conn._bw_counters = {}
+        stats['vnet0'] = (45, 3, 0, 0, 70, 3, 0, 0)
+        assert_bw_usage(start_time, 20, 30)
+        stats['vnet0'] = (50, 4, 0, 0, 80, 4, 0, 0)
+        assert_bw_usage(start_time, 25, 40)
+
     def test_update_available_resource_works_correctly(self):
         """Confirm compute_node table is updated successfully."""
         self.flags(instances_path='.')
@@ -1356,11 +1477,18 @@ class IptablesFirewallTestCase(test.TestCase):
                 ips.extend(info['ips'])
             return [ip['ip'] for ip in ips]
 
+        def get_fixed_ips_by_groups(context, security_group_ids):
+            return dict((group_id, get_fixed_ips())
+                        for group_id in security_group_ids)
+
         from nova.network import linux_net
         linux_net.iptables_manager.execute = fake_iptables_execute
+        # NOTE(agent): make sure every table is restored through the fake
+        linux_net.iptables_manager._applied = {}
 
         network_info = _fake_network_info(self.stubs, 1)
-        self.stubs.Set(db, 'instance_get_fixed_addresses', get_fixed_ips)
+        self.stubs.Set(db, 'instance_get_fixed_addresses_by_security_groups',
+                       get_fixed_ips_by_groups)
         self.fw.prepare_instance_filter(instance_ref, network_info)
         self.fw.apply_instance_filter(instance_ref, network_info)
 
@@ -1448,14 +1576,148 @@ class IptablesFirewallTestCase(test.TestCase):
                   ipv6_rules_per_addr * ipv6_addr_per_network * networks_count)
 
     def test_do_refresh_security_group_rules(self):
+        admin_ctxt = context.get_admin_context()
         instance_ref = self._create_instance_ref()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
         self.mox.StubOutWithMock(self.fw,
                                  'add_filters_for_instance',
                                  use_mock_anything=True)
         self.fw.prepare_instance_filter(instance_ref, mox.IgnoreArg())
         self.fw.instances[instance_ref['id']] = instance_ref
         self.mox.ReplayAll()
-        self.fw.do_refresh_security_group_rules("fake")
+        self.fw.do_refresh_security_group_rules(secgroup['id'])
+
+    def test_do_refresh_security_group_rules_other_group(self):
+        instance_ref = self._create_instance_ref()
+        self.mox.StubOutWithMock(self.fw,
+                                 'add_filters_for_instance',
+                                 use_mock_anything=True)
+        self.fw.instances[instance_ref['id']] = instance_ref
+        self.fw.instance_security_groups[instance_ref['id']] = set([1])
+        self.mox.ReplayAll()
+        # Only instances in the refreshed group get their chains rebuilt
+        self.fw.do_refresh_security_group_rules(2)
+
+    def test_rules_forgotten_when_group_unused(self):
+        admin_ctxt = context.get_admin_context()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        rule = db.security_group_rule_create(admin_ctxt,
+                {'parent_group_id': secgroup['id'],
+                 'protocol': 'tcp',
+                 'from_port': 22,
+                 'to_port': 22,
+                 'cidr': '10.0.0.0/8'})
+        self.stubs.Set(self.fw.iptables, 'apply', lambda: None)
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda instance, network_info: None)
+        network_info = _fake_network_info(self.stubs, 1)
+
+        instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        self.fw.prepare_instance_filter(instance_ref, network_info)
+        self.fw.unfilter_instance(instance_ref, network_info)
+
+        # The rule is revoked while no member of the group is on this
+        # host, so this host is not told about it.
+        db.security_group_rule_destroy(admin_ctxt, rule['id'])
+
+        instance_ref = self._create_instance_ref()
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+        ipv4_rules, ipv6_rules = self.fw.instance_rules(instance_ref,
+                                                        network_info)
+        self.assertFalse([r for r in ipv4_rules if '10.0.0.0/8' in r])
+
+    def test_do_refresh_security_group_members(self):
+        instance_ref = self._create_instance_ref()
+        self.mox.StubOutWithMock(self.fw,
+                                 'add_filters_for_instance',
+                                 use_mock_anything=True)
+        self.fw.add_filters_for_instance(instance_ref)
+        self.fw.instances[instance_ref['id']] = instance_ref
+        self.fw.instance_security_groups[instance_ref['id']] = set([1])
+        self.fw.security_group_rules[1] = [{'protocol': 'tcp',
+                                            'from_port': 22,
+                                            'to_port': 22,
+                                            'cidr': None,
+                                            'group_id': 2}]
+        self.mox.ReplayAll()
+        self.fw.do_refresh_security_group_members(3)
+        self.fw.do_refresh_security_group_members(2)
+
+    def test_shared_group_chains(self):
+        self.flags(iptables_shared_group_chains=True)
+        admin_ctxt = context.get_admin_context()
+        instance_ref = self._create_instance_ref()
+        secgroup = db.security_group_create(admin_ctxt,
+                                            {'user_id': 'fake',
+                                             'project_id': 'fake',
+                                             'name': 'testgroup',
+                                             'description': 'test group'})
+        src_secgroup = db.security_group_create(admin_ctxt,
+                                                {'user_id': 'fake',
+                                                 'project_id': 'fake',
+                                                 'name': 'testsourcegroup',
+                                                 'description': 'src group'})
+        db.security_group_rule_create(admin_ctxt,
+                                      {'parent_group_id': secgroup['id'],
+                                       'protocol': 'tcp',
+                                       'from_port': 80,
+                                       'to_port': 81,
+                                       'group_id': src_secgroup['id']})
+        db.instance_add_security_group(admin_ctxt, instance_ref['uuid'],
+                                       secgroup['id'])
+
+        self.members = ['10.0.0.1', '10.0.0.2']
+
+        def get_fixed_ips_by_groups(context, security_group_ids):
+            return dict((group_id, self.members)
+                        for group_id in security_group_ids)
+
+        self.stubs.Set(db, 'instance_get_fixed_addresses_by_security_groups',
+                       get_fixed_ips_by_groups)
+        self.stubs.Set(self.fw.iptables, 'apply', lambda: None)
+
+        network_info = _fake_network_info(self.stubs, 1)
+        self.fw.prepare_instance_filter(instance_ref, network_info)
+
+        table = self.fw.iptables.ipv4['filter']
+        group_chain = 'nova-sg-%s' % src_secgroup['id']
+        instance_chain = self.fw._instance_chain_name(instance_ref)
+        jumps = [rule.rule for rule in table.rules
+                 if rule.chain == instance_chain and group_chain in rule.rule]
+        self.assertEqual(len(jumps), 1)
+
+        def group_chain_rules():
+            return [rule.rule for rule in table.rules
+                    if rule.chain == group_chain]
+
+        self.assertEqual(group_chain_rules(), ['-s 10.0.0.1 -j ACCEPT',
+                                               '-s 10.0.0.2 -j ACCEPT'])
+
+        # A membership change only touches the shared chain
+        self.members = ['10.0.0.3']
+        self.mox.StubOutWithMock(self.fw, 'add_filters_for_instance')
+        self.mox.ReplayAll()
+        self.fw.do_refresh_security_group_members(src_secgroup['id'])
+        self.assertEqual(group_chain_rules(), ['-s 10.0.0.3 -j ACCEPT'])
+        self.mox.UnsetStubs()
+
+        self.stubs.Set(self.fw.nwfilter, 'unfilter_instance',
+                       lambda *args: None)
+        self.fw.unfilter_instance(instance_ref, network_info)
+        self.assertFalse(group_chain in table.chains)
 
     @test.skip_if(missing_libvirt(), "Test requires libvirt")
     def test_unfilter_instance_undefines_nwfilter(self):
@@ -197,12 +197,13 @@ class LinuxNetworkTestCase(test.TestCase):
         network_driver = FLAGS.network_driver
         self.driver = utils.import_object(network_driver)
         self.driver.db = db
+        self.stubs.Set(linux_net, '_dhcp_hosts', {})
 
     def test_update_dhcp_for_nw00(self):
         self.flags(use_single_default_gateway=True)
 
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
-        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instance')
+        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instances')
         self.mox.StubOutWithMock(self.driver, 'write_to_file')
         self.mox.StubOutWithMock(self.driver, 'ensure_path')
         self.mox.StubOutWithMock(os, 'chmod')
@@ -216,12 +217,10 @@ class LinuxNetworkTestCase(test.TestCase):
                                             mox.IgnoreArg())\
                                             .AndReturn([fixed_ips[0],
                                                         fixed_ips[3]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[0], vifs[1]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[2], vifs[3]])
+        db.virtual_interface_get_by_instances(mox.IgnoreArg(),
+                                              mox.IgnoreArg())\
+                                              .AndReturn([vifs[0], vifs[1],
+                                                          vifs[2], vifs[3]])
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.ensure_path(mox.IgnoreArg())
@@ -241,7 +240,7 @@ class LinuxNetworkTestCase(test.TestCase):
     def test_update_dhcp_for_nw01(self):
         self.flags(use_single_default_gateway=True)
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
-        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instance')
+        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instances')
         self.mox.StubOutWithMock(self.driver, 'write_to_file')
         self.mox.StubOutWithMock(self.driver, 'ensure_path')
         self.mox.StubOutWithMock(os, 'chmod')
@@ -255,12 +254,10 @@ class LinuxNetworkTestCase(test.TestCase):
                                             mox.IgnoreArg())\
                                             .AndReturn([fixed_ips[1],
                                                         fixed_ips[2]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[0], vifs[1]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[2], vifs[3]])
+        db.virtual_interface_get_by_instances(mox.IgnoreArg(),
+                                              mox.IgnoreArg())\
+                                              .AndReturn([vifs[0], vifs[1],
+                                                          vifs[2], vifs[3]])
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.write_to_file(mox.IgnoreArg(), mox.IgnoreArg())
         self.driver.ensure_path(mox.IgnoreArg())
@@ -277,6 +274,20 @@ class LinuxNetworkTestCase(test.TestCase):
 
         self.driver.update_dhcp(None, "eth0", networks[0])
 
+    def test_update_dhcp_unchanged(self):
+        self.stubs.Set(self.driver, 'get_dhcp_hosts',
+                       lambda context, network_ref: 'fake hosts')
+        self.stubs.Set(self.driver, '_dnsmasq_running', lambda dev: True)
+        self.mox.StubOutWithMock(self.driver, 'write_to_file')
+        self.mox.StubOutWithMock(self.driver, 'restart_dhcp')
+        self.driver.write_to_file(mox.IgnoreArg(), 'fake hosts')
+        self.driver.restart_dhcp(None, "eth0", networks[0])
+        self.mox.ReplayAll()
+
+        # The second update finds nothing to write or reload
+        self.driver.update_dhcp(None, "eth0", networks[0])
+        self.driver.update_dhcp(None, "eth0", networks[0])
+
     def test_get_dhcp_hosts_for_nw00(self):
         self.flags(use_single_default_gateway=True)
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
@@ -317,23 +328,16 @@ class LinuxNetworkTestCase(test.TestCase):
 
     def test_get_dhcp_opts_for_nw00(self):
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
-        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instance')
+        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instances')
 
         db.network_get_associated_fixed_ips(mox.IgnoreArg(),
                                             mox.IgnoreArg())\
                                             .AndReturn([fixed_ips[0],
                                                         fixed_ips[3],
                                                         fixed_ips[4]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[0],
-                                                         vifs[1],
-                                                         vifs[4]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[2],
-                                                         vifs[3],
-                                                         vifs[5]])
+        db.virtual_interface_get_by_instances(mox.IgnoreArg(),
+                                              mox.IgnoreArg())\
+                                              .AndReturn(vifs)
         self.mox.ReplayAll()
 
         expected_opts = 'NW-i00000001-0,3'
@@ -343,23 +347,16 @@ class LinuxNetworkTestCase(test.TestCase):
 
     def test_get_dhcp_opts_for_nw01(self):
         self.mox.StubOutWithMock(db, 'network_get_associated_fixed_ips')
-        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instance')
+        self.mox.StubOutWithMock(db, 'virtual_interface_get_by_instances')
 
         db.network_get_associated_fixed_ips(mox.IgnoreArg(),
                                             mox.IgnoreArg())\
                                             .AndReturn([fixed_ips[1],
                                                         fixed_ips[2],
                                                         fixed_ips[5]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[0],
-                                                         vifs[1],
-                                                         vifs[4]])
-        db.virtual_interface_get_by_instance(mox.IgnoreArg(),
-                                             mox.IgnoreArg())\
-                                             .AndReturn([vifs[2],
-                                                         vifs[3],
-                                                         vifs[5]])
+        db.virtual_interface_get_by_instances(mox.IgnoreArg(),
+                                              mox.IgnoreArg())\
+                                              .AndReturn(vifs)
         self.mox.ReplayAll()
 
         expected_opts = "NW-i00000000-1,3"
@@ -189,3 +189,28 @@ class MetadataTestCase(test.TestCase):
         self.assertEqual(self.app._format_instance_mapping(ctxt,
                                                            instance_ref1),
                          expected)
+
+    def test_metadata_cached(self):
+        self.calls = 0
+
+        def instance_get_list(*args, **kwargs):
+            self.calls += 1
+            return [self.instance]
+
+        self.stubs.Set(api, 'instance_get_all_by_filters', instance_get_list)
+        self.instance['user_data'] = base64.b64encode('happy')
+        self.assertEqual(self.request('/user-data'), 'happy')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.request('/meta-data/local-hostname'),
+            "%s.%s" % (self.instance['hostname'], FLAGS.dhcp_domain))
+        self.assertEqual(self.calls, 1)
+
+        # The mpi data lists the project, so it is only looked up when asked
+        self.request('/meta-data/mpi')
+        self.assertEqual(self.calls, 2)
+        self.request('/meta-data/mpi')
+        self.assertEqual(self.calls, 2)
+
+        self.flags(metadata_cache_expiration=0)
+        self.request('/user-data')
+        self.assertEqual(self.calls, 3)
@@ -193,6 +193,57 @@ class FlatNetworkTestCase(test.TestCase):
                       for ip_num in xrange(num_fixed_ips)]
             self.assertDictListMatch(info['ips'], check)
 
+    def test_get_instances_nw_info(self):
+        fixed_ips = [fake_network.next_fixed_ip(0),
+                     fake_network.next_fixed_ip(0)]
+        fixed_ips[1]['instance_id'] = 1
+        vifs = list(fake_network.vifs(1)) * 2
+        vifs[1] = dict(vifs[1], id=1, instance_id=1,
+                       address='DE:AD:BE:EF:00:01')
+        info_caches = {'uuid0': {'network_info': None},
+                       'uuid1': {'network_info': None}}
+        calls = {'network_get': 0, 'instance_info_cache_update': 0}
+
+        def fake_network_get(context, network_id):
+            calls['network_get'] += 1
+            return fake_network.fake_network(network_id)
+
+        def fake_instance_info_cache_get(context, instance_uuid):
+            return info_caches[instance_uuid]
+
+        def fake_instance_info_cache_update(context, instance_uuid, values):
+            calls['instance_info_cache_update'] += 1
+            info_caches[instance_uuid] = values
+
+        self.stubs.Set(db, 'fixed_ip_get_by_instances',
+                       lambda context, instance_ids: fixed_ips)
+        self.stubs.Set(db, 'virtual_interface_get_by_instances',
+                       lambda context, instance_ids: vifs)
+        self.stubs.Set(db, 'instance_type_get',
+                       lambda context, instance_type_id: fake_network.flavor)
+        self.stubs.Set(db, 'network_get', fake_network_get)
+        self.stubs.Set(db, 'instance_info_cache_get',
+                       fake_instance_info_cache_get)
+        self.stubs.Set(db, 'instance_info_cache_update',
+                       fake_instance_info_cache_update)
+
+        instances = [{'instance_id': 0, 'instance_uuid': 'uuid0',
+                      'instance_type_id': 1, 'host': HOST},
+                     {'instance_id': 1, 'instance_uuid': 'uuid1',
+                      'instance_type_id': 1, 'host': HOST}]
+        nw_infos = self.network.get_instances_nw_info(self.context,
+                                                      instances)
+        self.assertEqual(calls['network_get'], 1)
+        self.assertEqual(calls['instance_info_cache_update'], 2)
+        self.assertEqual(nw_infos['uuid0'][0][1]['mac'], vifs[0]['address'])
+        self.assertEqual(nw_infos['uuid1'][0][1]['mac'], vifs[1]['address'])
+        self.assertEqual(nw_infos['uuid1'][0][1]['ips'][0]['ip'],
+                         fixed_ips[1]['address'])
+
+        # the info caches are up to date now so they aren't written again
+        self.network.get_instances_nw_info(self.context, instances)
+        self.assertEqual(calls['instance_info_cache_update'], 2)
+
     def test_validate_networks(self):
         self.mox.StubOutWithMock(db, 'network_get_all_by_uuids')
         self.mox.StubOutWithMock(db, "fixed_ip_get_by_address")
@@ -421,6 +472,34 @@ class VlanNetworkTestCase(test.TestCase):
         network['vpn_private_address'] = '192.168.0.2'
         self.network.allocate_fixed_ip(self.context, 0, network)
 
+    def test_allocate_fixed_ip_from_claimed_pool(self):
+        self.flags(fixed_ip_pool_size=3)
+        self.mox.StubOutWithMock(db, 'fixed_ip_claim_pool')
+        self.mox.StubOutWithMock(db, 'fixed_ip_associate_claimed')
+
+        db.fixed_ip_claim_pool(mox.IgnoreArg(), networks[0]['id'], HOST,
+                               3).AndReturn(['192.168.0.101',
+                                             '192.168.0.102',
+                                             '192.168.0.103'])
+        # The first ip was taken explicitly after it was claimed.
+        db.fixed_ip_associate_claimed(mox.IgnoreArg(), '192.168.0.101', 0,
+                                      HOST).AndReturn(False)
+        db.fixed_ip_associate_claimed(mox.IgnoreArg(), '192.168.0.102', 0,
+                                      HOST).AndReturn(True)
+        db.fixed_ip_associate_claimed(mox.IgnoreArg(), '192.168.0.103', 1,
+                                      HOST).AndReturn(True)
+        db.fixed_ip_claim_pool(mox.IgnoreArg(), networks[0]['id'], HOST,
+                               3).AndReturn([])
+        self.mox.ReplayAll()
+
+        associate = self.network._associate_pool_address
+        self.assertEqual(associate(self.context, networks[0]['id'], 0),
+                         '192.168.0.102')
+        self.assertEqual(associate(self.context, networks[0]['id'], 1),
+                         '192.168.0.103')
+        self.assertRaises(exception.NoMoreFixedIps, associate,
+                          self.context, networks[0]['id'], 2)
+
     def test_create_networks_too_big(self):
         self.assertRaises(ValueError, self.network.create_networks, None,
                           num_networks=4094, vlan_start=1)
@@ -1081,6 +1160,23 @@ class CommonNetworkTestCase(test.TestCase):
         self.assertEqual(len(res), 1)
         self.assertEqual(res[0]['instance_id'], _vifs[2]['instance_id'])
 
+    def test_get_instance_uuids_by_floating_ip(self):
+        manager = fake_network.FakeNetworkManager()
+        _vifs = manager.db.virtual_interface_get_all(None)
+        fake_context = context.RequestContext('user', 'project')
+
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': '172.16.1.2'})
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0]['instance_id'], _vifs[1]['instance_id'])
+        self.assertEqual(res[0]['ip'], '172.16.1.2')
+
+        # The fixed ip matching hides the floating ip of the same instance
+        res = manager.get_instance_uuids_by_ip_filter(fake_context,
+                                                      {'ip': '172.16'})
+        self.assertEqual([r['ip'] for r in res],
+                         ['172.16.0.1', '172.16.0.2'])
+
 
 class TestRPCFixedManager(network_manager.RPCAllocateFixedIP,
         network_manager.NetworkManager):
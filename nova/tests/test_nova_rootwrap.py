@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from nova.rootwrap import daemon
 from nova.rootwrap.filters import CommandFilter, RegExpFilter, DnsmasqFilter
 from nova.rootwrap.wrapper import match_filter
 from nova import test
@@ -63,3 +64,22 @@ class RootwrapTestCase(test.TestCase):
         usercmd = ["cat", "/"]
         filtermatch = match_filter(self.filters, usercmd)
         self.assertTrue(filtermatch is self.filters[-1])
+
+    def test_daemon_run_commands(self):
+        results = daemon.run_commands(self.filters, [
+                {'cmd': [u'cat'], 'process_input': u'foo\xff'},
+                {'cmd': [u'ls', u'/nonexistant'], 'check_exit_code': None},
+                {'cmd': [u'ls', u'/nonexistant']},
+                {'cmd': [u'cat']}])
+        # Stops at the first command exiting with a code it may not exit with
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], [0, u'foo\xff', u''])
+        self.assertNotEqual(results[1][0], 0)
+        self.assertNotEqual(results[2][0], 0)
+
+    def test_daemon_rejects_unauthorized(self):
+        results = daemon.run_commands(self.filters, [
+                {'cmd': [u'foo_bar_not_exist']},
+                {'cmd': [u'cat']}])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0], daemon.RC_UNAUTHORIZED)
@@ -16,6 +16,10 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
+
+from sqlalchemy.exc import IntegrityError
+
 from nova import compute
 from nova import context
 from nova import db
@@ -24,8 +28,11 @@ from nova import quota
 from nova import exception
 from nova import rpc
 from nova import test
+from nova import utils
 from nova import volume
 from nova.compute import instance_types
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
 from nova.scheduler import driver as scheduler_driver
 
 
@@ -284,6 +291,121 @@ class QuotaTestCase(test.TestCase):
                           self.project_id)
         db.floating_ip_destroy(context.get_admin_context(), address)
 
+    def test_usage_tracked_without_recounting(self):
+        self.recounts = 0
+        real_count = sqlalchemy_api._instance_usage_count
+
+        def _fake_count(*args, **kwargs):
+            self.recounts += 1
+            return real_count(*args, **kwargs)
+
+        self.stubs.Set(sqlalchemy_api, '_instance_usage_count',
+                       _fake_count)
+        instance_id = self._create_instance(cores=2)
+        self.assertEqual(db.instance_data_get_for_project(self.context,
+                                                          self.project_id),
+                         (1, 2, 0))
+        other_id = self._create_instance(cores=1)
+        db.instance_update(self.context, other_id, {'vcpus': 3,
+                                                    'memory_mb': 512})
+        self.assertEqual(db.instance_data_get_for_project(self.context,
+                                                          self.project_id),
+                         (2, 5, 512))
+        db.instance_destroy(self.context, instance_id)
+        db.instance_destroy(self.context, instance_id)
+        self.assertEqual(db.instance_data_get_for_project(self.context,
+                                                          self.project_id),
+                         (1, 3, 512))
+        self.assertEqual(self.recounts, 1)
+        db.instance_destroy(self.context, other_id)
+
+    def test_usage_recounted_when_old(self):
+        self.flags(quota_usage_max_age=60)
+        volume_id = self._create_volume(size=5)
+        self.assertEqual(db.volume_data_get_for_project(self.context,
+                                                        self.project_id),
+                         (1, 5))
+        # A change the counters don't know about is picked up once
+        # the usage is old enough to be counted again.
+        sqlalchemy_api.model_query(self.context, models.Volume).\
+                filter_by(id=volume_id).\
+                update({'size': 7})
+        self.assertEqual(db.volume_data_get_for_project(self.context,
+                                                        self.project_id),
+                         (1, 5))
+        utils.set_time_override(utils.utcnow() +
+                                datetime.timedelta(seconds=61))
+        try:
+            self.assertEqual(db.volume_data_get_for_project(self.context,
+                                                            self.project_id),
+                             (1, 7))
+        finally:
+            utils.clear_time_override()
+        db.volume_destroy(self.context, volume_id)
+
+    def test_usage_rows_unique(self):
+        volume_id = self._create_volume(size=5)
+        db.volume_data_get_for_project(self.context, self.project_id)
+        usage_ref = models.ProjectUsage()
+        usage_ref.project_id = self.project_id
+        usage_ref.resource = 'volumes'
+        usage_ref.in_use = 1
+        self.assertRaises((exception.Duplicate, IntegrityError),
+                          usage_ref.save)
+        db.volume_destroy(self.context, volume_id)
+
+    def test_usage_read_back_after_concurrent_create(self):
+        volume_id = self._create_volume(size=5)
+        self.calls = 0
+        real_get = sqlalchemy_api._project_usage_get_or_count
+
+        def _racing_get(*args, **kwargs):
+            self.calls += 1
+            if self.calls == 1:
+                # Another request creates the rows while this one counts.
+                real_get(*args, **kwargs)
+                raise exception.Duplicate()
+            return real_get(*args, **kwargs)
+
+        self.stubs.Set(sqlalchemy_api, '_project_usage_get_or_count',
+                       _racing_get)
+        self.assertEqual(db.volume_data_get_for_project(self.context,
+                                                        self.project_id),
+                         (1, 5))
+        self.assertEqual(self.calls, 2)
+        db.volume_destroy(self.context, volume_id)
+
+    def test_quotas_cached_until_changed(self):
+        self.flags(quota_cache_ttl=60)
+        self.assertEqual(quota.get_project_quotas(self.context,
+                                                  self.project_id)['volumes'],
+                         2)
+        db.quota_create(self.context, self.project_id, 'volumes', 5)
+        self.assertEqual(quota.get_project_quotas(self.context,
+                                                  self.project_id)['volumes'],
+                         5)
+
+        self.queries = 0
+        real_query = sqlalchemy_api.model_query
+
+        def _fake_model_query(*args, **kwargs):
+            self.queries += 1
+            return real_query(*args, **kwargs)
+
+        self.stubs.Set(sqlalchemy_api, 'model_query', _fake_model_query)
+        quota.get_project_quotas(self.context, self.project_id)
+        self.assertEqual(self.queries, 0)
+        self.stubs.Set(sqlalchemy_api, 'model_query', real_query)
+
+        db.quota_update(self.context, self.project_id, 'volumes', 6)
+        self.assertEqual(quota.get_project_quotas(self.context,
+                                                  self.project_id)['volumes'],
+                         6)
+        db.quota_destroy_all_by_project(self.context, self.project_id)
+        self.assertEqual(quota.get_project_quotas(self.context,
+                                                  self.project_id)['volumes'],
+                         2)
+
     def test_too_many_metadata_items(self):
         metadata = {}
         for i in range(FLAGS.quota_metadata_items + 1):
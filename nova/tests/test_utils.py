@@ -18,6 +18,7 @@ import __builtin__
 import mox
 import datetime
 import os
+import StringIO
 import tempfile
 
 import nova
@@ -111,6 +112,96 @@ grep foo
             os.unlink(tmpfilename)
             os.unlink(tmpfilename2)
 
+    def test_execute_many_stops_at_failure(self):
+        executed = []
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(cmd)
+            if cmd[-1] == 'false':
+                raise exception.ProcessExecutionError()
+            return 'out', 'err'
+
+        self.stubs.Set(utils, 'execute', fake_execute)
+        self.assertEqual(utils.execute_many([('/usr/bin/env', 'true')],
+                                            run_as_root=True),
+                         [('out', 'err')])
+        self.assertRaises(exception.ProcessExecutionError,
+                          utils.execute_many,
+                          [('/usr/bin/env', 'false'),
+                           ('/usr/bin/env', 'true')])
+        self.assertEqual(executed, [('/usr/bin/env', 'true'),
+                                    ('/usr/bin/env', 'false')])
+
+    def test_execute_many_in_rootwrap_daemon(self):
+        requests = []
+
+        def fake_execute_in_rootwrap_daemon(commands):
+            requests.append(commands)
+            return [(0, 'out', ''), (1, '', 'err')]
+
+        self.flags(root_helper_daemon='sudo nova-rootwrap-daemon')
+        self.stubs.Set(utils, '_execute_in_rootwrap_daemon',
+                       fake_execute_in_rootwrap_daemon)
+        self.assertRaises(exception.ProcessExecutionError,
+                          utils.execute_many,
+                          [('ip', 'addr', 'del', '10.0.0.1/24', 'dev', 'eth0'),
+                           ('ip', 'addr', 'add', '10.0.0.1/24', 'dev', 'br0'),
+                           ('ip', 'link', 'set', 'br0', 'up')],
+                          run_as_root=True)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(len(requests[0]), 3)
+        self.assertEqual(requests[0][1],
+                         (['ip', 'addr', 'add', '10.0.0.1/24', 'dev', 'br0'],
+                          None, [0]))
+        self.assertEqual(utils.execute_many([('ip', 'link')],
+                                            check_exit_code=[0, 1],
+                                            run_as_root=True),
+                         [('out', ''), ('', 'err')])
+
+    def test_execute_in_rootwrap_daemon(self):
+        def fake_execute_in_rootwrap_daemon(commands):
+            self.assertEqual(commands, [(['cat'], 'foo', None)])
+            return [(0, 'foo', '')]
+
+        self.flags(root_helper_daemon='sudo nova-rootwrap-daemon')
+        self.stubs.Set(utils, '_execute_in_rootwrap_daemon',
+                       fake_execute_in_rootwrap_daemon)
+        self.assertEqual(utils.execute('cat', process_input='foo',
+                                       run_as_root=True),
+                         ('foo', ''))
+
+    def test_rootwrap_daemon_restart_reaps_old_daemon(self):
+        class FakeDaemon(object):
+            def __init__(self):
+                self.stdin = StringIO.StringIO()
+                self.stdout = StringIO.StringIO('/tmp/rootwrap.sock\n')
+                self.returncode = None
+
+            def poll(self):
+                return self.returncode
+
+            def wait(self):
+                self.returncode = 0
+                return self.returncode
+
+        daemons = []
+
+        def fake_popen(*args, **kwargs):
+            daemons.append(FakeDaemon())
+            return daemons[-1]
+
+        self.flags(root_helper_daemon='sudo nova-rootwrap-daemon')
+        self.stubs.Set(utils.subprocess, 'Popen', fake_popen)
+        self.stubs.Set(utils, '_rootwrap_daemon', None)
+        self.assertEqual(utils._get_rootwrap_daemon_socket(),
+                         '/tmp/rootwrap.sock')
+        self.assertEqual(utils._get_rootwrap_daemon_socket(restart=True),
+                         '/tmp/rootwrap.sock')
+        self.assertEqual(len(daemons), 2)
+        self.assertTrue(daemons[0].stdin.closed)
+        self.assertEqual(daemons[0].returncode, 0)
+        self.assertEqual(daemons[1].returncode, None)
+
 
 class GetFromPathTestCase(test.TestCase):
     def test_tolerates_nones(self):
@@ -15,9 +15,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+import shutil
+import tempfile
+
+import eventlet
+from eventlet import event
+
 from nova import flags
+import nova.image
 from nova import test
 from nova.virt import driver
+from nova.virt import images
 
 FLAGS = flags.FLAGS
 
@@ -81,3 +90,82 @@ class TestVirtDriver(test.TestCase):
                                                 'swap_size': 0}))
         self.assertTrue(driver.swap_is_usable({'device_name': '/dev/sdb',
                                                 'swap_size': 1}))
+
+
+class FakeImageService(object):
+    """Image service whose downloads block until released"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.downloads = 0
+        self.released = event.Event()
+
+    def show(self, context, image_id):
+        return {'id': image_id}
+
+    def get(self, context, image_id, data):
+        self.downloads += 1
+        self.released.wait()
+        for chunk in self.chunks:
+            data.write(chunk)
+        return {'id': image_id}
+
+
+class TestVirtImages(test.TestCase):
+    def setUp(self):
+        super(TestVirtImages, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.image_service = FakeImageService(['x', '\0' * 8, 'y',
+                                               '\0' * 4])
+        self.stubs.Set(nova.image, 'get_image_service',
+                       lambda context, href: (self.image_service, href))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestVirtImages, self).tearDown()
+
+    def _read(self, fname):
+        with open(os.path.join(self.tmpdir, fname)) as f:
+            return f.read()
+
+    def test_fetch_leaves_holes(self):
+        self.image_service.released.send()
+        images.fetch(None, '1', os.path.join(self.tmpdir, 'image'),
+                     None, None)
+        self.assertEqual(self._read('image'),
+                         'x' + '\0' * 8 + 'y' + '\0' * 4)
+
+    def test_concurrent_fetches_share_download(self):
+        fetches = [eventlet.spawn(images.fetch, None, '1',
+                                  os.path.join(self.tmpdir, fname),
+                                  None, None)
+                   for fname in ('image1', 'image2')]
+        eventlet.sleep(0)
+        self.image_service.released.send()
+        for fetch in fetches:
+            self.assertEqual(fetch.wait(), {'id': '1'})
+
+        self.assertEqual(self.image_service.downloads, 1)
+        self.assertEqual(self._read('image1'), self._read('image2'))
+
+    def test_fetch_after_shared_download_finished(self):
+        def fake_show(context, image_id):
+            # The download being joined finishes meanwhile
+            eventlet.sleep()
+            return {'id': image_id}
+
+        self.stubs.Set(self.image_service, 'show', fake_show)
+        first = eventlet.spawn(images.fetch, None, '1',
+                               os.path.join(self.tmpdir, 'image1'),
+                               None, None)
+        eventlet.sleep(0)
+        late = eventlet.spawn(images.fetch, None, '1',
+                              os.path.join(self.tmpdir, 'image2'),
+                              None, None)
+        self.image_service.released.send()
+        with eventlet.Timeout(5):
+            self.assertEqual(first.wait(), {'id': '1'})
+            self.assertEqual(late.wait(), {'id': '1'})
+
+        self.assertEqual(self.image_service.downloads, 2)
+        self.assertEqual(self._read('image1'), self._read('image2'))
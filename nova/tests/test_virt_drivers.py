@@ -390,6 +390,14 @@ class _VirtDriverTestCase(test.TestCase):
         host_status = self.connection.get_host_stats()
         self._check_host_status_fields(host_status)
 
+    @catch_notimplementederror
+    def test_manage_image_cache(self):
+        self.connection.manage_image_cache(self.ctxt)
+
+    @catch_notimplementederror
+    def test_prefetch_image(self):
+        self.connection.prefetch_image(self.ctxt, '1')
+
     @catch_notimplementederror
     def test_set_host_enabled(self):
         self.connection.set_host_enabled('a useless argument?', True)
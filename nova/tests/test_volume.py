@@ -321,6 +321,58 @@ class VolumeDriverTestCase(DriverTestCase):
         self.output = 'x'
         self.volume.driver.delete_volume({'name': 'test1', 'size': 1024})
 
+    def _delete_and_wipe(self, name, size):
+        """Deletes a volume and waits for the wipe, returns the commands
+        executed."""
+        executed = []
+
+        def fake_execute(*cmd, **kwargs):
+            executed.append(cmd)
+            if cmd[0] == 'lvs':
+                return ("  wipe-volume-1     -wi-a- 2048.00\n"
+                        "  wipe-_snapshot-1  swi-a- 1024.00\n"
+                        "  volume-2          -wi-ao 2048.00\n"), None
+            return '', None
+
+        self.volume.driver.set_execute(fake_execute)
+        self.volume.driver._delete_volume({'name': name}, size)
+        self.volume.driver._wipe_pool.waitall()
+        self.assertEqual(self.volume.driver._wipes, set())
+        return executed
+
+    def test_delete_volume_wipes_in_background(self):
+        """Test deleted volumes are renamed, then wiped and removed."""
+        executed = self._delete_and_wipe('volume-1', 2)
+        self.assertEqual(executed[0], ('lvrename', 'nova-volumes',
+                                       'volume-1', 'wipe-volume-1'))
+        self.assertTrue(('ionice', '-c3', 'dd', 'if=/dev/zero',
+                         'of=/dev/mapper/nova--volumes-wipe--volume--1',
+                         'bs=1M', 'count=2048', 'seek=0', 'oflag=direct')
+                        in executed)
+        # Only the copy-on-write store of snapshots is wiped
+        self.assertTrue(('ionice', '-c3', 'dd', 'if=/dev/zero',
+                         'of=/dev/mapper/nova--volumes-wipe--_snapshot--1-cow',
+                         'bs=1M', 'count=1024', 'seek=0', 'oflag=direct')
+                        in executed)
+        removed = [cmd[-1] for cmd in executed if cmd[0] == 'lvremove']
+        self.assertEqual(sorted(removed), ['nova-volumes/wipe-_snapshot-1',
+                                           'nova-volumes/wipe-volume-1'])
+
+    def test_delete_volume_wipe_size(self):
+        """Test wiping can be limited or turned off."""
+        self.flags(volume_clear_size=100, volume_clear_ionice=0)
+        executed = self._delete_and_wipe('volume-1', 2)
+        wipes = [cmd for cmd in executed if cmd[0] == 'dd']
+        self.assertEqual(len(wipes), 2)
+        for cmd in wipes:
+            self.assertTrue('count=100' in cmd)
+
+        self.flags(volume_clear='none')
+        executed = self._delete_and_wipe('volume-1', 2)
+        self.assertFalse([cmd for cmd in executed if cmd[0] == 'dd'])
+        self.assertEqual(len([cmd for cmd in executed
+                              if cmd[0] == 'lvremove']), 2)
+
 
 class ISCSITestCase(DriverTestCase):
     """Test Case for ISCSIDriver"""
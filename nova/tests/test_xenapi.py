@@ -25,6 +25,8 @@ import os
 import re
 import stubout
 
+from eventlet import greenthread
+
 from nova import db
 from nova import context
 from nova import flags
@@ -1133,6 +1135,65 @@ class HostStateTestCase(test.TestCase):
         self.assertEquals(stats['host_memory_free_computed'], 40)
 
 
+class XenAPISessionTaskTestCase(test.TestCase):
+    """Unit tests for waiting on XenAPI tasks."""
+    def setUp(self):
+        super(XenAPISessionTaskTestCase, self).setUp()
+        self.stubs = stubout.StubOutForTesting()
+        self.flags(xenapi_task_event_timeout=0.01,
+                   xenapi_task_poll_interval=0.01)
+        stubs.stubout_session(self.stubs, xenapi_fake.SessionBase)
+        xenapi_fake.reset()
+        self.session = xenapi_conn.XenAPISession('test_url', 'root',
+                                                 'test_pass')
+
+    def tearDown(self):
+        super(XenAPISessionTaskTestCase, self).tearDown()
+        self.stubs.UnsetAll()
+
+    def _create_task(self, **fields):
+        task = xenapi_fake.create_task('Async.VM.start')
+        xenapi_fake.get_record('task', task).update(fields)
+        return task
+
+    def _complete_task_later(self, task):
+        def complete_task():
+            xenapi_fake.get_record('task', task).update(
+                    status='success', result=xenapi_fake.as_value('done'))
+
+        greenthread.spawn_after(0.05, complete_task)
+
+    def test_wait_for_completed_task(self):
+        task = self._create_task(status='success',
+                                 result=xenapi_fake.as_value('done'))
+        self.assertEqual(self.session.wait_for_task(task), 'done')
+        self.assertTrue(self.session._task_watcher is None)
+
+    def test_wait_for_failed_task(self):
+        task = self._create_task(status='failure',
+                                 error_info=['VM_MISSING_PV_DRIVERS'])
+        self.assertRaises(xenapi_fake.Failure,
+                          self.session.wait_for_task, task)
+
+    def test_wait_for_pending_task(self):
+        task = self._create_task(status='pending')
+        self._complete_task_later(task)
+        self.assertEqual(self.session.wait_for_task(task), 'done')
+        self.assertEqual(self.session._task_waiters, {})
+
+    def test_wait_for_pending_task_without_events(self):
+        def fake_event_from(*args):
+            raise xenapi_fake.Failure(['MESSAGE_METHOD_UNKNOWN',
+                                       'event.from'])
+
+        self.stubs.Set(xenapi_fake.SessionBase, 'event_from',
+                       fake_event_from)
+        task = self._create_task(status='pending')
+        self._complete_task_later(task)
+        self.assertEqual(self.session.wait_for_task(task), 'done')
+        self.assertFalse(self.session._task_events_supported)
+
+
 class XenAPIAutoDiskConfigTestCase(test.TestCase):
     def setUp(self):
         super(XenAPIAutoDiskConfigTestCase, self).setUp()
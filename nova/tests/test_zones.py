@@ -379,3 +379,92 @@ class ZoneManagerTestCase(test.TestCase):
         utils.set_time_override(time_future)
         caps = zm.get_zone_capabilities(None)
         self.assertEquals(caps, {})
+
+    def _stub_host_resource_db(self, zm):
+        self.mox.StubOutWithMock(zm, '_compute_node_get_all')
+        self.mox.StubOutWithMock(zm, '_instance_get_all')
+        zm._compute_node_get_all(mox.IgnoreArg()).AndReturn([
+            dict(id=1, local_gb=1024, memory_mb=2048,
+                 service=dict(host='host1')),
+            dict(id=2, local_gb=2048, memory_mb=4096,
+                 service=dict(host='host2')),
+            dict(id=3, local_gb=4096, memory_mb=8192, service=None)])
+        zm._instance_get_all(mox.IgnoreArg()).AndReturn([
+            dict(local_gb=10, memory_mb=512, host='host1'),
+            dict(local_gb=20, memory_mb=1024, host='host2'),
+            dict(local_gb=40, memory_mb=2048, host=None)])
+
+    def test_get_all_host_data_syncs_once(self):
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=512)
+        zm = zone_manager.ZoneManager()
+        self._stub_host_resource_db(zm)
+
+        self.mox.ReplayAll()
+        hosts = zm.get_all_host_data(None)
+        # Second call must be served from the table, not the db.
+        hosts = zm.get_all_host_data(None)
+        self.mox.VerifyAll()
+
+        self.assertEquals(sorted(hosts.keys()), ['host1', 'host2'])
+        self.assertEquals(hosts['host1'].free_ram_mb, 2048 - 512 - 512)
+        self.assertEquals(hosts['host1'].free_disk_gb, 1024 - 10)
+        self.assertEquals(hosts['host2'].free_ram_mb, 4096 - 512 - 1024)
+        self.assertEquals(hosts['host2'].free_disk_gb, 2048 - 20)
+
+    def test_get_all_host_data_returns_copies(self):
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+        zm = zone_manager.ZoneManager()
+        self._stub_host_resource_db(zm)
+
+        self.mox.ReplayAll()
+        hosts = zm.get_all_host_data(None)
+        hosts['host1'].consume_resources(100, 100)
+        hosts = zm.get_all_host_data(None)
+        self.mox.VerifyAll()
+
+        self.assertEquals(hosts['host1'].free_ram_mb, 2048 - 512)
+        self.assertEquals(hosts['host1'].free_disk_gb, 1024 - 10)
+
+    def test_consume_host_resources(self):
+        self.flags(reserved_host_disk_mb=0, reserved_host_memory_mb=0)
+        zm = zone_manager.ZoneManager()
+        self._stub_host_resource_db(zm)
+
+        self.mox.ReplayAll()
+        zm.sync_host_resources(None)
+        zm.consume_host_resources('host1', 100, 1000)
+        zm.consume_host_resources('host2', -20, -1024)
+        zm.consume_host_resources('unknown', 100, 1000)
+        hosts = zm.get_all_host_data(None)
+        self.mox.VerifyAll()
+
+        self.assertEquals(hosts['host1'].free_ram_mb, 2048 - 512 - 1000)
+        self.assertEquals(hosts['host1'].free_disk_gb, 1024 - 10 - 100)
+        self.assertEquals(hosts['host2'].free_ram_mb, 4096)
+        self.assertEquals(hosts['host2'].free_disk_gb, 2048)
+        self.assertFalse('unknown' in hosts)
+
+    def test_host_resources_resync_after_interval(self):
+        self.flags(host_resource_sync_interval=60)
+        zm = zone_manager.ZoneManager()
+        self.assertTrue(zm.host_resources_stale())
+
+        zm.last_host_resource_sync = utils.utcnow()
+        self.assertFalse(zm.host_resources_stale())
+
+        utils.set_time_override(utils.utcnow() +
+                                datetime.timedelta(seconds=61))
+        self.assertTrue(zm.host_resources_stale())
+        utils.clear_time_override()
+
+    def test_new_compute_host_forces_resync(self):
+        zm = zone_manager.ZoneManager()
+        zm.last_host_resource_sync = utils.utcnow()
+        zm.host_resources = {'host1': dict(free_disk_gb=1, free_ram_mb=1)}
+
+        zm.update_service_capabilities("compute", "host1", dict(a=1))
+        self.assertFalse(zm.host_resources_stale())
+        zm.update_service_capabilities("volume", "host2", dict(a=1))
+        self.assertFalse(zm.host_resources_stale())
+        zm.update_service_capabilities("compute", "host2", dict(a=1))
+        self.assertTrue(zm.host_resources_stale())
@@ -163,7 +163,8 @@ def execute(*cmd, **kwargs):
     :attempts           How many times to retry cmd.
     :run_as_root        True | False. Defaults to False. If set to True,
                         the command is prefixed by the command specified
-                        in the root_helper FLAG.
+                        in the root_helper FLAG, or run through the root
+                        wrapper daemon if the root_helper_daemon FLAG is set.
 
     :raises exception.Error on receiving unknown arguments
     :raises exception.ProcessExecutionError
@@ -173,13 +174,7 @@ def execute(*cmd, **kwargs):
     """
 
     process_input = kwargs.pop('process_input', None)
-    check_exit_code = kwargs.pop('check_exit_code', [0])
-    ignore_exit_code = False
-    if isinstance(check_exit_code, bool):
-        ignore_exit_code = not check_exit_code
-        check_exit_code = [0]
-    elif isinstance(check_exit_code, int):
-        check_exit_code = [check_exit_code]
+    check_exit_code = _allowed_exit_codes(kwargs.pop('check_exit_code', [0]))
     delay_on_retry = kwargs.pop('delay_on_retry', True)
     attempts = kwargs.pop('attempts', 1)
     run_as_root = kwargs.pop('run_as_root', False)
@@ -189,31 +184,40 @@ def execute(*cmd, **kwargs):
         raise exception.Error(_('Got unknown keyword args '
                                 'to utils.execute: %r') % kwargs)
 
-    if run_as_root:
+    use_daemon = run_as_root and FLAGS.root_helper_daemon and not shell
+    if run_as_root and not use_daemon:
         cmd = shlex.split(FLAGS.root_helper) + list(cmd)
     cmd = map(str, cmd)
 
     while attempts > 0:
         attempts -= 1
         try:
-            LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
-            _PIPE = subprocess.PIPE  # pylint: disable=E1101
-            obj = subprocess.Popen(cmd,
-                                   stdin=_PIPE,
-                                   stdout=_PIPE,
-                                   stderr=_PIPE,
-                                   close_fds=True,
-                                   shell=shell)
-            result = None
-            if process_input is not None:
-                result = obj.communicate(process_input)
+            if use_daemon:
+                LOG.debug(_('Running cmd (rootwrap daemon): %s'),
+                          ' '.join(cmd))
+                ((_returncode, stdout, stderr),) = \
+                        _execute_in_rootwrap_daemon([(cmd, process_input,
+                                                      None)])
+                result = (stdout, stderr)
             else:
-                result = obj.communicate()
-            obj.stdin.close()  # pylint: disable=E1101
-            _returncode = obj.returncode  # pylint: disable=E1101
+                LOG.debug(_('Running cmd (subprocess): %s'), ' '.join(cmd))
+                _PIPE = subprocess.PIPE  # pylint: disable=E1101
+                obj = subprocess.Popen(cmd,
+                                       stdin=_PIPE,
+                                       stdout=_PIPE,
+                                       stderr=_PIPE,
+                                       close_fds=True,
+                                       shell=shell)
+                result = None
+                if process_input is not None:
+                    result = obj.communicate(process_input)
+                else:
+                    result = obj.communicate()
+                obj.stdin.close()  # pylint: disable=E1101
+                _returncode = obj.returncode  # pylint: disable=E1101
             if _returncode:
                 LOG.debug(_('Result was %s') % _returncode)
-                if not ignore_exit_code \
+                if check_exit_code is not None \
                     and _returncode not in check_exit_code:
                     (stdout, stderr) = result
                     raise exception.ProcessExecutionError(
@@ -236,6 +240,137 @@ def execute(*cmd, **kwargs):
             greenthread.sleep(0)
 
 
+def execute_many(cmds, **kwargs):
+    """
+    Helper method to execute several commands in order, stopping at the
+    first one that fails.
+
+    :cmds               List of commands, each a tuple of the arguments
+                        execute() takes.
+    :check_exit_code    As for execute(), applies to every command.
+    :run_as_root        As for execute().  If the root_helper_daemon FLAG
+                        is set, all the commands are run in a single round
+                        trip to the root wrapper daemon.
+
+    :raises exception.Error on receiving unknown arguments
+    :raises exception.ProcessExecutionError
+
+    :returns a list of (stdout, stderr) tuples, one for each command.
+    """
+    unknown = set(kwargs) - set(['check_exit_code', 'run_as_root'])
+    if unknown:
+        raise exception.Error(_('Got unknown keyword args '
+                                'to utils.execute_many: %r') % list(unknown))
+    if not (kwargs.get('run_as_root') and FLAGS.root_helper_daemon):
+        return [execute(*cmd, **kwargs) for cmd in cmds]
+
+    check_exit_code = _allowed_exit_codes(kwargs.get('check_exit_code', [0]))
+    cmds = [map(str, cmd) for cmd in cmds]
+    for cmd in cmds:
+        LOG.debug(_('Running cmd (rootwrap daemon): %s'), ' '.join(cmd))
+    results = _execute_in_rootwrap_daemon([(cmd, None, check_exit_code)
+                                           for cmd in cmds])
+    for cmd, (_returncode, stdout, stderr) in zip(cmds, results):
+        if _returncode:
+            LOG.debug(_('Result was %s') % _returncode)
+            if check_exit_code is not None \
+                and _returncode not in check_exit_code:
+                raise exception.ProcessExecutionError(
+                        exit_code=_returncode,
+                        stdout=stdout,
+                        stderr=stderr,
+                        cmd=' '.join(cmd))
+    return [(stdout, stderr) for _returncode, stdout, stderr in results]
+
+
+def _allowed_exit_codes(check_exit_code):
+    """Returns the exit codes check_exit_code allows, None if any."""
+    if isinstance(check_exit_code, bool):
+        if not check_exit_code:
+            return None
+        return [0]
+    elif isinstance(check_exit_code, int):
+        return [check_exit_code]
+    return check_exit_code
+
+
+_rootwrap_daemon = None
+_rootwrap_daemon_socket = None
+_rootwrap_daemon_lock = semaphore.Semaphore()
+
+
+def _get_rootwrap_daemon_socket(restart=False):
+    """Returns the socket path of the root wrapper daemon, starting it
+    first if it isn't running (or restart is set)."""
+    global _rootwrap_daemon
+    global _rootwrap_daemon_socket
+    with _rootwrap_daemon_lock:
+        if _rootwrap_daemon is not None and _rootwrap_daemon.poll() is None:
+            if not restart:
+                return _rootwrap_daemon_socket
+            # NOTE(agent): the daemon exits once its stdin is closed
+            _rootwrap_daemon.stdin.close()
+            _rootwrap_daemon.stdout.close()
+            _rootwrap_daemon.wait()
+
+        cmd = shlex.split(FLAGS.root_helper_daemon)
+        LOG.debug(_('Starting root wrapper daemon: %s'), ' '.join(cmd))
+        _PIPE = subprocess.PIPE  # pylint: disable=E1101
+        _rootwrap_daemon = subprocess.Popen(cmd,
+                                            stdin=_PIPE,
+                                            stdout=_PIPE,
+                                            close_fds=True)
+        _rootwrap_daemon_socket = _rootwrap_daemon.stdout.readline().strip()
+        if not _rootwrap_daemon_socket:
+            _rootwrap_daemon = None
+            raise exception.Error(_('Root wrapper daemon %s failed to '
+                                    'start') % FLAGS.root_helper_daemon)
+        return _rootwrap_daemon_socket
+
+
+def _execute_in_rootwrap_daemon(commands):
+    """Runs commands as root in a single round trip to the root wrapper
+    daemon, stopping at the first one that fails.
+
+    :commands   List of (cmd, process_input, check_exit_code) tuples, with
+                check_exit_code a list of allowed exit codes or None.
+
+    :returns a list of (returncode, stdout, stderr) tuples, one for each
+             command run.
+    """
+    request = []
+    for cmd, process_input, check_exit_code in commands:
+        if process_input is not None:
+            process_input = process_input.decode('latin-1')
+        request.append({'cmd': [arg.decode('latin-1') for arg in cmd],
+                        'process_input': process_input,
+                        'check_exit_code': check_exit_code})
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(_get_rootwrap_daemon_socket())
+        except socket.error:
+            # NOTE(agent): nothing was sent yet, so the commands are safe to
+            #              run on a new daemon
+            LOG.warn(_('Could not reach the root wrapper daemon, '
+                       'restarting it'))
+            sock.close()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(_get_rootwrap_daemon_socket(restart=True))
+        sock.sendall(json.dumps(request) + '\n')
+        reply = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+
+    if not reply:
+        raise exception.Error(_('Root wrapper daemon closed the connection '
+                                'without running %s') %
+                              [' '.join(cmd) for cmd, _i, _c in commands])
+    return [(returncode, stdout.encode('latin-1'), stderr.encode('latin-1'))
+            for returncode, stdout, stderr in json.loads(reply)]
+
+
 def trycmd(*args, **kwargs):
     """
     A wrapper around execute() to more easily handle warnings and errors.
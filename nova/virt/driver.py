@@ -204,7 +204,9 @@ class ComputeDriver(object):
 
     def get_all_bw_usage(self, start_time, stop_time=None):
         """Return bandwidth usage info for each interface on each
-           running VM"""
+           running VM, as a list of dicts with the interface's
+           mac_address and the bytes it received (bw_in) and sent
+           (bw_out) since start_time"""
         raise NotImplementedError()
 
     def get_host_ip_addr(self):
@@ -510,6 +512,14 @@ class ComputeDriver(object):
         """Reboots, shuts down or powers up the host."""
         raise NotImplementedError()
 
+    def manage_image_cache(self, context):
+        """Remove unused images cached on this host when needed."""
+        raise NotImplementedError()
+
+    def prefetch_image(self, context, image_id):
+        """Cache an image on this host ahead of instances booting from it."""
+        raise NotImplementedError()
+
     def set_host_enabled(self, host, enabled):
         """Sets the specified host's ability to accept new instances."""
         # TODO(Vek): Need to pass context in for access to auth_token
@@ -320,3 +320,9 @@ class FakeConnection(driver.ComputeDriver):
     def set_host_enabled(self, host, enabled):
         """Sets the specified host's ability to accept new instances."""
         pass
+
+    def manage_image_cache(self, context):
+        pass
+
+    def prefetch_image(self, context, image_id):
+        pass
@@ -22,6 +22,9 @@ Handling of VM disk images.
 """
 
 import os
+import sys
+
+from eventlet import event
 
 from nova import exception
 from nova import flags
@@ -34,15 +37,86 @@ FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.virt.images')
 
 
+# NOTE(agent): image hrefs being downloaded, mapped to the (path, event) of
+#              each fetch of the same image waiting for that download to
+#              finish
+_downloads = {}
+
+
+class _SparseWriter(object):
+    """Writes image data to a file, seeking over chunks of zeros rather
+    than writing them so that they are left as holes in the file."""
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+        self.size = 0
+
+    def write(self, data):
+        if data.strip('\0'):
+            self.image_file.write(data)
+        else:
+            self.image_file.seek(len(data), os.SEEK_CUR)
+        self.size += len(data)
+
+    def close(self):
+        # NOTE(agent): a file ending in a hole would be cut short otherwise
+        self.image_file.truncate(self.size)
+
+
+def _copy_sparse(src, dest, chunk_size=65536):
+    with open(src, "rb") as src_file:
+        with open(dest, "wb") as dest_file:
+            writer = _SparseWriter(dest_file)
+            for chunk in iter(lambda: src_file.read(chunk_size), ''):
+                writer.write(chunk)
+            writer.close()
+
+
 def fetch(context, image_href, path, _user_id, _project_id):
+    """Downloads an image to path, leaving its runs of zeros as holes.
+
+    A fetch of an image that is already being downloaded waits for that
+    download and copies the result instead of downloading it again.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
     #             checked before we got here.
     (image_service, image_id) = nova.image.get_image_service(context,
                                                              image_href)
-    with open(path, "wb") as image_file:
-        metadata = image_service.get(context, image_id, image_file)
+    if image_href in _downloads:
+        # NOTE(agent): the image must still be visible in this context
+        image_service.show(context, image_id)
+    # NOTE(agent): nothing may yield from here until this fetch joins or
+    #              registers a download, or it could join one that has
+    #              already finished and wait forever
+    waiters = _downloads.get(image_href)
+    if waiters is not None:
+        done = event.Event()
+        waiters.append((path, done))
+        return done.wait()
+
+    _downloads[image_href] = waiters = []
+    try:
+        with open(path, "wb") as image_file:
+            writer = _SparseWriter(image_file)
+            metadata = image_service.get(context, image_id, writer)
+            writer.close()
+    except Exception:
+        exc_info = sys.exc_info()
+        del _downloads[image_href]
+        for _path, done in waiters:
+            done.send_exception(*exc_info)
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+    del _downloads[image_href]
+    for waiter_path, done in waiters:
+        try:
+            _copy_sparse(path, waiter_path)
+        except Exception:
+            done.send_exception(*sys.exc_info())
+        else:
+            done.send(metadata)
     return metadata
 
 
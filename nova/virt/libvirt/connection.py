@@ -66,6 +66,7 @@ from nova import utils
 from nova.virt.disk import api as disk
 from nova.virt import driver
 from nova.virt import images
+from nova.virt.libvirt import imagecache
 from nova.virt.libvirt import utils as libvirt_utils
 
 
@@ -96,6 +97,11 @@ flags.DEFINE_string('libvirt_uri',
 flags.DEFINE_bool('allow_same_net_traffic',
                   True,
                   'Whether to allow network traffic from same network')
+flags.DEFINE_bool('iptables_shared_group_chains',
+                  False,
+                  'Whether rules granting access to a security group jump '
+                  'to one shared chain of its members\' addresses instead '
+                  'of listing the addresses in every instance chain')
 flags.DEFINE_bool('use_cow_images',
                   True,
                   'Whether to use cow images')
@@ -202,6 +208,8 @@ class LibvirtConnection(driver.ComputeDriver):
         self.default_root_device = self._disk_prefix + 'a'
         self.default_local_device = self._disk_prefix + 'b'
         self.default_swap_device = self._disk_prefix + 'c'
+        self.image_cache_manager = imagecache.ImageCacheManager()
+        self._bw_counters = {}
 
     @property
     def host_state(self):
@@ -666,6 +674,22 @@ class LibvirtConnection(driver.ComputeDriver):
     def poll_unconfirmed_resizes(self, resize_confirm_window):
         pass
 
+    def manage_image_cache(self, context):
+        """Remove unused base images once they take up too much space."""
+        self.image_cache_manager.manage_base_images()
+
+    def prefetch_image(self, context, image_id):
+        """Cache the base image of an image's root disk ahead of instances
+        booting from it."""
+        self._cache_image(fn=libvirt_utils.fetch_image,
+                          context=context,
+                          target=None,
+                          fname=hashlib.sha1(str(image_id)).hexdigest(),
+                          image_id=image_id,
+                          user_id=context.user_id,
+                          project_id=context.project_id,
+                          size=FLAGS.minimum_root_size)
+
     # NOTE(ilyaalekseyev): Implementation like in multinics
     # for xenapi(tr3buchet)
     @exception.wrap_exception()
@@ -802,25 +826,33 @@ class LibvirtConnection(driver.ComputeDriver):
         to be unique to a given image.
 
         If cow is True, it will make a CoW image instead of a copy.
+
+        If target is None, only the image in the common store is created.
         """
 
-        if not os.path.exists(target):
-            base_dir = os.path.join(FLAGS.instances_path, '_base')
+        if target is None or not os.path.exists(target):
+            base_dir = imagecache.get_base_dir()
             if not os.path.exists(base_dir):
                 libvirt_utils.ensure_tree(base_dir)
             base = os.path.join(base_dir, fname)
 
+            # NOTE(agent): the image cache manager removes unused base images
+            #              under the same lock, so the base image is marked as
+            #              used and the copy made before letting go of it
             @utils.synchronized(fname)
             def call_if_not_exists(base, fn, *args, **kwargs):
                 if not os.path.exists(base):
                     fn(target=base, *args, **kwargs)
+                libvirt_utils.update_mtime(base)
 
-            call_if_not_exists(base, fn, *args, **kwargs)
+                if target is None:
+                    return
+                if cow:
+                    libvirt_utils.create_cow_image(base, target)
+                else:
+                    libvirt_utils.copy_image(base, target)
 
-            if cow:
-                libvirt_utils.create_cow_image(base, target)
-            else:
-                libvirt_utils.copy_image(base, target)
+            call_if_not_exists(base, fn, *args, **kwargs)
 
     @staticmethod
     def _fetch_image(context, target, image_id, user_id, project_id,
@@ -1516,6 +1548,94 @@ class LibvirtConnection(driver.ComputeDriver):
         domain = self._lookup_by_name(instance_name)
         return domain.interfaceStats(interface)
 
+    def get_all_bw_usage(self, start_time, stop_time=None):
+        """Return bandwidth usage info for each interface on each
+           running VM"""
+        interface_stats = []
+        for domain_id in self._conn.listDomainsID():
+            try:
+                domain = self._conn.lookupByID(domain_id)
+                doc = ElementTree.fromstring(domain.XMLDesc(0))
+            except libvirt.libvirtError:
+                # NOTE(agent): the domain went away since it was listed
+                continue
+            for node in doc.findall('./devices/interface'):
+                mac = node.find('mac')
+                target = node.find('target')
+                if mac is None or target is None:
+                    continue
+                try:
+                    stats = domain.interfaceStats(target.get('dev'))
+                except libvirt.libvirtError:
+                    continue
+                interface_stats.append((mac.get('address'), stats))
+
+        stored_usage = self._get_stored_bw_usage(
+                [mac_address for mac_address, _stats in interface_stats
+                 if mac_address not in self._bw_counters], start_time)
+        bw_usage = []
+        bw_counters = {}
+        for mac_address, stats in interface_stats:
+            counters = self._count_bw_usage(mac_address, start_time,
+                                            stats[0], stats[4],
+                                            stored_usage.get(mac_address))
+            bw_counters[mac_address] = counters
+            bw_usage.append(dict(mac_address=mac_address,
+                                 bw_in=counters['bw_in'],
+                                 bw_out=counters['bw_out']))
+        self._bw_counters = bw_counters
+        return bw_usage
+
+    @staticmethod
+    def _get_stored_bw_usage(mac_addresses, start_time):
+        """Returns the (bw_in, bw_out) recorded for start_time of each of
+        the interfaces with the given MAC addresses, by address."""
+        if not mac_addresses:
+            return {}
+        ctxt = nova_context.get_admin_context()
+        stored_usage = {}
+        for vif in db.virtual_interface_get_by_addresses(ctxt,
+                                                         mac_addresses):
+            for usage in db.bw_usage_get_by_instance(ctxt,
+                                                     vif['instance_id'],
+                                                     start_time):
+                if usage['network_label'] == vif['network']['label']:
+                    stored_usage[vif['address']] = (usage['bw_in'],
+                                                    usage['bw_out'])
+        return stored_usage
+
+    def _count_bw_usage(self, mac_address, start_time, rx_bytes, tx_bytes,
+                        stored_usage=None):
+        """Adds the bytes an interface received and sent since it was last
+        polled to its usage since start_time.
+
+        interfaceStats counts from when the interface was created, which is
+        when its instance was last started, so the usage is kept between
+        polls rather than read from the counters.  An interface polled for
+        the first time carries on from stored_usage, the (bw_in, bw_out)
+        last recorded for it, if any.
+        """
+        counters = self._bw_counters.get(mac_address)
+        if counters is None:
+            # NOTE(agent): the interface wasn't polled by this process yet,
+            #              so its counters only become the baseline; they
+            #              include traffic already recorded before a restart
+            bw_in, bw_out = stored_usage or (0, 0)
+            counters = dict(start_time=start_time, rx_bytes=rx_bytes,
+                            tx_bytes=tx_bytes, bw_in=bw_in, bw_out=bw_out)
+        elif counters['start_time'] != start_time:
+            counters.update(start_time=start_time, bw_in=0, bw_out=0)
+
+        for bw, counter, value in (('bw_in', 'rx_bytes', rx_bytes),
+                                   ('bw_out', 'tx_bytes', tx_bytes)):
+            if value < counters[counter]:
+                # NOTE(agent): the interface was created again, counting
+                #              from zero
+                counters[counter] = 0
+            counters[bw] += value - counters[counter]
+            counters[counter] = value
+        return counters
+
     def get_console_pool_info(self, console_type):
         #TODO(mdragon): console proxy should be implemented for libvirt,
         #               in case someone wants to use it with kvm or
@@ -22,6 +22,7 @@ from eventlet import tpool
 
 from nova import context
 from nova import db
+from nova import exception
 from nova import flags
 from nova import log as logging
 from nova import utils
@@ -518,6 +519,15 @@ class IptablesFirewallDriver(FirewallDriver):
         self.iptables = linux_net.iptables_manager
         self.instances = {}
         self.network_infos = {}
+        # The security groups of each filtered instance, so that a refresh
+        # only regenerates the chains of the instances it affects
+        self.instance_security_groups = {}
+        # The rules of each security group used by a filtered instance,
+        # until the group is refreshed
+        self.security_group_rules = {}
+        # The security groups with a shared chain of their members'
+        # addresses, see FLAGS.iptables_shared_group_chains
+        self.security_group_chains = set()
         self.nwfilter = NWFilterFirewall(kwargs['get_connection'])
         self.basicly_filtered = False
 
@@ -542,7 +552,10 @@ class IptablesFirewallDriver(FirewallDriver):
         if self.instances.pop(instance['id'], None):
             # NOTE(vish): use the passed info instead of the stored info
             self.network_infos.pop(instance['id'])
+            self.instance_security_groups.pop(instance['id'], None)
             self.remove_filters_for_instance(instance)
+            self._remove_unused_security_group_chains()
+            self._remove_unused_security_group_rules()
             self.iptables.apply()
             self.nwfilter.unfilter_instance(instance, network_info)
         else:
@@ -589,6 +602,9 @@ class IptablesFirewallDriver(FirewallDriver):
                                                             network_info)
         self._add_filters('local', ipv4_rules, ipv6_rules)
         ipv4_rules, ipv6_rules = self.instance_rules(instance, network_info)
+        if FLAGS.iptables_shared_group_chains:
+            self._add_security_group_chains(self._grantee_group_ids(
+                    self.instance_security_groups[instance['id']]))
         self._add_filters(chain_name, ipv4_rules, ipv6_rules)
 
     def remove_filters_for_instance(self, instance):
@@ -598,8 +614,73 @@ class IptablesFirewallDriver(FirewallDriver):
         if FLAGS.use_ipv6:
             self.iptables.ipv6['filter'].remove_chain(chain_name)
 
-    @staticmethod
-    def instance_rules(instance, network_info):
+    def _grantee_group_ids(self, security_group_ids):
+        """Return the groups the rules of the given groups grant access to.
+        """
+        return set(rule['group_id'] for group_id in security_group_ids
+                   for rule in self.security_group_rules.get(group_id, [])
+                   if not rule['cidr'] and rule['group_id'])
+
+    def _add_security_group_chains(self, security_group_ids):
+        """Create the shared chains of the members of the given groups
+        that don't have one yet."""
+        new_ids = [group_id for group_id in security_group_ids
+                   if group_id not in self.security_group_chains]
+        if new_ids:
+            self._fill_security_group_chains(new_ids)
+
+    def _fill_security_group_chains(self, security_group_ids):
+        """(Re)build the shared chains of the members of the given groups.
+
+        Packets matching a rule that grants access to a group jump to its
+        chain, which accepts them if they come from one of its members and
+        otherwise returns to the instance chain.
+        """
+        ctxt = context.get_admin_context()
+        addresses = db.instance_get_fixed_addresses_by_security_groups(
+                ctxt, list(security_group_ids))
+        table = self.iptables.ipv4['filter']
+        for group_id, ips in addresses.iteritems():
+            chain_name = self._security_group_chain_name(group_id)
+            table.add_chain(chain_name)
+            table.empty_chain(chain_name)
+            for ip in ips:
+                table.add_rule(chain_name, '-s %s -j ACCEPT' % (ip,))
+            self.security_group_chains.add(group_id)
+
+    def _remove_unused_security_group_chains(self):
+        """Remove the shared chains no filtered instance jumps to anymore.
+        """
+        used_ids = self._grantee_group_ids(set().union(
+                *self.instance_security_groups.values()))
+        for group_id in self.security_group_chains - used_ids:
+            chain_name = self._security_group_chain_name(group_id)
+            self.iptables.ipv4['filter'].remove_chain(chain_name)
+        self.security_group_chains &= used_ids
+
+    def _remove_unused_security_group_rules(self):
+        """Forget the rules of the groups no filtered instance is in.
+
+        Rules refreshes are only sent to hosts running members of the
+        group, so those rules would not be kept up to date.
+        """
+        used_ids = set().union(*self.instance_security_groups.values())
+        for group_id in set(self.security_group_rules) - used_ids:
+            del self.security_group_rules[group_id]
+
+    def _security_group_rules(self, ctxt, security_group_id):
+        if security_group_id not in self.security_group_rules:
+            rules = db.security_group_rule_get_by_security_group(ctxt,
+                                                          security_group_id)
+            self.security_group_rules[security_group_id] = [
+                    {'protocol': rule['protocol'],
+                     'from_port': rule['from_port'],
+                     'to_port': rule['to_port'],
+                     'cidr': rule['cidr'],
+                     'group_id': rule['group_id']} for rule in rules]
+        return self.security_group_rules[security_group_id]
+
+    def instance_rules(self, instance, network_info):
         ctxt = context.get_admin_context()
 
         ipv4_rules = []
@@ -650,27 +731,36 @@ class IptablesFirewallDriver(FirewallDriver):
 
         security_groups = db.security_group_get_by_instance(ctxt,
                                                             instance['id'])
+        security_group_ids = [group['id'] for group in security_groups]
+        self.instance_security_groups[instance['id']] = \
+                set(security_group_ids)
+        rules_by_group = [self._security_group_rules(ctxt, group_id)
+                          for group_id in security_group_ids]
+
+        # NOTE(agent): the addresses of every grantee group are fetched
+        #              at once
+        grantee_ips = {}
+        if not FLAGS.iptables_shared_group_chains:
+            grantee_ips = db.instance_get_fixed_addresses_by_security_groups(
+                    ctxt, list(self._grantee_group_ids(security_group_ids)))
 
         # then, security group chains and rules
-        for security_group in security_groups:
-            rules = db.security_group_rule_get_by_security_group(ctxt,
-                                                          security_group['id'])
-
+        for rules in rules_by_group:
             for rule in rules:
                 LOG.debug(_('Adding security group rule: %r'), rule)
 
-                if not rule.cidr:
+                if not rule['cidr']:
                     version = 4
                 else:
-                    version = netutils.get_ip_version(rule.cidr)
+                    version = netutils.get_ip_version(rule['cidr'])
 
                 if version == 4:
                     fw_rules = ipv4_rules
                 else:
                     fw_rules = ipv6_rules
 
-                protocol = rule.protocol
-                if version == 6 and rule.protocol == 'icmp':
+                protocol = rule['protocol']
+                if version == 6 and rule['protocol'] == 'icmp':
                     protocol = 'icmpv6'
 
                 args = ['-j ACCEPT']
@@ -678,15 +768,15 @@ class IptablesFirewallDriver(FirewallDriver):
                     args += ['-p', protocol]
 
                 if protocol in ['udp', 'tcp']:
-                    if rule.from_port == rule.to_port:
-                        args += ['--dport', '%s' % (rule.from_port,)]
+                    if rule['from_port'] == rule['to_port']:
+                        args += ['--dport', '%s' % (rule['from_port'],)]
                     else:
                         args += ['-m', 'multiport',
-                                 '--dports', '%s:%s' % (rule.from_port,
-                                                        rule.to_port)]
+                                 '--dports', '%s:%s' % (rule['from_port'],
+                                                        rule['to_port'])]
                 elif protocol == 'icmp':
-                    icmp_type = rule.from_port
-                    icmp_code = rule.to_port
+                    icmp_type = rule['from_port']
+                    icmp_code = rule['to_port']
 
                     if icmp_type == -1:
                         icmp_type_arg = None
@@ -703,20 +793,21 @@ class IptablesFirewallDriver(FirewallDriver):
                             args += ['-m', 'icmp6', '--icmpv6-type',
                                      icmp_type_arg]
 
-                if rule.cidr:
-                    LOG.info('Using cidr %r', rule.cidr)
-                    args += ['-s', rule.cidr]
+                if rule['cidr']:
+                    LOG.info('Using cidr %r', rule['cidr'])
+                    args += ['-s', rule['cidr']]
                     fw_rules += [' '.join(args)]
-                else:
-                    if rule['grantee_group']:
-                        for instance in rule['grantee_group']['instances']:
-                            LOG.info('instance: %r', instance)
-                            ips = db.instance_get_fixed_addresses(ctxt,
-                                                                instance['id'])
-                            LOG.info('ips: %r', ips)
-                            for ip in ips:
-                                subrule = args + ['-s %s' % ip]
-                                fw_rules += [' '.join(subrule)]
+                elif rule['group_id'] and FLAGS.iptables_shared_group_chains:
+                    chain_name = self._security_group_chain_name(
+                            rule['group_id'])
+                    args[0] = '-j $%s' % (chain_name,)
+                    fw_rules += [' '.join(args)]
+                elif rule['group_id']:
+                    ips = grantee_ips[rule['group_id']]
+                    LOG.info('ips: %r', ips)
+                    for ip in ips:
+                        subrule = args + ['-s %s' % ip]
+                        fw_rules += [' '.join(subrule)]
 
                 LOG.info('Using fw_rules: %r', fw_rules)
         ipv4_rules += ['-j $sg-fallback']
@@ -729,16 +820,55 @@ class IptablesFirewallDriver(FirewallDriver):
         return self.nwfilter.instance_filter_exists(instance, network_info)
 
     def refresh_security_group_members(self, security_group):
-        self.do_refresh_security_group_rules(security_group)
+        self.do_refresh_security_group_members(security_group)
         self.iptables.apply()
 
     def refresh_security_group_rules(self, security_group):
         self.do_refresh_security_group_rules(security_group)
         self.iptables.apply()
 
+    @utils.synchronized('iptables', external=True)
+    def do_refresh_security_group_members(self, security_group):
+        """Regenerate the chains of the instances in a group that grants
+        access to the members of security_group."""
+        if FLAGS.iptables_shared_group_chains:
+            # Only the shared chain lists the members
+            if security_group in self.security_group_chains:
+                self._fill_security_group_chains([security_group])
+            return
+        granting_groups = set(group_id for group_id, rules
+                              in self.security_group_rules.iteritems()
+                              if any(rule['group_id'] == security_group
+                                     for rule in rules))
+        self._refresh_instances(instance_id for instance_id, groups
+                                in self.instance_security_groups.iteritems()
+                                if groups & granting_groups)
+
     @utils.synchronized('iptables', external=True)
     def do_refresh_security_group_rules(self, security_group):
-        for instance in self.instances.values():
+        """Regenerate the chains of the instances in security_group, both
+        as we last saw it and as it is now, as its rules or members have
+        changed."""
+        self.security_group_rules.pop(security_group, None)
+        instance_ids = set(instance_id for instance_id, groups
+                           in self.instance_security_groups.iteritems()
+                           if security_group in groups)
+        ctxt = context.get_admin_context()
+        try:
+            group = db.security_group_get(ctxt, security_group)
+            instance_ids.update(instance['id']
+                                for instance in group['instances'])
+        except exception.SecurityGroupNotFound:
+            pass
+        self._refresh_instances(instance_ids)
+        self._remove_unused_security_group_chains()
+        self._remove_unused_security_group_rules()
+
+    def _refresh_instances(self, instance_ids):
+        for instance_id in list(instance_ids):
+            instance = self.instances.get(instance_id)
+            if instance is None:
+                continue
             self.remove_filters_for_instance(instance)
             self.add_filters_for_instance(instance)
 
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Management of the base images libvirt instance disks are created from.
+
+Base images are cached under FLAGS.instances_path/_base.  Every time an
+instance disk is created from one, its modification time is updated, so
+the modification time tells when a base image was last used.
+"""
+
+import os
+import stat
+
+from nova import exception
+from nova import flags
+from nova import log as logging
+from nova import utils
+from nova.virt.libvirt import utils as libvirt_utils
+
+
+LOG = logging.getLogger('nova.virt.libvirt.imagecache')
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('base_image_cache_max_bytes', 0,
+                     'Number of bytes the cached base images may take up '
+                     'before base images not backing any instance disk are '
+                     'removed, least recently used first (0 means never '
+                     'remove base images)')
+
+
+def get_base_dir():
+    """Returns the directory the base images are cached in."""
+    return os.path.join(FLAGS.instances_path, '_base')
+
+
+class ImageCacheManager(object):
+    """Keeps the base image cache under base_image_cache_max_bytes."""
+
+    def __init__(self):
+        # NOTE(agent): an instance disk keeps the backing file it was created
+        #              with, so backing files are remembered by disk path and
+        #              inode rather than asking qemu-img about every disk on
+        #              every pass
+        self._backing_files = {}
+
+    def _list_base_images(self, base_dir):
+        """Returns a dict mapping the name of each cached base image to
+        its (size on disk, modification time)."""
+        base_images = {}
+        for fname in os.listdir(base_dir):
+            try:
+                st = os.stat(os.path.join(base_dir, fname))
+            except OSError:
+                # NOTE(agent): removed since listed
+                continue
+            if stat.S_ISREG(st.st_mode):
+                base_images[fname] = (st.st_blocks * 512, st.st_mtime)
+        return base_images
+
+    def _list_backing_files(self):
+        """Returns the names of the base images backing instance disks."""
+        backing_files = {}
+        for dirname in os.listdir(FLAGS.instances_path):
+            instance_dir = os.path.join(FLAGS.instances_path, dirname)
+            if dirname == '_base' or not os.path.isdir(instance_dir):
+                continue
+            for fname in os.listdir(instance_dir):
+                if not fname.startswith('disk'):
+                    continue
+                path = os.path.join(instance_dir, fname)
+                try:
+                    key = (path, os.stat(path).st_ino)
+                    if key not in self._backing_files:
+                        self._backing_files[key] = \
+                                libvirt_utils.get_disk_backing_file(path)
+                except (OSError, exception.ProcessExecutionError):
+                    # NOTE(agent): the instance is going away or its disk is
+                    #              still being created
+                    continue
+                backing_files[key] = self._backing_files[key]
+        self._backing_files = backing_files
+        return set(backing_file for backing_file in backing_files.values()
+                   if backing_file)
+
+    def _remove_base_image(self, base_dir, fname, mtime):
+        """Removes a base image unless it was used after being listed.
+
+        Holds the same lock instance disks are created from the base image
+        under, so a disk can't be created from it while it is removed.
+        """
+
+        @utils.synchronized(fname)
+        def remove_if_unused():
+            path = os.path.join(base_dir, fname)
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return False
+                os.unlink(path)
+            except OSError:
+                return False
+            LOG.info(_('Removed unused base image %s'), fname)
+            return True
+
+        return remove_if_unused()
+
+    def manage_base_images(self):
+        """Removes base images that no instance disk is backed by, least
+        recently used first, until the cache fits base_image_cache_max_bytes.
+        """
+        max_bytes = FLAGS.base_image_cache_max_bytes
+        base_dir = get_base_dir()
+        if max_bytes <= 0 or not os.path.isdir(base_dir):
+            return
+
+        base_images = self._list_base_images(base_dir)
+        total_bytes = sum(size for size, _mtime in base_images.values())
+        if total_bytes <= max_bytes:
+            return
+
+        in_use = self._list_backing_files()
+        unused = sorted((mtime, fname)
+                        for fname, (_size, mtime) in base_images.items()
+                        if fname not in in_use)
+        for mtime, fname in unused:
+            if total_bytes <= max_bytes:
+                break
+            if self._remove_base_image(base_dir, fname, mtime):
+                total_bytes -= base_images[fname][0]
+
+        if total_bytes > max_bytes:
+            LOG.warn(_('Base images take up %(total_bytes)d bytes, more than '
+                       'the %(max_bytes)d allowed, but are in use'), locals())
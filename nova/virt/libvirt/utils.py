@@ -83,15 +83,26 @@ def get_disk_backing_file(path):
     """Get the backing file of a disk image
 
     :param path: Path to the disk image
-    :returns: a path to the image's backing store
+    :returns: a path to the image's backing store, or None if the image
+              has no backing file
     """
     out, err = execute(FLAGS.qemu_img, 'info', path)
     backing_file = [i.split('actual path:')[1].strip()[:-1]
         for i in out.split('\n') if 0 <= i.find('backing file')]
+    if not backing_file:
+        return None
     backing_file = os.path.basename(backing_file[0])
     return backing_file
 
 
+def update_mtime(path):
+    """Set the modification time of a file to now
+
+    :param path: File to touch
+    """
+    os.utime(path, None)
+
+
 def copy_image(src, dest):
     """Copy a disk image
 
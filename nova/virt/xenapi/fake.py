@@ -481,6 +481,20 @@ class SessionBase(object):
     def network_get_all_records_where(self, _1, filter):
         return self.xenapi.network.get_all_records()
 
+    def event_from(self, _1, classes, token, timeout):
+        # Records in the fake database change without generating events, so
+        # every record of the given classes is reported as modified
+        events = []
+        for cls in classes:
+            for ref, rec in _db_content[cls].iteritems():
+                events.append({'class': cls,
+                               'operation': 'mod',
+                               'ref': ref,
+                               'snapshot': rec})
+        return {'events': events,
+                'valid_ref_counts': {},
+                'token': str(uuid.uuid4())}
+
     def xenapi_request(self, methodname, params):
         if methodname.startswith('login'):
             self._login(methodname, params)
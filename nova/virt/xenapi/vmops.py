@@ -1327,12 +1327,19 @@ class VMOps(object):
                           exc_info=sys.exc_info())
             return {}
         bw = {}
+        # NOTE(agent): fetch every VM and VIF record in two calls, rather than
+        #              three calls for each VM and one for each VIF
+        vm_recs = dict((vm_rec['uuid'], vm_rec) for vm_rec in
+                       self._session.call_xenapi("VM.get_all_records").
+                       itervalues())
+        vif_recs = self._session.call_xenapi("VIF.get_all_records")
         for uuid, data in metrics.iteritems():
-            vm_ref = self._session.call_xenapi("VM.get_by_uuid", uuid)
-            vm_rec = self._session.call_xenapi("VM.get_record", vm_ref)
+            vm_rec = vm_recs.get(uuid)
+            if vm_rec is None:
+                continue
             vif_map = {}
-            for vif in [self._session.call_xenapi("VIF.get_record", vrec)
-                        for vrec in vm_rec['VIFs']]:
+            for vif in [vif_recs[vrec] for vrec in vm_rec['VIFs']
+                        if vrec in vif_recs]:
                 vif_map[vif['device']] = vif['MAC']
             name = vm_rec['name_label']
             if name.startswith('Control domain'):
@@ -26,7 +26,8 @@ reasons.
 
 All long-running XenAPI calls (VM.start, VM.reboot, etc) are called async
 (using XenAPI.VM.async_start etc). These return a task, which can then be
-polled for completion.
+waited on for completion. A single watcher per session waits for task
+events (event.from), and wakes up the waiters of tasks as they complete.
 
 This combination of techniques means that we don't block the main thread at
 all, and at the same time we don't hold lots of threads waiting for
@@ -43,8 +44,10 @@ reactor thread if the VM.get_by_name_label or VM.get_record calls block.
 :xenapi_connection_password:  Password for connection to XenServer/Xen Cloud
                               Platform.
 :xenapi_task_poll_interval:  The interval (seconds) used for polling of
-                             remote tasks (Async.VM.start, etc)
-                             (default: 0.5).
+                             remote tasks (Async.VM.start, etc) on hosts
+                             without event.from (default: 0.5).
+:xenapi_task_event_timeout:  How long (seconds) to wait for task events in
+                             a single call (default: 30).
 :target_host:                the iSCSI Target Host IP address, i.e. the IP
                              address for the nova-volume host
 :target_port:                iSCSI Target Port, 3260 Default
@@ -60,12 +63,12 @@ reactor thread if the VM.get_by_name_label or VM.get_record calls block.
 import contextlib
 import json
 import random
-import sys
 import time
 import urlparse
 import xmlrpclib
 
 from eventlet import event
+from eventlet import greenthread
 from eventlet import queue
 from eventlet import tpool
 from eventlet import timeout
@@ -73,7 +76,6 @@ from eventlet import timeout
 from nova import context
 from nova import db
 from nova import exception
-from nova import utils
 from nova import flags
 from nova import log as logging
 from nova.virt import driver
@@ -106,7 +108,12 @@ flags.DEFINE_integer('xenapi_connection_concurrent',
 flags.DEFINE_float('xenapi_task_poll_interval',
                    0.5,
                    'The interval used for polling of remote tasks '
-                   '(Async.VM.start, etc). Used only if '
+                   '(Async.VM.start, etc) on hosts without event.from. '
+                   'Used only if connection_type=xenapi.')
+flags.DEFINE_float('xenapi_task_event_timeout',
+                   30.0,
+                   'How long (seconds) to wait for events of remote tasks '
+                   'in a single call. Used only if '
                    'connection_type=xenapi.')
 flags.DEFINE_float('xenapi_vhd_coalesce_poll_interval',
                    5.0,
@@ -322,13 +329,9 @@ class XenAPIConnection(driver.ComputeDriver):
         for iusage in self._vmops.get_all_bw_usage(start_time, stop_time).\
                       values():
             for macaddr, usage in iusage.iteritems():
-                vi = db.virtual_interface_get_by_address(
-                                    context.get_admin_context(),
-                                    macaddr)
-                if vi:
-                    bwusage.append(dict(virtual_interface=vi,
-                                        bw_in=usage['bw_in'],
-                                        bw_out=usage['bw_out']))
+                bwusage.append(dict(mac_address=macaddr,
+                                    bw_in=usage['bw_in'],
+                                    bw_out=usage['bw_out']))
         return bwusage
 
     def get_console_output(self, instance):
@@ -455,7 +458,14 @@ class XenAPISession(object):
 
     def __init__(self, url, user, pw):
         self.XenAPI = self.get_imported_xenapi()
+        self._url = url
+        self._user = user
+        self._pw = pw
         self._sessions = queue.Queue()
+        self._event_session = None
+        self._task_waiters = {}
+        self._task_watcher = None
+        self._task_events_supported = True
         exception = self.XenAPI.Failure(_("Unable to log in to XenAPI "
                             "(is the Dom0 disk full?)"))
         for i in xrange(FLAGS.xenapi_connection_concurrent):
@@ -515,56 +525,131 @@ class XenAPISession(object):
                                  self.get_xenapi_host(), plugin, fn, args)
 
     def wait_for_task(self, task, uuid=None):
-        """Return the result of the given task. The task is polled
-        until it completes."""
+        """Return the result of the given task. The task events watcher
+        wakes us up when it completes."""
         done = event.Event()
-        loop = utils.LoopingCall(f=None)
-
-        def _poll_task():
-            """Poll the given XenAPI task, and return the result if the
-            action was completed successfully or not.
-            """
-            try:
-                ctxt = context.get_admin_context()
-                name = self.call_xenapi("task.get_name_label", task)
-                status = self.call_xenapi("task.get_status", task)
-
-                # Ensure action is never > 255
-                action = dict(action=name[:255], error=None)
-                log_instance_actions = (FLAGS.xenapi_log_instance_actions and
-                                        uuid)
-                if log_instance_actions:
-                    action["instance_uuid"] = uuid
-
-                if status == "pending":
-                    return
-                elif status == "success":
-                    result = self.call_xenapi("task.get_result", task)
-                    LOG.info(_("Task [%(name)s] %(task)s status:"
-                            " success    %(result)s") % locals())
-
-                    if log_instance_actions:
-                        db.instance_action_create(ctxt, action)
-
-                    done.send(_parse_xmlrpc_value(result))
-                else:
-                    error_info = self.call_xenapi("task.get_error_info", task)
-                    LOG.warn(_("Task [%(name)s] %(task)s status:"
-                            " %(status)s    %(error_info)s") % locals())
-
-                    if log_instance_actions:
-                        action["error"] = str(error_info)
-                        db.instance_action_create(ctxt, action)
-
-                    done.send_exception(self.XenAPI.Failure(error_info))
-            except self.XenAPI.Failure, exc:
-                LOG.warn(exc)
-                done.send_exception(*sys.exc_info())
-            loop.stop()
-
-        loop.f = _poll_task
-        loop.start(FLAGS.xenapi_task_poll_interval, now=True)
-        return done.wait()
+        self._task_waiters[task] = done
+        try:
+            # NOTE(agent): read the task only after registering as its waiter,
+            #              so it either has completed already or the watcher
+            #              sees it complete
+            task_rec = self.call_xenapi("task.get_record", task)
+            if task_rec['status'] == 'pending':
+                if self._task_events_supported:
+                    if self._task_watcher is None:
+                        self._task_watcher = greenthread.spawn(
+                                self._watch_tasks)
+                    task_rec = done.wait()
+                if task_rec is None:
+                    task_rec = self._poll_task(task)
+        finally:
+            self._task_waiters.pop(task, None)
+
+        ctxt = context.get_admin_context()
+        name = task_rec['name_label']
+        status = task_rec['status']
+
+        # Ensure action is never > 255
+        action = dict(action=name[:255], error=None)
+        log_instance_actions = (FLAGS.xenapi_log_instance_actions and
+                                uuid)
+        if log_instance_actions:
+            action["instance_uuid"] = uuid
+
+        if status == "success":
+            result = task_rec['result']
+            LOG.info(_("Task [%(name)s] %(task)s status:"
+                    " success    %(result)s") % locals())
+
+            if log_instance_actions:
+                db.instance_action_create(ctxt, action)
+
+            return _parse_xmlrpc_value(result)
+        else:
+            error_info = task_rec['error_info']
+            LOG.warn(_("Task [%(name)s] %(task)s status:"
+                    " %(status)s    %(error_info)s") % locals())
+
+            if log_instance_actions:
+                action["error"] = str(error_info)
+                db.instance_action_create(ctxt, action)
+
+            raise self.XenAPI.Failure(error_info)
+
+    def _poll_task(self, task):
+        """Poll the given task until it is no longer pending, for when
+        task events can't be watched."""
+        while True:
+            greenthread.sleep(FLAGS.xenapi_task_poll_interval)
+            task_rec = self.call_xenapi("task.get_record", task)
+            if task_rec['status'] != 'pending':
+                return task_rec
+
+    def _watch_tasks(self):
+        """Wake up the waiters of tasks as the tasks complete, until no
+        waiters are left.
+
+        Watches task events through event.from on a session of its own,
+        so a single XenAPI call at a time is spent on all pending tasks.
+        If that fails, the waiters are woken up to poll their tasks.
+        """
+        token = ''
+        try:
+            while self._task_waiters:
+                try:
+                    events = self._call_event_from(['task'], token)
+                except self.XenAPI.Failure, exc:
+                    if exc.details and exc.details[0] == 'EVENTS_LOST':
+                        # NOTE(agent): read every task again
+                        token = ''
+                        continue
+                    if exc.details and \
+                       exc.details[0] == 'MESSAGE_METHOD_UNKNOWN':
+                        LOG.warn(_("XenAPI host does not support "
+                                   "event.from, polling tasks instead"))
+                        self._task_events_supported = False
+                    else:
+                        LOG.exception(_("Error watching XenAPI tasks"))
+                    self._event_session = None
+                    break
+                except Exception:
+                    LOG.exception(_("Error watching XenAPI tasks"))
+                    self._event_session = None
+                    break
+
+                token = events['token']
+                for task_event in events['events']:
+                    if task_event['class'] != 'task':
+                        continue
+                    task = task_event['ref']
+                    if task not in self._task_waiters:
+                        continue
+                    if task_event['operation'] == 'del':
+                        done = self._task_waiters.pop(task)
+                        done.send_exception(self.XenAPI.Failure(
+                                ['HANDLE_INVALID', 'task', task]))
+                    elif task_event['snapshot']['status'] != 'pending':
+                        done = self._task_waiters.pop(task)
+                        done.send(task_event['snapshot'])
+
+            for task in self._task_waiters.keys():
+                self._task_waiters.pop(task).send(None)
+        finally:
+            self._task_watcher = None
+
+    def _call_event_from(self, classes, token):
+        """Call event.from on the session kept for watching events."""
+        if self._event_session is None:
+            session = self._create_session(self._url)
+            with timeout.Timeout(FLAGS.xenapi_login_timeout,
+                                 self.XenAPI.Failure(
+                                        _("Unable to log in to XenAPI"))):
+                session.login_with_password(self._user, self._pw)
+            self._event_session = session
+        # NOTE(agent): 'from' is a keyword in Python
+        event_from = getattr(self._event_session.xenapi.event, 'from')
+        return tpool.execute(event_from, classes, token,
+                             float(FLAGS.xenapi_task_event_timeout))
 
     def _create_session(self, url):
         """Stubout point. This can be replaced with a mock session."""
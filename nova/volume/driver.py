@@ -24,6 +24,9 @@ import os
 import time
 from xml.etree import ElementTree
 
+from eventlet import greenpool
+from eventlet import greenthread
+
 from nova import exception
 from nova import flags
 from nova import log as logging
@@ -51,14 +54,37 @@ flags.DEFINE_integer('iscsi_port', 3260,
                      'The port that the iSCSI daemon is listening on')
 flags.DEFINE_string('rbd_pool', 'rbd',
                     'the rbd pool in which volumes are stored')
+flags.DEFINE_string('volume_clear', 'zero',
+                    'How to wipe deleted volumes before their space is '
+                    'freed: zero (write zeros over them) or none (only safe '
+                    'for thin provisioned volumes, which read back zeros '
+                    'where they were never written)')
+flags.DEFINE_integer('volume_clear_size', 0,
+                     'Size in MiB to wipe at the start of deleted volumes '
+                     '(0 means wipe them entirely)')
+flags.DEFINE_integer('volume_clear_concurrency', 1,
+                     'Number of deleted volumes to wipe at the same time')
+flags.DEFINE_integer('volume_clear_bandwidth', 0,
+                     'MiB per second a deleted volume may be wiped at '
+                     '(0 means no limit)')
+flags.DEFINE_integer('volume_clear_ionice', 3,
+                     'I/O scheduling class to wipe deleted volumes in: '
+                     '1 (realtime), 2 (best-effort), 3 (idle), or 0 to leave '
+                     'it unchanged')
 
 
 class VolumeDriver(object):
     """Executes commands relating to Volumes."""
+
+    # Prefix of deleted logical volumes waiting to be wiped and removed
+    WIPE_PREFIX = 'wipe-'
+
     def __init__(self, execute=utils.execute, *args, **kwargs):
         # NOTE(vish): db is set by Manager
         self.db = None
         self.set_execute(execute)
+        self._wipe_pool = greenpool.GreenPool(FLAGS.volume_clear_concurrency)
+        self._wipes = set()
 
     def set_execute(self, execute):
         self._execute = execute
@@ -88,6 +114,8 @@ class VolumeDriver(object):
         if not FLAGS.volume_group in volume_groups:
             raise exception.Error(_("volume group %s doesn't exist")
                                   % FLAGS.volume_group)
+        # NOTE(agent): resume wiping volumes deleted before a restart
+        self._queue_wipes()
 
     def _create_volume(self, volume_name, sizestr):
         self._try_execute('lvcreate', '-L', sizestr, '-n',
@@ -108,14 +136,79 @@ class VolumeDriver(object):
         return False
 
     def _delete_volume(self, volume, size_in_g):
-        """Deletes a logical volume."""
-        # zero out old volumes to prevent data leaking between users
-        # TODO(ja): reclaiming space should be done lazy and low priority
-        self._copy_volume('/dev/zero', self.local_path(volume), size_in_g)
-        self._try_execute('lvremove', '-f', "%s/%s" %
-                          (FLAGS.volume_group,
-                           self._escape_snapshot(volume['name'])),
+        """Deletes a logical volume.
+
+        The volume is renamed out of the way, and wiped and removed in the
+        background.
+        """
+        volume_name = self._escape_snapshot(volume['name'])
+        self._try_execute('lvrename', FLAGS.volume_group, volume_name,
+                          self.WIPE_PREFIX + volume_name, run_as_root=True)
+        self._queue_wipes()
+
+    def _queue_wipes(self):
+        """Queues wiping the deleted logical volumes not queued yet."""
+        out, err = self._execute('lvs', '--noheadings', '--nosuffix',
+                                 '--units', 'm',
+                                 '-o', 'lv_name,lv_attr,lv_size',
+                                 FLAGS.volume_group, run_as_root=True)
+        for line in (out or '').splitlines():
+            fields = line.split()
+            if (len(fields) != 3 or
+                not fields[0].startswith(self.WIPE_PREFIX) or
+                fields[0] in self._wipes):
+                continue
+            lv_name, attr, size = fields
+            self._wipes.add(lv_name)
+            self._wipe_pool.spawn_n(self._wipe_volume, lv_name,
+                                    int(float(size)), attr[0] in 'sS')
+
+    def _wipe_volume(self, lv_name, size_in_m, is_snapshot):
+        """Wipes a deleted logical volume to prevent data leaking between
+        users, then removes it."""
+        try:
+            if FLAGS.volume_clear != 'none':
+                path = self._mapper_path(lv_name)
+                if is_snapshot:
+                    # NOTE(agent): the data of a snapshot is in its
+                    #              copy-on-write store; writing to the
+                    #              snapshot itself would copy the origin's
+                    #              blocks there first
+                    path += '-cow'
+                self._clear_volume(path, size_in_m)
+            self._try_execute('lvremove', '-f',
+                              "%s/%s" % (FLAGS.volume_group, lv_name),
+                              run_as_root=True)
+            LOG.info(_("Wiped and removed deleted volume %s"), lv_name)
+        except Exception:
+            LOG.exception(_("Failed to wipe deleted volume %s, will retry "
+                            "when another volume is deleted"), lv_name)
+        finally:
+            self._wipes.discard(lv_name)
+
+    def _clear_volume(self, path, size_in_m):
+        """Writes zeros over a volume, no faster than
+        volume_clear_bandwidth."""
+        if FLAGS.volume_clear_size:
+            size_in_m = min(size_in_m, FLAGS.volume_clear_size)
+        cmd = []
+        if FLAGS.volume_clear_ionice:
+            cmd = ['ionice', '-c%d' % FLAGS.volume_clear_ionice]
+        # NOTE(agent): with a bandwidth limit, write a second's worth at a time
+        chunk_in_m = FLAGS.volume_clear_bandwidth or size_in_m
+        offset = 0
+        while offset < size_in_m:
+            count = min(chunk_in_m, size_in_m - offset)
+            start = time.time()
+            self._execute(*(cmd + ['dd', 'if=/dev/zero', 'of=%s' % path,
+                                   'bs=1M', 'count=%d' % count,
+                                   'seek=%d' % offset, 'oflag=direct']),
                           run_as_root=True)
+            offset += count
+            if FLAGS.volume_clear_bandwidth:
+                delay = (start + float(count) / FLAGS.volume_clear_bandwidth
+                         - time.time())
+                greenthread.sleep(max(delay, 0))
 
     def _sizestr(self, size_in_g):
         if int(size_in_g) == 0:
@@ -175,14 +268,15 @@ class VolumeDriver(object):
             # If the snapshot isn't present, then don't attempt to delete
             return True
 
-        # TODO(yamahata): zeroing out the whole snapshot triggers COW.
-        # it's quite slow.
         self._delete_volume(snapshot, snapshot['volume_size'])
 
     def local_path(self, volume):
+        return self._mapper_path(self._escape_snapshot(volume['name']))
+
+    def _mapper_path(self, lv_name):
         # NOTE(vish): stops deprecation warning
         escaped_group = FLAGS.volume_group.replace('-', '--')
-        escaped_name = self._escape_snapshot(volume['name']).replace('-', '--')
+        escaped_name = lv_name.replace('-', '--')
         return "/dev/mapper/%s-%s" % (escaped_group, escaped_name)
 
     def ensure_export(self, context, volume):
@@ -97,6 +97,7 @@ setup(name='nova',
                'bin/nova-network',
                'bin/nova-objectstore',
                'bin/nova-rootwrap',
+               'bin/nova-rootwrap-daemon',
                'bin/nova-scheduler',
                'bin/nova-spoolsentry',
                'bin/stack',